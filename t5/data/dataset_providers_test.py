@@ -16,6 +16,7 @@
 import os
 
 from absl.testing import absltest
+import gin
 import immutabledict
 import seqio
 from seqio import test_utils
@@ -151,6 +152,50 @@ class TasksTest(test_utils.FakeTaskTest):
         output_features=features)
     self.verify_task_matches_fake_datasets("task_no_eos", use_cached=False)
 
+  def test_execution_policy(self):
+    policy = dataset_providers.ExecutionPolicy(
+        deterministic=False,
+        private_threadpool_size=2,
+        max_intra_op_parallelism=1,
+        prefetch_buffer_size=4)
+    _add_t5_task(
+        "t5_fn_task_with_policy",
+        dataset_providers.FunctionTask,
+        splits=("train", "validation"),
+        dataset_fn=test_utils.get_fake_dataset,
+        execution_policy=policy)
+    self.verify_task_matches_fake_datasets(
+        "t5_fn_task_with_policy", use_cached=False)
+
+    ds = TaskRegistry.get("t5_fn_task_with_policy").get_dataset(
+        None, "train", use_cached=False)
+    options = ds.options()
+    self.assertFalse(options.deterministic)
+    self.assertEqual(options.threading.private_threadpool_size, 2)
+    self.assertEqual(options.threading.max_intra_op_parallelism, 1)
+
+  def test_execution_policy_from_gin(self):
+    task = _add_t5_task(
+        "t5_fn_task_gin_policy",
+        dataset_providers.FunctionTask,
+        splits=("train", "validation"),
+        dataset_fn=test_utils.get_fake_dataset)
+    # Bindings parsed after the task is registered apply to its datasets.
+    with gin.unlock_config():
+      gin.parse_config([
+          "ExecutionPolicy.private_threadpool_size = 3",
+          "ExecutionPolicy.shuffle_buffer_size = 7",
+      ])
+    try:
+      with mock.patch.object(
+          tf.data.Dataset, "shuffle", autospec=True,
+          side_effect=lambda ds, buffer_size, **_: ds) as shuffle:
+        ds = task.get_dataset(None, "train", use_cached=False, seed=0)
+      self.assertEqual(shuffle.call_args[0][1], 7)
+      self.assertEqual(ds.options().threading.private_threadpool_size, 3)
+    finally:
+      gin.clear_config()
+
   def test_task_registry_reset(self):
     """Ensure reset() clears seqio.TaskRegistry."""
     _add_t5_task(
@@ -217,6 +217,8 @@ def trivia_qa(dataset):
     This function will return flattend examples of the format:
       {'inputs': 'question: <question> context: <article>'
        'targets': 'answer: <sampled answer>'}
+    with one example for each (context, answer) pair where the answer occurs in
+    the context, ignoring case, after padding punctuation in both.
 
     Args:
       dataset: a tf.data.Dataset to process.
@@ -243,49 +245,55 @@ def trivia_qa(dataset):
         contexts = tf.concat(contexts, 0)
 
         q = _pad_punctuation(x["question"])
-        answers = x["answer"]["normalized_aliases"]
-
-        combination_size = tf.size(answers) * tf.size(contexts)
-        find_answers = tf.TensorArray(tf.bool, size=combination_size, dynamic_size=True)
-        selected_answers = tf.TensorArray(
-            tf.string, size=combination_size, dynamic_size=True
-        )
-        join_q_c = tf.TensorArray(tf.string, size=combination_size, dynamic_size=True)
-
-        def cond_fn(i, find_answers, selected_answers, join_q_c):
-            del find_answers, selected_answers, join_q_c  # Unused
-            return tf.less(i, combination_size)
-
-        def body_fn(i, find_answers, selected_answers, join_q_c):
-            """Find answers from contexts and join."""
-            context_idx = tf.math.floordiv(i, tf.size(answers))
-            answer_idx = tf.math.mod(i, tf.size(answers))
-
-            a = _pad_punctuation(answers[answer_idx])
-            a_ = tf.strings.join([".*", a, ".*"])
-            c = _pad_punctuation(contexts[context_idx])
-            find_a = tf.strings.regex_full_match(
-                tf.strings.lower(c), tf.strings.lower(a_)
+        answers = _pad_punctuation(x["answer"]["normalized_aliases"])
+        contexts = _pad_punctuation(contexts)
+        lower_answers = tf.strings.lower(answers)
+        lower_contexts = tf.strings.lower(contexts)
+        num_contexts = tf.size(contexts)
+
+        def cond_fn(i, found):
+            del found  # Unused
+            return tf.less(i, tf.size(answers))
+
+        def body_fn(i, found):
+            """Finds answer i in all the contexts."""
+            # A context contains the answer iff splitting on it gives 2 parts.
+            found_i = tf.equal(
+                tf.strings.split(
+                    lower_contexts, lower_answers[i], maxsplit=1
+                ).row_lengths(),
+                2,
             )
-            find_answers = find_answers.write(i, find_a)
-            selected_answers = selected_answers.write(i, a)
-
-            join_q_c_str = _string_join(["question:", q, "context:", c])
-            join_q_c = join_q_c.write(i, join_q_c_str)
-            return (i + 1, find_answers, selected_answers, join_q_c)
+            # Like the `.*.*` pattern, an empty answer is found in any context.
+            found_i = tf.logical_or(
+                found_i,
+                tf.fill([num_contexts], tf.equal(tf.strings.length(answers[i]), 0)),
+            )
+            return i + 1, found.write(i, found_i)
 
-        _, find_answers, selected_answers, join_q_c = tf.while_loop(
+        _, found = tf.while_loop(
             cond_fn,
             body_fn,
-            loop_vars=[tf.constant(0), find_answers, selected_answers, join_q_c],
+            loop_vars=[
+                tf.constant(0),
+                tf.TensorArray(
+                    tf.bool,
+                    size=tf.size(answers),
+                    element_shape=tf.TensorShape([None]),
+                    infer_shape=False,
+                ),
+            ],
         )
-        find_answers = find_answers.stack()
-        selected_answers = selected_answers.stack()
-        join_q_c = join_q_c.stack()
-
-        selected_answers = tf.boolean_mask(selected_answers, find_answers)
-        selected_join_q_c = tf.boolean_mask(join_q_c, find_answers)
+        # Order the (context, answer) pairs by context, then by answer.
+        found = tf.transpose(
+            tf.reshape(found.concat(), [tf.size(answers), num_contexts])
+        )
+        matches = tf.where(found)
 
+        selected_answers = tf.gather(answers, matches[:, 1])
+        selected_join_q_c = _string_join(
+            ["question:", q, "context:", tf.gather(contexts, matches[:, 0])]
+        )
         return selected_join_q_c, selected_answers
 
     def my_fn(x):
@@ -1171,6 +1179,60 @@ def neighboring_pairs(dataset, text_key="text", reuse_sentences=True):
     return dataset
 
 
+def neighboring_pairs_batched(
+    dataset, text_key="text", reuse_sentences=True, batch_size=128
+):
+    """Like `neighboring_pairs`, but processes batches of examples at a time.
+
+    The lines and sentences of a batch of examples are split into
+    `tf.RaggedTensor`s, and the pairs of all the lines are formed at once. The
+    outputs are the same as those of `neighboring_pairs`.
+
+    Args:
+      dataset: a tf.data.Dataset
+      text_key: a string, the key for the text feature to preprocess in the
+        dataset examples.
+      reuse_sentences: a boolean
+      batch_size: an integer, the number of examples processed at a time.
+
+    Returns:
+      a tf.data.Dataset
+    """
+
+    def my_fn(text):
+        # Split by lines, removing empty lines.
+        lines = tf.strings.strip(tf.strings.split(text, sep="\n").flat_values)
+        lines = tf.boolean_mask(lines, tf.strings.length(lines) > 0)
+
+        # Get pairs of neighboring sentences.
+        # TODO(mmatena): Use better sentence segmentation.
+        sep = str(uuid.uuid4())
+        sentences = tf.strings.regex_replace(lines, r"((?:\.|\!|\?)+)", r"\1" + sep)
+        sentences = tf.strings.strip(tf.strings.split(sentences, sep))
+        if reuse_sentences:
+            firsts = sentences[:, :-1]
+            seconds = sentences[:, 1:]
+        else:
+            firsts = sentences[:, :-1:2]
+            seconds = sentences[:, 1::2]
+        firsts = firsts.flat_values
+        seconds = seconds.flat_values
+
+        # Remove examples with empty strings.
+        non_empty = (
+            tf.math.minimum(tf.strings.length(firsts), tf.strings.length(seconds)) > 0
+        )
+        return {
+            "first": tf.boolean_mask(firsts, non_empty),
+            "second": tf.boolean_mask(seconds, non_empty),
+        }
+
+    dataset = dataset.map(lambda x: x[text_key], num_parallel_calls=AUTOTUNE)
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.map(my_fn, num_parallel_calls=AUTOTUNE)
+    return dataset.unbatch()
+
+
 @seqio.map_over_dataset
 def glue(x, benchmark_name, label_names, feature_names=None, id_key="idx"):
     """Convert a dataset from glue to text2text examples.
@@ -1388,34 +1450,8 @@ def record(dataset):
       a tf.data.Dataset
     """
 
-    def process_answers(x):
-        """Helper fn to get one example per answer."""
-        ex = x.copy()
-        num_answers = tf.size(ex["answers"])
-
-        def duplicate_along_first_dim(t):
-            n_duplicates = tf.math.maximum(num_answers, 1)
-            return tf.broadcast_to(
-                t, shape=tf.concat([[n_duplicates], tf.shape(t)], axis=0)
-            )
-
-        for k, v in x.items():
-            if k != "idx":
-                ex[k] = duplicate_along_first_dim(v)
-        ex["targets"] = tf.cond(
-            tf.greater(num_answers, 0),
-            lambda: x["answers"],
-            lambda: tf.constant(["<unk>"]),
-        )
-        ex["idx"] = {
-            "passage": duplicate_along_first_dim(x["idx"]["passage"]),
-            "query": duplicate_along_first_dim(x["idx"]["query"]),
-        }
-
-        return ex
-
     def my_fn(x):
-        """Converts the processed example to text2text strings."""
+        """Converts an example to text2text strings, batched per answer."""
         passage = x["passage"]
         passage = tf.strings.regex_replace(
             passage, r"(\.|\?|\!|\"|\')\n@highlight\n", r"\1 "
@@ -1439,16 +1475,29 @@ def record(dataset):
         ex["idx/query"] = x["idx"]["query"]
 
         ex["inputs"] = joined
-        # Note that "answers" has been converted to a single string by the
-        # process_answers function.
-        ex["targets"] = x["targets"]
         # Pass-through full list of answers for eval
         ex["answers"] = x["answers"]
+
+        # Only the formatted features are repeated for each answer, to get
+        # one example per answer after unbatching.
+        num_answers = tf.size(x["answers"])
+
+        def duplicate_along_first_dim(t):
+            n_duplicates = tf.math.maximum(num_answers, 1)
+            return tf.broadcast_to(
+                t, shape=tf.concat([[n_duplicates], tf.shape(t)], axis=0)
+            )
+
+        ex = {k: duplicate_along_first_dim(v) for k, v in ex.items()}
+        ex["targets"] = tf.cond(
+            tf.greater(num_answers, 0),
+            lambda: x["answers"],
+            lambda: tf.constant(["<unk>"]),
+        )
         return ex
 
-    dataset = dataset.map(process_answers, num_parallel_calls=AUTOTUNE)
-    dataset = dataset.unbatch()
-    return dataset.map(my_fn, num_parallel_calls=AUTOTUNE)
+    dataset = dataset.map(my_fn, num_parallel_calls=AUTOTUNE)
+    return dataset.unbatch()
 
 
 def multi_translate(dataset, source_language, target_language):
@@ -1971,6 +2020,7 @@ def rank_classification(
     weight_fn: Optional[Callable[[FeatureType], tf.Tensor]] = None,
     mode: str = "eval",
     passthrough_feature_keys: Optional[Sequence[str]] = None,
+    share_inputs: bool = False,
 ) -> tf.data.Dataset:
     """Prepare dataset for rank classification scoring.
 
@@ -2027,6 +2077,16 @@ def rank_classification(
     since it uses the correct label. With mode set to 'fewshot_eval', it would
     return both examples in a single batch.
 
+    With `share_inputs=True`, the labels of an example must share the same
+    'inputs', which `inputs_fn` may return as a scalar. The preprocessor then
+    returns one example per input example, with the shared scalar 'inputs', an
+    'inputs_group_id' equal to the input example index, the per-label features
+    and the untiled passthrough features, so that the shared inputs are
+    tokenized once. `expand_shared_inputs` must be applied after tokenization,
+    with the desired `mode`, to produce the per-label examples. Each of them
+    keeps the 'inputs_group_id' of its input example, which lets batching encode
+    the shared inputs once.
+
     Args:
       ds: a tf.data.Dataset to preprocess.
       inputs_fn: a callable that returns the 'inputs' features for each label
@@ -2040,9 +2100,12 @@ def rank_classification(
         example(s) based on the label value(s). 'eval' produces an example for
         every possible class value, sequentially. 'fewshot_eval' produces an
         example for every possible class value, batched together for each input
-        example.
+        example. Must be 'eval' with `share_inputs`, whose mode is given to
+        `expand_shared_inputs` instead.
       passthrough_feature_keys: a sequence of feature names that should be passed
         through to the output of this preprocessor. eg: ["starburst", "tokens"]
+      share_inputs: bool, whether to return the labels of each input example as
+        a single example with shared 'inputs', see above.
 
     Returns:
       A tf.data.Dataset containing 'idx', inputs', 'targets', and 'is_correct'.
@@ -2051,18 +2114,35 @@ def rank_classification(
         raise ValueError(
             "Mode must be one of 'train', 'eval', or 'fewshot_eval'. " f"Got '{mode}'."
         )
+    if share_inputs and mode != "eval":
+        raise ValueError(
+            "With share_inputs, the mode must be passed to expand_shared_inputs "
+            f"instead. Got '{mode}'."
+        )
 
     def make_examples(idx, ex):
         inputs = inputs_fn(ex)
         targets = targets_fn(ex)
         is_correct = tf.cast(is_correct_fn(ex), tf.bool)
 
+        # With `share_inputs`, `inputs_fn` may return a single, scalar input.
+        sizes = [tf.size(targets)]
+        if not share_inputs or inputs.shape.rank:
+            sizes.insert(0, tf.size(inputs))
         tf.debugging.assert_equal(
             tf.size(is_correct),
-            [tf.size(inputs), tf.size(targets)],
+            sizes,
             "`inputs_fn`, `targets_fn`, and `is_correct_fn` must return the same "
             "size tensors.",
         )
+        if share_inputs and inputs.shape.rank:
+            tf.debugging.assert_equal(
+                inputs,
+                inputs[0],
+                "With `share_inputs`, `inputs_fn` must return the same inputs "
+                "for every label.",
+            )
+            inputs = inputs[0]
 
         num_out = tf.size(is_correct)
         in_idx = tf.fill([num_out], tf.cast(idx, tf.int32))
@@ -2079,6 +2159,9 @@ def rank_classification(
             output["weight"] = tf.fill(tf.shape(is_correct), weight_fn(ex))
             output["weight"] = tf.cast(output["weight"], tf.float32)
 
+        if share_inputs:
+            output["inputs_group_id"] = tf.cast(idx, tf.int32)
+
         for feature_name in passthrough_feature_keys or []:
             if feature_name in output:
                 raise ValueError(
@@ -2086,6 +2169,10 @@ def rank_classification(
                     "in the preprocessed output. Try renaming it to something else."
                 )
 
+            if share_inputs:
+                # Tiled by `expand_shared_inputs`.
+                output[feature_name] = ex[feature_name]
+                continue
             tiled_shape = tf.concat(
                 [
                     tf.expand_dims(tf.shape(targets)[0], axis=0),
@@ -2101,6 +2188,8 @@ def rank_classification(
 
     ds = ds.enumerate()
     ds = ds.map(make_examples, num_parallel_calls=AUTOTUNE)
+    if share_inputs:
+        return ds
     if mode != "fewshot_eval":
         ds = ds.unbatch()
     if mode == "train":
@@ -2108,6 +2197,61 @@ def rank_classification(
     return ds
 
 
+# Features of `rank_classification(share_inputs=True)` outputs, before and
+# after tokenization, that hold one value per label.
+_RANK_CLASSIFICATION_LABEL_FEATURES = (
+    "idx",
+    "targets",
+    "targets_pretokenized",
+    "is_correct",
+    "weight",
+)
+
+
+def expand_shared_inputs(dataset: tf.data.Dataset, mode: str = "eval"):
+    """Expands `rank_classification(share_inputs=True)` outputs per label.
+
+    Intended to be applied after tokenization, so that the shared inputs of the
+    labels of an example are only tokenized once. The shared features, i.e. the
+    tokenized 'inputs', 'inputs_group_id' and the passthrough features, are
+    tiled for each label.
+
+    Args:
+      dataset: a tf.data.Dataset from `rank_classification` with
+        `share_inputs=True`, usually tokenized.
+      mode: A string, one of 'train', 'eval' or 'fewshot_eval', see
+        `rank_classification`.
+
+    Returns:
+      a tf.data.Dataset like `rank_classification` with `share_inputs=False`
+      would produce, with an additional 'inputs_group_id' feature.
+    """
+    if mode not in ("train", "eval", "fewshot_eval"):
+        raise ValueError(
+            "Mode must be one of 'train', 'eval', or 'fewshot_eval'. " f"Got '{mode}'."
+        )
+
+    def expand(ex):
+        num_out = tf.shape(ex["is_correct"])[0]
+        output = {}
+        for k, v in ex.items():
+            if k in _RANK_CLASSIFICATION_LABEL_FEATURES:
+                output[k] = v
+            else:
+                output[k] = tf.tile(
+                    tf.expand_dims(v, axis=0),
+                    tf.concat([[num_out], tf.ones([v.shape.rank], tf.int32)], 0),
+                )
+        return output
+
+    dataset = dataset.map(expand, num_parallel_calls=AUTOTUNE)
+    if mode != "fewshot_eval":
+        dataset = dataset.unbatch()
+    if mode == "train":
+        dataset = dataset.filter(lambda ex: ex["is_correct"])
+    return dataset
+
+
 def rank_classification_formatter(
     ds: tf.data.Dataset,
     inputs_formats: Union[str, Sequence[str]],
@@ -2115,6 +2259,7 @@ def rank_classification_formatter(
     mode: str = "eval",
     label_key: str = "label",
     weight_key: Optional[str] = None,
+    share_inputs: bool = False,
 ) -> tf.data.Dataset:
     """Create 'inputs' and 'targets' strings for ranking classification.
 
@@ -2193,10 +2338,21 @@ def rank_classification_formatter(
           batched together for each input example.
       label_key: A string, the feature key for the integer label value(s).
       weight_key: A string, the feature key for the float example weight.
+      share_inputs: bool, whether to format a single `inputs_formats` string
+        once per example and return the labels of each example as one example,
+        see `rank_classification`. `expand_shared_inputs` must then be applied
+        after tokenization, with the desired `mode`, and `mode` must be left as
+        'eval' here.
 
     Returns:
       A tf.data.Dataset containing 'idx', inputs', 'targets', and 'is_correct'.
     """
+    if share_inputs and isinstance(inputs_formats, (list, tuple)):
+        raise ValueError(
+            "share_inputs requires a single inputs_formats string, got "
+            f"{inputs_formats}."
+        )
+    shared_inputs_format = inputs_formats
     if isinstance(inputs_formats, (list, tuple)) and isinstance(
         targets_formats, (list, tuple)
     ):
@@ -2253,13 +2409,18 @@ def rank_classification_formatter(
     def _weight_fn(ex):
         return ex[weight_key]
 
+    if share_inputs:
+        inputs_fn = functools.partial(_format_str, fmt=shared_inputs_format)
+    else:
+        inputs_fn = functools.partial(_apply_formats, fmts=inputs_formats)
     return rank_classification(
         ds,
-        inputs_fn=functools.partial(_apply_formats, fmts=inputs_formats),
+        inputs_fn=inputs_fn,
         targets_fn=functools.partial(_apply_formats, fmts=targets_formats),
         is_correct_fn=_is_correct_fn,
         weight_fn=None if weight_key is None else _weight_fn,
         mode=mode,
+        share_inputs=share_inputs,
     )
 
 
@@ -2441,6 +2602,76 @@ def preprocess_tsv(
     Returns:
       A feature dict with 'inputs' and 'targets' features.
     """
+    return _parse_tsv(
+        line,
+        field_delim=field_delim,
+        num_fields=num_fields,
+        inputs_format=inputs_format,
+        targets_format=targets_format,
+        field_names=field_names,
+        use_quote_delim=use_quote_delim,
+    )
+
+
+def preprocess_tsv_batched(
+    dataset,
+    field_delim="\t",
+    num_fields=2,
+    inputs_format="{0}",
+    targets_format="{1}",
+    field_names=None,
+    use_quote_delim=False,
+    batch_size=1024,
+):
+    r"""Like `preprocess_tsv`, but parses and formats lines in batches.
+
+    Lines are batched so that a single `tf.io.decode_csv` call parses, and a
+    single `tf.strings.join` per format formats, `batch_size` lines at a time.
+    The batches are processed in parallel and the outputs are identical to, and
+    in the same order as, those of `preprocess_tsv`.
+
+    Args:
+      dataset: a tf.data.Dataset of comma/tab-delimited strings.
+      field_delim: a string, the delimiter to split on e.g. ',' for csv.
+      num_fields: an integer
+      inputs_format: a string, the desired output format with placeholders for
+        field values.
+      targets_format: a string, the desired output format with placeholders for
+        field values.
+      field_names: a list of strings, the ordered names of the TSV fields.
+        defaults to None (i.e. use field number in *_format)
+      use_quote_delim: If false, treats double quotation marks as regular
+        characters inside of the string fields (ignoring RFC 4180, Section 2,
+        Bullet 5).
+      batch_size: an integer, the number of lines parsed at a time.
+
+    Returns:
+      A tf.data.Dataset of feature dicts with 'inputs' and 'targets' features.
+    """
+    parse_fn = functools.partial(
+        _parse_tsv,
+        field_delim=field_delim,
+        num_fields=num_fields,
+        inputs_format=inputs_format,
+        targets_format=targets_format,
+        field_names=field_names,
+        use_quote_delim=use_quote_delim,
+    )
+    dataset = dataset.batch(batch_size)
+    dataset = dataset.map(parse_fn, num_parallel_calls=AUTOTUNE)
+    return dataset.unbatch()
+
+
+def _parse_tsv(
+    lines,
+    field_delim,
+    num_fields,
+    inputs_format,
+    targets_format,
+    field_names,
+    use_quote_delim,
+):
+    """Parses delimited strings of any shape, see `preprocess_tsv`."""
 
     def _format_part_with_field_numbers(part, field_values):
         found = re.findall(r"{(\d+)}", part)
@@ -2475,7 +2706,7 @@ def preprocess_tsv(
         return tf.strings.join(parts)
 
     field_values = tf.io.decode_csv(
-        line,
+        lines,
         record_defaults=[""]
         * (num_fields if field_names is None else len(field_names)),
         field_delim=field_delim,
@@ -2767,7 +2998,7 @@ def prepend_prompt(
             x[key] = tf.concat([prompt_tokens, x[key]], axis=0)
             return x
 
-        dataset = dataset.map(add_to_inputs)
+        dataset = dataset.map(add_to_inputs, num_parallel_calls=AUTOTUNE)
     return dataset
 
 
@@ -3108,6 +3339,69 @@ def trim_tokens_at_front(x, sequence_length, keys_to_trim=None, **unused_kwargs)
     return x
 
 
+def _find_subsequence(sequence, subsequence):
+    """Returns the first position of `subsequence` in `sequence`, or -1.
+
+    Windows of `sequence` are compared with `subsequence` through two rolling
+    fingerprints computed from cumulative sums, so that memory is O(N) for a
+    sequence of length N. Each token id x is folded to (x * 40503) mod 2^16;
+    the fingerprints of a window are the sum of its folded ids and their sum
+    weighted by offset in the window. Windows with matching fingerprints are
+    then verified in order until the first exact match. The sums fit in int64
+    for sequences of up to 2^23 tokens.
+
+    Args:
+      sequence: 1-D integer Tensor of length N.
+      subsequence: 1-D integer Tensor of length M.
+
+    Returns:
+      a scalar int32 Tensor, -1 if `subsequence` is empty or not found.
+    """
+    n = tf.size(sequence)
+    m = tf.size(subsequence)
+
+    def search():
+        def fold(x):
+            return (tf.cast(x, tf.int64) * 40503) % 65536
+
+        folded = fold(sequence)
+        folded_sub = fold(subsequence)
+        positions = tf.range(n, dtype=tf.int64)
+        sums = tf.concat([[0], tf.cumsum(folded)], 0)
+        weighted_sums = tf.concat([[0], tf.cumsum(folded * positions)], 0)
+        starts = tf.range(n - m + 1, dtype=tf.int64)
+        window_sums = sums[m:] - sums[: n - m + 1]
+        window_weighted_sums = (
+            weighted_sums[m:] - weighted_sums[: n - m + 1] - starts * window_sums
+        )
+        candidates = tf.where(
+            tf.logical_and(
+                tf.equal(window_sums, tf.reduce_sum(folded_sub)),
+                tf.equal(
+                    window_weighted_sums,
+                    tf.reduce_sum(folded_sub * tf.range(m, dtype=tf.int64)),
+                ),
+            )
+        )[:, 0]
+        candidates = tf.cast(candidates, tf.int32)
+
+        def cond(i, start):
+            return tf.logical_and(i < tf.size(candidates), start < 0)
+
+        def body(i, start):
+            del start
+            c = candidates[i]
+            match = tf.reduce_all(tf.equal(sequence[c : c + m], subsequence))
+            return i + 1, tf.where(match, c, -1)
+
+        _, start = tf.while_loop(cond, body, (tf.constant(0), tf.constant(-1)))
+        return start
+
+    return tf.cond(
+        tf.logical_and(m > 0, m <= n), search, lambda: tf.constant(-1)
+    )
+
+
 def trivia_qa_truncate_inputs(dataset, output_features, sequence_length):
     """Token preprocessor for the trivia QA dataset to truncate inputs.
 
@@ -3162,42 +3456,8 @@ def trivia_qa_truncate_inputs(dataset, output_features, sequence_length):
         def truncate_inputs():
             """Helper function to truncate the inputs."""
 
-            def answer_in_context(context, answer):
-                """Helper function that checks if the answer is present in the context.
-
-                Args:
-                  context: Tensor, tokenized representation of the context
-                  answer: Tensor, tokenized representation of the answer
-
-                Returns:
-                  result: boolean, indicates if the answer was present in the context.
-                  pos_mask: boolean mask, a mask for every possible start position of
-                    the answer in the context. Indicates whether the answer starts at
-                    the particular position.
-                """
-                conv_inp = tf.reshape(tf.cast(context, tf.float32), [1, -1, 1])
-                ans_len = tf.shape(answer)[0]
-                filters = tf.eye(ans_len, dtype=tf.float32)
-
-                # Assume context len is N and answer len is M.
-                # Use a convolution to create a matrix of (N-M) x M elements where
-                # each row of the matrix is a sequence of len M. This matrix contains
-                # all possible contiguous sequences of length M from the context.
-                # Every row of this matrix is compared with the answer to check if the
-                # answer exists in the context.
-                strided = tf.nn.conv1d(
-                    conv_inp, tf.reshape(filters, [ans_len, 1, ans_len]), 1, "VALID"
-                )
-                strided = tf.cast(strided[0], answer.dtype)
-                pos_mask = tf.reduce_all(
-                    tf.equal(strided, tf.reshape(answer, [1, -1])), 1
-                )
-                result = tf.reduce_any(pos_mask)
-                return result, pos_mask
-
-            def slice_inputs(inputs, answer_len, pos_mask, seed=None):
+            def slice_inputs(inputs, answer_len, ans_start_pos, seed=None):
                 """Helper function to slice inputs while keeping the answer."""
-                ans_start_pos = tf.cast(tf.where(pos_mask)[0][0], tf.int32)
                 inputs_len = tf.shape(inputs)[0]
                 start_range_min = tf.maximum(
                     0, ans_start_pos - (max_input_tokens - answer_len)
@@ -3215,10 +3475,10 @@ def trivia_qa_truncate_inputs(dataset, output_features, sequence_length):
                 )
                 return inputs[start_pos : start_pos + max_input_tokens]
 
-            result, pos_mask = answer_in_context(inputs, targets)
+            ans_start_pos = _find_subsequence(inputs, targets)
 
-            if result:
-                return slice_inputs(inputs, ans_len, pos_mask, seed=seed)
+            if ans_start_pos >= 0:
+                return slice_inputs(inputs, ans_len, ans_start_pos, seed=seed)
             else:
                 return tf.constant([], dtype=inputs.dtype)
 
@@ -3465,12 +3725,45 @@ def concatenate_and_split_to_fixed_length(
     Returns:
       a tf.data.Dataset
     """
-    dataset = dataset.map(lambda x: {feature_key: x[feature_key]})
     max_tokens = sequence_length[feature_key]
     if output_features[feature_key].add_eos:
         # Leave room to insert an EOS token.
         max_tokens -= 1
-    return dataset.unbatch().batch(max_tokens)
+    spec = dataset.element_spec[feature_key]
+    empty = tf.zeros([0] + spec.shape[1:].as_list(), spec.dtype)
+    # Append an end marker so that the last, partial chunk is emitted.
+    dataset = dataset.map(
+        lambda x: (x[feature_key], False), num_parallel_calls=AUTOTUNE
+    ).concatenate(tf.data.Dataset.from_tensors((empty, True)))
+
+    def split_fn(buffer, inputs):
+        """Emits the full chunks of the buffered tokens as one block."""
+        tokens, is_last = inputs
+        buffer = tf.concat([buffer, tokens], 0)
+        num_tokens = tf.shape(buffer)[0]
+        num_chunks = tf.where(
+            is_last, -(-num_tokens // max_tokens), num_tokens // max_tokens
+        )
+        num_emitted = tf.minimum(num_chunks * max_tokens, num_tokens)
+        # Only the last chunk of the last block can be partial. It is padded
+        # here and trimmed after unbatching.
+        padding = [[0, num_chunks * max_tokens - num_emitted]] + [[0, 0]] * (
+            spec.shape.rank - 1
+        )
+        chunks = tf.reshape(
+            tf.pad(buffer[:num_emitted], padding),
+            tf.concat([[num_chunks, max_tokens], tf.shape(buffer)[1:]], 0),
+        )
+        lengths = tf.minimum(
+            max_tokens, num_emitted - tf.range(num_chunks) * max_tokens
+        )
+        return buffer[num_emitted:], (chunks, lengths)
+
+    dataset = dataset.scan(empty, split_fn).unbatch()
+    return dataset.map(
+        lambda chunk, length: {feature_key: chunk[:length]},
+        num_parallel_calls=AUTOTUNE,
+    )
 
 
 @gin.configurable
@@ -346,6 +346,48 @@ class PreprocessorsTest(tf.test.TestCase):
             'keys'
     }])
 
+  def test_triviaqa_search_results(self):
+    og_dataset = tf.data.Dataset.from_tensors({
+        'question': 'Who wrote it?',
+        'entity_pages': {
+            'wiki_context': ['It was written by J.R.R. Tolkien.', 'No.']
+        },
+        'search_results': {
+            'search_context': ['TOLKIEN wrote it', 'Nobody knows']
+        },
+        'answer': {
+            'normalized_aliases': ['tolkien', 'j.r.r. tolkien', 'lewis'],
+            'normalized_value': 'tolkien'
+        }
+    })
+
+    dataset = prep.trivia_qa(og_dataset)
+    assert_dataset(dataset, [{
+        'inputs': 'question: Who wrote it ? context: It was written by '
+                  'J . R . R . Tolkien . ',
+        'targets': 'tolkien'
+    }, {
+        'inputs': 'question: Who wrote it ? context: It was written by '
+                  'J . R . R . Tolkien . ',
+        'targets': 'j . r . r . tolkien'
+    }, {
+        'inputs': 'question: Who wrote it ? context: TOLKIEN wrote it',
+        'targets': 'tolkien'
+    }])
+
+  def test_triviaqa_no_match(self):
+    og_dataset = tf.data.Dataset.from_tensors({
+        'question': 'What is the answer?',
+        'entity_pages': {
+            'wiki_context': ['The answer is hidden.']
+        },
+        'answer': {
+            'normalized_aliases': ['key'],
+            'normalized_value': 'key'
+        }
+    })
+    self.assertEmpty(list(prep.trivia_qa(og_dataset)))
+
   def test_squad_span_space_tokenized(self):
     answers = ['the answer', 'answer']
     d = tf.data.Dataset.from_tensors(
@@ -623,6 +665,33 @@ class PreprocessorsTest(tf.test.TestCase):
     ref = ' '.join([original] * num_tries)
     self.assertEqual(reconstructed, ref)
 
+  def _assert_same_outputs(self, preprocessor, batched_preprocessor):
+    texts = [
+        'This is a long test with lots of words to see if it works ok.',
+        'one', '', 'two\vwords', '  a  b  ',
+        'x\ty\nz w. Hello there! Ok? yes.\n\nNew line. Another one.',
+        ' '.join(str(i) for i in range(300)),
+    ] * 3
+    dataset = tf.data.Dataset.from_tensor_slices(
+        {'text': texts, 'id': list(range(len(texts)))})
+    with seqio.map_seed_manager(3):
+      expected = list(test_utils.dataset_as_text(preprocessor(dataset)))
+    with seqio.map_seed_manager(3):
+      # The batch size leaves a partial last batch.
+      actual = list(test_utils.dataset_as_text(
+          batched_preprocessor(dataset, batch_size=4)))
+    self.assertNotEmpty(expected)
+    self.assertEqual(actual, expected)
+
+  def test_neighboring_pairs_batched(self):
+    for reuse_sentences in (True, False):
+      self._assert_same_outputs(
+          functools.partial(
+              prep.neighboring_pairs, reuse_sentences=reuse_sentences),
+          functools.partial(
+              prep.neighboring_pairs_batched,
+              reuse_sentences=reuse_sentences))
+
   def test_split_tokens(self):
     original = list(range(2, 102))
     og_dataset = tf.data.Dataset.from_tensors({'targets': original})
@@ -813,6 +882,45 @@ class PreprocessorsTest(tf.test.TestCase):
       # should still correspond.
       self.assertAllEqual(ex['targets'], tf.tile(ex['passthrough'], [5]))
 
+  def test_concatenate_and_split_to_fixed_length(self):
+    lengths = [3, 0, 7, 12, 1, 5]
+    og_dataset = tf.data.Dataset.from_generator(
+        lambda: ({'targets': list(range(10 * i, 10 * i + n)), 'id': i}
+                 for i, n in enumerate(lengths)),
+        output_signature={
+            'targets': tf.TensorSpec([None], tf.int32),
+            'id': tf.TensorSpec([], tf.int32),
+        })
+    for add_eos in (True, False):
+      output_features = {
+          'targets': seqio.Feature(
+              vocabulary=seqio.PassThroughVocabulary(102), add_eos=add_eos)
+      }
+      max_tokens = 4 if add_eos else 5
+      ds = prep.concatenate_and_split_to_fixed_length(
+          og_dataset, sequence_length={'targets': 5},
+          output_features=output_features)
+      # Same as concatenating all tokens and splitting them into chunks.
+      expected = og_dataset.map(lambda x: {'targets': x['targets']})
+      assert_dataset(ds, list(expected.unbatch().batch(max_tokens)))
+
+  def test_concatenate_and_split_to_fixed_length_rank2(self):
+    og_dataset = tf.data.Dataset.from_tensor_slices({
+        'targets': tf.ragged.constant(
+            [[[1, 2], [3, 4], [5, 6]], [[7, 8], [9, 10]]], ragged_rank=1)
+    })
+    ds = prep.concatenate_and_split_to_fixed_length(
+        og_dataset, sequence_length={'targets': 2},
+        output_features={
+            'targets': seqio.Feature(
+                vocabulary=seqio.PassThroughVocabulary(102), add_eos=False)
+        })
+    assert_dataset(ds, [
+        {'targets': [[1, 2], [3, 4]]},
+        {'targets': [[5, 6], [7, 8]]},
+        {'targets': [[9, 10]]},
+    ])
+
   def test_split_tokens_to_targets_length(self):
     original = list(range(2, 102))
     og_dataset = tf.data.Dataset.from_tensors({'targets': original})
@@ -1232,6 +1340,26 @@ class PreprocessorsTest(tf.test.TestCase):
         self.assertContainsSubset(data['targets'], data['inputs'])
         self.assertLen(data['inputs'], 10)
 
+  def test_find_subsequence(self):
+    def find(sequence, subsequence):
+      return int(prep._find_subsequence(
+          tf.constant(sequence, tf.int32), tf.constant(subsequence, tf.int32)))
+
+    self.assertEqual(find([0, 3, 5, 7, 9, 11], [5, 7, 9]), 2)
+    self.assertEqual(find([0, 3, 5, 7, 9, 11], [0, 3]), 0)
+    self.assertEqual(find([0, 3, 5, 7, 9, 11], [9, 11]), 4)
+    # Permutations of the answer have the same unweighted fingerprint.
+    self.assertEqual(find([9, 7, 5, 5, 7, 9], [5, 7, 9]), 3)
+    # The first of several, overlapping occurrences.
+    self.assertEqual(find([1, 1, 1, 1, 2], [1, 1]), 0)
+    self.assertEqual(find([2, 1, 2, 1, 2, 1, 3], [2, 1, 3]), 4)
+    # Ids that are not exactly representable as float32.
+    big = 2**24 + 1
+    self.assertEqual(find([big - 1, big, big + 1], [big]), 1)
+    self.assertEqual(find([0, 3, 5], [3, 6]), -1)
+    self.assertEqual(find([0, 3, 5], [0, 3, 5, 7]), -1)
+    self.assertEqual(find([0, 3, 5], []), -1)
+
   def test_record(self):
     og_dataset = tf.data.Dataset.from_tensors({
         'query': 'It was @placeholder.',
@@ -1706,6 +1834,123 @@ class PreprocessorsTest(tf.test.TestCase):
             },
         ])
 
+  def test_rank_classification_share_inputs(self):
+    def dataset_generator():
+      yield {
+          'context': 'the sky is blue',
+          'options': ['class 0', 'class 1', 'class 2'],
+          'label': 1,
+          'weight': 1.0,
+          'context_allow_pass': 'the sun is out',
+      }
+
+    dataset = tf.data.Dataset.from_generator(
+        dataset_generator,
+        output_signature={
+            'context': tf.TensorSpec(shape=(), dtype=tf.string),
+            'options': tf.TensorSpec(shape=(None,), dtype=tf.string),
+            'label': tf.TensorSpec(shape=(), dtype=tf.int32),
+            'weight': tf.TensorSpec(shape=(), dtype=tf.float32),
+            'context_allow_pass': tf.TensorSpec(shape=(), dtype=tf.string),
+        })
+
+    preprocessor = functools.partial(
+        prep.rank_classification,
+        dataset,
+        inputs_fn=lambda features: features['context'],
+        targets_fn=lambda features: features['options'],
+        is_correct_fn=lambda features: tf.one_hot(features['label'], 3),
+        weight_fn=lambda features: features['weight'],
+        passthrough_feature_keys=['context_allow_pass'],
+        share_inputs=True)
+
+    test_utils.assert_dataset(
+        preprocessor(), [{
+            'idx': [[0, 0], [0, 1], [0, 2]],
+            'inputs': 'the sky is blue',
+            'inputs_group_id': 0,
+            'targets': ['class 0', 'class 1', 'class 2'],
+            'is_correct': [False, True, False],
+            'weight': [1.0, 1.0, 1.0],
+            'context_allow_pass': 'the sun is out',
+        }])
+
+    test_utils.assert_dataset(
+        prep.expand_shared_inputs(preprocessor(), mode='train'), [{
+            'idx': [0, 1],
+            'inputs': 'the sky is blue',
+            'inputs_group_id': 0,
+            'targets': 'class 1',
+            'is_correct': True,
+            'weight': 1.0,
+            'context_allow_pass': 'the sun is out',
+        }])
+
+    test_utils.assert_dataset(
+        prep.expand_shared_inputs(preprocessor(), mode='eval'), [{
+            'idx': [0, i],
+            'inputs': 'the sky is blue',
+            'inputs_group_id': 0,
+            'targets': f'class {i}',
+            'is_correct': i == 1,
+            'weight': 1.0,
+            'context_allow_pass': 'the sun is out',
+        } for i in range(3)])
+
+    test_utils.assert_dataset(
+        prep.expand_shared_inputs(preprocessor(), mode='fewshot_eval'), [{
+            'idx': [[0, 0], [0, 1], [0, 2]],
+            'inputs': ['the sky is blue'] * 3,
+            'inputs_group_id': [0, 0, 0],
+            'targets': ['class 0', 'class 1', 'class 2'],
+            'is_correct': [False, True, False],
+            'weight': [1.0, 1.0, 1.0],
+            'context_allow_pass': ['the sun is out'] * 3,
+        }])
+
+    # The mode is only given to `expand_shared_inputs`.
+    with self.assertRaisesRegex(ValueError, 'expand_shared_inputs'):
+      preprocessor(mode='train')
+
+  def test_rank_classification_share_inputs_tokenized(self):
+    dataset = tf.data.Dataset.from_tensors({
+        'context': 'the sky is blue',
+        'label': 0,
+    })
+    dataset = prep.rank_classification(
+        dataset,
+        inputs_fn=lambda features: tf.fill([2], features['context']),
+        targets_fn=lambda features: tf.constant(['yes', 'no']),
+        is_correct_fn=lambda features: tf.one_hot(features['label'], 2),
+        share_inputs=True)
+    vocab = test_utils.sentencepiece_vocab()
+    output_features = {
+        'inputs': seqio.Feature(vocab, add_eos=False),
+        'targets': seqio.Feature(vocab, add_eos=False),
+    }
+    dataset = seqio.preprocessors.tokenize(dataset, output_features)
+    dataset = prep.expand_shared_inputs(dataset)
+
+    inputs = vocab.encode('the sky is blue')
+    test_utils.assert_dataset(
+        dataset, [{
+            'idx': [0, 0],
+            'inputs': inputs,
+            'inputs_pretokenized': 'the sky is blue',
+            'inputs_group_id': 0,
+            'targets': vocab.encode('yes'),
+            'targets_pretokenized': 'yes',
+            'is_correct': True,
+        }, {
+            'idx': [0, 1],
+            'inputs': inputs,
+            'inputs_pretokenized': 'the sky is blue',
+            'inputs_group_id': 0,
+            'targets': vocab.encode('no'),
+            'targets_pretokenized': 'no',
+            'is_correct': False,
+        }])
+
   def test_rank_classification_errors(self):
     dataset = tf.data.Dataset.from_tensors({
         'left': 'the sky is blue',
@@ -1978,6 +2223,45 @@ class PreprocessorsTest(tf.test.TestCase):
           mode='eval',
           label_key='answerKey')
 
+  def test_rank_classification_formatter_share_inputs(self):
+    input_ds = tf.data.Dataset.from_tensors({
+        'premise': 'The farmland needed irrigation.',
+        'question': 'effect',
+        'choice1': 'a canal was constructed',
+        'choice2': 'the crops grew tall',
+        'label': 0,
+    })
+
+    dataset = prep.rank_classification_formatter(
+        input_ds,
+        inputs_formats='{premise} What is the {question}? X',
+        targets_formats=['I think {choice1}.', 'I think {choice2}.'],
+        share_inputs=True)
+
+    test_utils.assert_dataset(
+        dataset,
+        [
+            {
+                'idx': [[0, 0], [0, 1]],
+                'inputs':
+                    'The farmland needed irrigation. What is the effect? X',
+                'inputs_group_id': 0,
+                'targets': [
+                    'I think a canal was constructed.',
+                    'I think the crops grew tall.',
+                ],
+                'is_correct': [True, False],
+            },
+        ])
+
+    with self.assertRaisesRegex(
+        ValueError, 'share_inputs requires a single inputs_formats string'):
+      prep.rank_classification_formatter(
+          input_ds,
+          inputs_formats=['{premise} {choice1}', '{premise} {choice2}'],
+          targets_formats='{question}',
+          share_inputs=True)
+
   def test_rank_classification_formatter_with_weight(self):
     input_examples = [
         {
@@ -2360,6 +2644,45 @@ class PreprocessorsTest(tf.test.TestCase):
     }
     assert_dataset(dataset, expected)
 
+  def test_preprocess_tsv_batched(self):
+    kwargs = dict(
+        field_delim=',',
+        num_fields=3,
+        inputs_format='numerator: {2} denominator: {1}',
+        targets_format='quotient: {0}')
+    x = tf.data.Dataset.from_tensor_slices(['6,7,42', '2,9,18', '"1",3,3'])
+    expected = list(prep.preprocess_tsv(x, **kwargs).as_numpy_iterator())
+    self.assertEqual(expected[2]['targets'], b'quotient: "1"')
+    assert_dataset(
+        prep.preprocess_tsv_batched(x, batch_size=2, **kwargs), expected)
+
+    kwargs['use_quote_delim'] = True
+    x = tf.data.Dataset.from_tensor_slices(['6,7,42', '2,9,18', '"1,0",3,3'])
+    expected = list(prep.preprocess_tsv(x, **kwargs).as_numpy_iterator())
+    self.assertEqual(expected[2]['targets'], b'quotient: 1,0')
+    assert_dataset(
+        prep.preprocess_tsv_batched(x, batch_size=2, **kwargs), expected)
+
+  def test_preprocess_tsv_batched_with_field_names(self):
+    x = tf.data.Dataset.from_tensor_slices(['6,7,42', '2,9,18'])
+    dataset = prep.preprocess_tsv_batched(
+        x,
+        field_delim=',',
+        field_names=['quot', 'denom', 'numer'],
+        inputs_format='numerator: {numer} denominator: {denom}',
+        targets_format='quotient: {quot}',
+        batch_size=4)
+    assert_dataset(dataset, [
+        {
+            'inputs': 'numerator: 42 denominator: 7',
+            'targets': 'quotient: 6'
+        },
+        {
+            'inputs': 'numerator: 18 denominator: 9',
+            'targets': 'quotient: 2'
+        },
+    ])
+
   # TODO(adarob): Add more than a smoke test.
   def test_span_corruption(self):
     vocab = test_utils.sentencepiece_vocab()
@@ -15,13 +15,21 @@
 """Utility functions for running offline evaluation."""
 
 import collections
+import concurrent.futures
+import functools
 import os
+import sqlite3
+import struct
+import threading
 
 from absl import logging
+from google.protobuf import message
 import numpy as np
 import pandas as pd
 import tensorflow.compat.v1 as tf
-import tensorflow_datasets as tfds
+
+from tensorflow.core.framework import tensor_pb2
+from tensorflow.python.lib.io import tf_record
 
 
 class Metric(object):
@@ -78,39 +86,240 @@ METRIC_NAMES = collections.OrderedDict([
 Event = collections.namedtuple("event", ["step", "value"])
 
 
-def parse_events_files(tb_summary_dir, seqio_summaries=False):
+# TFRecord framing: a little-endian uint64 length and its uint32 masked CRC,
+# the record data, then a uint32 masked CRC of the data.
+_RECORD_HEADER = struct.Struct("<QI")
+_RECORD_FOOTER = struct.Struct("<I")
+
+
+def _crc32c_table():
+  table = []
+  for i in range(256):
+    crc = i
+    for _ in range(8):
+      crc = (crc >> 1) ^ 0x82F63B78 if crc & 1 else crc >> 1
+    table.append(crc)
+  return table
+
+
+_CRC32C_TABLE = _crc32c_table()
+
+
+def _masked_crc32c(data):
+  """Returns the masked CRC32C of `data`, as stored in TFRecord files.
+
+  Only used on the 8-byte length of a record whose read failed; the record
+  data is checked by the TensorFlow record reader.
+  """
+  crc = 0xFFFFFFFF
+  table = _CRC32C_TABLE
+  for b in data:
+    crc = table[(crc ^ b) & 0xFF] ^ (crc >> 8)
+  crc ^= 0xFFFFFFFF
+  return (((crc >> 15) | (crc << 17)) + 0xa282ead8) & 0xFFFFFFFF
+
+
+def _read_records(events_file, offset=0):
+  """Reads the complete TFRecords of `events_file` from byte `offset` on.
+
+  A trailing partial record, e.g. one that is still being written, is not
+  returned so that it can be read once it is complete. A record whose data
+  fails its CRC check is skipped. If the length of a record fails its CRC
+  check, the remaining records cannot be located and are skipped.
+
+  Args:
+    events_file: str, path to a TFRecord file.
+    offset: int, byte offset of the first record to read.
+
+  Returns:
+    A (records, end_offset) tuple, where records is a list of serialized
+    records and end_offset is the byte offset after the last record read.
+  """
+  size = tf.io.gfile.stat(events_file).length
+  reader = tf_record.tf_record_random_reader(events_file)
+  records = []
+  pos = offset
+  while pos + _RECORD_HEADER.size <= size:
+    try:
+      record, end = reader.read(pos)
+    except IndexError:
+      break
+    except tf.errors.DataLossError:
+      # The reader does not tell a corrupted record from a truncated one, so
+      # look at the header of the record to find out which it is.
+      with tf.io.gfile.GFile(events_file, "rb") as f:
+        f.seek(pos)
+        header = f.read(_RECORD_HEADER.size)
+      length, length_crc = _RECORD_HEADER.unpack(header)
+      if _masked_crc32c(header[:8]) != length_crc:
+        logging.warning("Skipping %s from byte %d due to corrupted record.",
+                        events_file, pos)
+        return records, size
+      end = pos + _RECORD_HEADER.size + length + _RECORD_FOOTER.size
+      if end > size:
+        break
+      logging.warning("Skipping corrupted record at byte %d of %s.",
+                      pos, events_file)
+    else:
+      records.append(record)
+    pos = end
+  if pos < size:
+    logging.info("Stopping at truncated record in %s.", events_file)
+  return records, pos
+
+
+def _parse_events_file(events_file, offset=0, seqio_summaries=False):
+  """Parses each event in `events_file` from byte `offset` on exactly once.
+
+  Args:
+    events_file: str, path to an events file.
+    offset: int, byte offset of the first record to parse.
+    seqio_summaries: boolean, whether event summaries are generated by SeqIO
+      Evaluator.
+
+  Returns:
+    A (rows, end_offset) tuple, where rows is a list of (tag, step,
+    simple_value, tensor) tuples. `tensor` is a serialized TensorProto for
+    SeqIO tensor summaries and None otherwise.
+  """
+  records, end_offset = _read_records(events_file, offset)
+  rows = []
+  for record in records:
+    try:
+      e = tf.compat.v1.Event.FromString(record)
+    except message.DecodeError:
+      logging.info("Skipping corrupted record in %s.", events_file)
+      continue
+    for v in e.summary.value:
+      # SeqIO summaries may hold either a tensor or a scalar, so we need to
+      # handle both cases.
+      if seqio_summaries and v.HasField("tensor"):
+        rows.append((v.tag, e.step, None, v.tensor.SerializeToString()))
+      else:
+        rows.append((v.tag, e.step, v.simple_value, None))
+  return rows, end_offset
+
+
+def _rows_to_events(rows, events=None):
+  """Appends (tag, step, simple_value, tensor) rows to an events dict."""
+  events = collections.defaultdict(list) if events is None else events
+  for tag, step, simple_value, tensor in rows:
+    if tensor is not None:
+      value = tf.make_ndarray(tensor_pb2.TensorProto.FromString(tensor))
+    else:
+      value = simple_value
+    events[tag].append(Event(step, value))
+  return events
+
+
+class EventsIndex(object):
+  """A local SQLite sidecar of the events parsed from TensorBoard files.
+
+  For each events file, the index stores the byte offset up to which the file
+  has been parsed along with the (tag, step, value) rows read so far, so that
+  subsequent calls only parse records appended since. Files that shrank, e.g.
+  because they were rewritten, are parsed again from the start.
+
+  The index file must be on a local filesystem, while the events files it
+  indexes may be anywhere `tf.io.gfile` can read. An index may be shared by
+  threads parsing different summary directories.
+  """
+
+  def __init__(self, index_file):
+    self._lock = threading.Lock()
+    self._conn = sqlite3.connect(index_file, check_same_thread=False)
+    with self._conn:
+      self._conn.execute(
+          "CREATE TABLE IF NOT EXISTS files ("
+          "path TEXT, seqio INTEGER, offset INTEGER, "
+          "PRIMARY KEY (path, seqio))")
+      self._conn.execute(
+          "CREATE TABLE IF NOT EXISTS events ("
+          "path TEXT, seqio INTEGER, tag TEXT, step INTEGER, "
+          "simple_value REAL, tensor BLOB)")
+      self._conn.execute(
+          "CREATE INDEX IF NOT EXISTS events_path ON events (path, seqio)")
+
+  def close(self):
+    self._conn.close()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *unused_exc_info):
+    self.close()
+
+  def offset(self, events_file, seqio_summaries):
+    """Returns the byte offset up to which `events_file` has been indexed."""
+    with self._lock:
+      row = self._conn.execute(
+          "SELECT offset FROM files WHERE path = ? AND seqio = ?",
+          (events_file, int(seqio_summaries))).fetchone()
+    return row[0] if row else 0
+
+  def update(self, events_file, seqio_summaries, rows, offset, reset=False):
+    """Appends `rows` parsed from `events_file` and records its new offset."""
+    key = (events_file, int(seqio_summaries))
+    with self._lock, self._conn:
+      if reset:
+        self._conn.execute(
+            "DELETE FROM events WHERE path = ? AND seqio = ?", key)
+      self._conn.executemany(
+          "INSERT INTO events VALUES (?, ?, ?, ?, ?, ?)",
+          (key + row for row in rows))
+      self._conn.execute(
+          "INSERT OR REPLACE INTO files VALUES (?, ?, ?)", key + (offset,))
+
+  def rows(self, events_file, seqio_summaries):
+    """Returns the indexed (tag, step, simple_value, tensor) rows in order."""
+    with self._lock:
+      return self._conn.execute(
+          "SELECT tag, step, simple_value, tensor FROM events "
+          "WHERE path = ? AND seqio = ? ORDER BY rowid",
+          (events_file, int(seqio_summaries))).fetchall()
+
+
+def parse_events_files(tb_summary_dir, seqio_summaries=False, index=None,
+                       num_workers=None):
   """Parse all TensorBoard events files in tb_summary_dir.
 
   Args:
     tb_summary_dir: str, path to look for events files in.
     seqio_summaries: boolean, whether event summaries are generated by SeqIO
       Evaluator.
+    index: an optional EventsIndex. If provided, only records that were not
+      indexed by a previous call are parsed.
+    num_workers: int, number of threads used to parse events files. Defaults
+      to the ThreadPoolExecutor default.
 
   Returns:
     A dict, where each key is a TensorBoard tag and each value is a list of
     Event tuples with step and value attributes.
   """
+  events_files = tf.io.gfile.glob(os.path.join(tb_summary_dir, "events.*"))
+  if index is None:
+    offsets = [0] * len(events_files)
+  else:
+    offsets = [index.offset(f, seqio_summaries) for f in events_files]
+    sizes = [tf.io.gfile.stat(f).length for f in events_files]
+    # A file which is smaller than its indexed offset has been rewritten.
+    resets = [size < offset for size, offset in zip(sizes, offsets)]
+    offsets = [0 if r else o for r, o in zip(resets, offsets)]
+
+  with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as pool:
+    parsed = list(pool.map(
+        functools.partial(_parse_events_file, seqio_summaries=seqio_summaries),
+        events_files, offsets))
+
   events = collections.defaultdict(list)
-  for events_file in tf.io.gfile.glob(os.path.join(tb_summary_dir, "events.*")):
-    try:
-      serialized_events = list(
-          tfds.as_numpy(tf.data.TFRecordDataset(events_file)))[1:]
-      for idx, e in enumerate(tf.train.summary_iterator(events_file)):
-        for v in e.summary.value:
-          if seqio_summaries:
-            event = tf.compat.v1.Event.FromString(
-                serialized_events[idx-1]).summary.value[0]
-            # Need to check if event has a tensor or scalar since we need to
-            # handle both cases.
-            if event.HasField("tensor"):
-              metric_value = tf.make_ndarray(event.tensor)
-            else:
-              metric_value = event.simple_value
-          else:
-            metric_value = v.simple_value
-          events[v.tag].append(Event(e.step, metric_value))
-    except tf.errors.DataLossError:
-      logging.info("Skipping %s due to truncated record.", events_file)
+  for i, (events_file, (rows, end_offset)) in enumerate(
+      zip(events_files, parsed)):
+    if index is not None:
+      if rows or resets[i] or end_offset != offsets[i]:
+        index.update(events_file, seqio_summaries, rows, end_offset,
+                     reset=resets[i])
+      rows = index.rows(events_file, seqio_summaries)
+    _rows_to_events(rows, events)
   return events
 
 
@@ -195,29 +404,26 @@ def scores_to_df(scores, metric_names=None):
           tag)
 
   # Sort the tags in scores according to metric_names order
-  sorted_tags = sorted(
-      scores.keys(), key=lambda x: list(metric_names.keys()).index(x)
-  )
+  tag_rank = {tag: i for i, tag in enumerate(metric_names)}
+  sorted_tags = sorted(scores.keys(), key=tag_rank.__getitem__)
   columns = [metric_names[t].name for t in sorted_tags]
 
-  # Convert scores to dict with the format
-  # {step_number: {tag1: value, tag2: value, ...}}
-  step_scores = collections.defaultdict(
-      lambda: collections.OrderedDict([(t, np.nan) for t in sorted_tags])
-  )
-  for tag in sorted_tags:
-    for step, value in scores[tag]:
-      # If a job gets evicted and restarts from a prior checkpoint, it's
-      # possible that a single step has more than one eval result. In that case,
-      # we pick the max value across all the eval results.
-      if step_scores[step][tag]:
-        step_scores[step][tag] = max(value, step_scores[step][tag])
-      else:
-        step_scores[step][tag] = value
-  sorted_items = sorted(list(step_scores.items()))
-  data = [list(r.values()) for _, r in sorted_items]
-  index = [s for s, _ in sorted_items]
-  df = pd.DataFrame(data, index, columns)
+  # Build a long-format frame with one (step, tag, value) row per event, where
+  # tags are represented by their position in sorted_tags.
+  lengths = [len(scores[t]) for t in sorted_tags]
+  steps = [step for t in sorted_tags for step, _ in scores[t]]
+  values = [value for t in sorted_tags for _, value in scores[t]]
+  long_df = pd.DataFrame({
+      "step": np.array(steps, dtype=np.int64),
+      "tag": np.repeat(np.arange(len(sorted_tags)), lengths),
+      "value": np.array(values, dtype=np.float64),
+  })
+  # If a job gets evicted and restarts from a prior checkpoint, it's possible
+  # that a single step has more than one eval result. In that case, we pick the
+  # max value across all the eval results.
+  df = long_df.groupby(["step", "tag"])["value"].max().unstack("tag")
+  df = df.reindex(columns=range(len(sorted_tags)))
+  df.columns = columns
   df.index.name = "step"
   return df
 
@@ -247,6 +453,41 @@ def metric_group_max(df, metric_names=None):
   return metric_max, metric_max_step
 
 
+def metric_group_max_per_run(df, metric_names=None, level="run"):
+  """Like `metric_group_max`, for each run of a DataFrame indexed by run/step.
+
+  Args:
+    df: pandas.DataFrame with a (run, step) MultiIndex, columns should be
+      metric names.
+    metric_names: dict mapping tensorboard tag to metric name.
+    level: name of the index level that identifies runs.
+  Returns:
+    A (metric_max, metric_max_step) tuple of pandas.DataFrames indexed by run,
+    with the same columns as `df`.
+  """
+  # Use METRIC_NAMES defined at the top as default
+  metric_names = metric_names or METRIC_NAMES
+  group_to_metrics = collections.defaultdict(set)
+  for metric in metric_names.values():
+    group_to_metrics[metric.group].add(metric.name)
+  runs = df.index.unique(level=level)
+  metric_max = pd.DataFrame(index=runs, columns=df.columns, dtype=np.float64)
+  metric_max_step = pd.DataFrame(index=runs, columns=df.columns,
+                                 dtype=np.float64)
+  for metrics in group_to_metrics.values():
+    if not all(m in df for m in metrics):
+      continue
+    metrics = list(metrics)
+    # Need to replace nan with large negative value for idxmax
+    group_mean = df[metrics].mean(axis=1).fillna(-1e9)
+    max_index = group_mean.groupby(level=level).idxmax().reindex(runs)
+    metric_max[metrics] = df.loc[max_index, metrics].to_numpy()
+    metric_max_step[metrics] = np.repeat(
+        max_index.map(lambda idx: idx[-1]).to_numpy()[:, None],
+        len(metrics), axis=1)
+  return metric_max, metric_max_step
+
+
 def log_csv(df, metric_names=None, output_file=None):
   """Log scores to be copy/pasted into a spreadsheet."""
   logging.info(",".join(df.columns))
@@ -16,6 +16,8 @@
 
 import collections
 import os
+import struct
+from unittest import mock
 
 from absl.testing import absltest
 import numpy as np
@@ -74,6 +76,121 @@ class EvalUtilsTest(absltest.TestCase):
         },
     )
 
+  def _write_summaries(self, summary_dir, tags, values, steps):
+    with tf.Graph().as_default():
+      summary_writer = tf.summary.FileWriter(summary_dir)
+      for tag, value, step in zip(tags, values, steps):
+        summary = tf.Summary()
+        summary.value.add(tag=tag, simple_value=value)
+        summary_writer.add_summary(summary, step)
+      summary_writer.close()
+
+  def test_parse_events_files_index(self):
+    tb_summary_dir = self.create_tempdir().full_path
+    index_file = os.path.join(self.create_tempdir().full_path, "index.db")
+    self._write_summaries(
+        tb_summary_dir, ["eval/foo_task/accuracy", "loss"], [1., 3.], [20, 40])
+    with eval_utils.EventsIndex(index_file) as index:
+      events = eval_utils.parse_events_files(tb_summary_dir, index=index)
+    self.assertDictEqual(
+        events, {"eval/foo_task/accuracy": [(20, 1.)], "loss": [(40, 3.)]})
+
+    # Append new records to the indexed file.
+    events_file, = tf.io.gfile.glob(os.path.join(tb_summary_dir, "events.*"))
+    with open(events_file, "rb") as f:
+      indexed_size = len(f.read())
+    new_summary_dir = self.create_tempdir().full_path
+    self._write_summaries(
+        new_summary_dir, ["eval/foo_task/accuracy"], [2.], [30])
+    new_file, = tf.io.gfile.glob(os.path.join(new_summary_dir, "events.*"))
+    with open(new_file, "rb") as f:
+      new_records = f.read()
+    with open(events_file, "ab") as f:
+      f.write(new_records)
+
+    parsed_offsets = []
+    parse_events_file = eval_utils._parse_events_file
+    def _parse_events_file(events_file, offset=0, seqio_summaries=False):
+      parsed_offsets.append(offset)
+      return parse_events_file(events_file, offset, seqio_summaries)
+    with mock.patch.object(
+        eval_utils, "_parse_events_file", _parse_events_file):
+      with eval_utils.EventsIndex(index_file) as index:
+        events = eval_utils.parse_events_files(tb_summary_dir, index=index)
+    self.assertEqual(parsed_offsets, [indexed_size])
+    self.assertDictEqual(
+        events,
+        {
+            "eval/foo_task/accuracy": [(20, 1.), (30, 2.)],
+            "loss": [(40, 3.)],
+        },
+    )
+
+  def test_parse_events_files_truncated(self):
+    tb_summary_dir = self.create_tempdir().full_path
+    index_file = os.path.join(self.create_tempdir().full_path, "index.db")
+    self._write_summaries(
+        tb_summary_dir, ["loss", "loss"], [1., 2.], [10, 20])
+    events_file, = tf.io.gfile.glob(os.path.join(tb_summary_dir, "events.*"))
+    with open(events_file, "rb") as f:
+      records = f.read()
+    # Cut the last record short, as if it was still being written.
+    with open(events_file, "wb") as f:
+      f.write(records[:-5])
+    with eval_utils.EventsIndex(index_file) as index:
+      events = eval_utils.parse_events_files(tb_summary_dir, index=index)
+      self.assertDictEqual(events, {"loss": [(10, 1.)]})
+      with open(events_file, "wb") as f:
+        f.write(records)
+      events = eval_utils.parse_events_files(tb_summary_dir, index=index)
+      self.assertDictEqual(events, {"loss": [(10, 1.), (20, 2.)]})
+
+  def test_parse_events_files_corrupted(self):
+    tb_summary_dir = self.create_tempdir().full_path
+    self._write_summaries(
+        tb_summary_dir, ["loss", "loss", "loss"], [1., 2., 3.], [10, 20, 30])
+    events_file, = tf.io.gfile.glob(os.path.join(tb_summary_dir, "events.*"))
+    with open(events_file, "rb") as f:
+      records = f.read()
+    # The file starts with a file version record, then one record per step.
+    offsets = [0]
+    while offsets[-1] < len(records):
+      length, = struct.unpack_from("<Q", records, offsets[-1])
+      offsets.append(offsets[-1] + length + 16)
+
+    # A record with corrupted data is skipped.
+    corrupted = bytearray(records)
+    corrupted[offsets[3] - 5] ^= 0xFF
+    with open(events_file, "wb") as f:
+      f.write(corrupted)
+    events = eval_utils.parse_events_files(tb_summary_dir)
+    self.assertDictEqual(events, {"loss": [(10, 1.), (30, 3.)]})
+
+    # A record with a corrupted length ends the file.
+    corrupted = bytearray(records)
+    corrupted[offsets[3]] ^= 0xFF
+    with open(events_file, "wb") as f:
+      f.write(corrupted)
+    _, end_offset = eval_utils._read_records(events_file)
+    self.assertEqual(end_offset, len(records))
+    events = eval_utils.parse_events_files(tb_summary_dir)
+    self.assertDictEqual(events, {"loss": [(10, 1.), (20, 2.)]})
+
+  def test_parse_events_files_seqio_index(self):
+    tb_summary_dir = self.create_tempdir()
+    index_file = os.path.join(self.create_tempdir().full_path, "index.db")
+    logger = seqio.TensorBoardLoggerV1(tb_summary_dir.full_path)
+    logger(task_name="foo_task",
+           metrics={"accuracy": seqio.metrics.Scalar(1.)}, step=20,
+           dataset=tf.data.Dataset.range(0), inferences={}, targets=[])
+
+    task_dir = os.path.join(tb_summary_dir.full_path, "foo_task")
+    with eval_utils.EventsIndex(index_file) as index:
+      for _ in range(2):
+        events = eval_utils.parse_events_files(
+            task_dir, seqio_summaries=True, index=index)
+        self.assertDictEqual(events, {"eval/accuracy": [(20, 1.)]})
+
   def test_get_eval_metric_values(self):
     events = {
         "eval/foo_task/accuracy": [(20, 1.), (30, 2.)],
@@ -138,6 +255,28 @@ class EvalUtilsTest(absltest.TestCase):
     df = eval_utils.compute_avg_glue(df)
     self.assertNoCommonElements(df.columns, ["Average GLUE Score"])
 
+  def test_scores_to_df(self):
+    metric_names = collections.OrderedDict([
+        ("metric1", eval_utils.Metric("ABC Accuracy")),
+        ("metric2", eval_utils.Metric("DEF Accuracy", "DEF")),
+    ])
+    scores = {
+        "metric2": [(20, 0.), (10, 4.), (20, -1.)],
+        "metric1": [(10, 1.), (10, 3.), (30, 2.)],
+        "unknown": [(30, 5.)],
+    }
+    df = eval_utils.scores_to_df(scores, metric_names)
+    expected = pd.DataFrame(
+        collections.OrderedDict([
+            ("ABC Accuracy", [3., np.nan, 2.]),
+            ("DEF Accuracy", [4., 0., np.nan]),
+            ("unknown", [np.nan, np.nan, 5.]),
+        ]),
+        index=pd.Index([10, 20, 30], name="step"),
+    )
+    pd.testing.assert_frame_equal(df, expected)
+    self.assertIn("unknown", metric_names)
+
   def test_metric_group_max(self):
     df = pd.DataFrame(
         collections.OrderedDict([
@@ -158,6 +297,44 @@ class EvalUtilsTest(absltest.TestCase):
     self.assertTrue(metric_max_step.keys().equals(df.columns))
     self.assertSequenceEqual(list(metric_max_step.values), [40, 20, 20])
 
+  def test_metric_group_max_per_run(self):
+    metric_names = collections.OrderedDict([
+        ("metric1", eval_utils.Metric("ABC Accuracy")),
+        ("metric2", eval_utils.Metric("DEF Accuracy", "DEF")),
+        ("metric3", eval_utils.Metric("DEF Exact Match", "DEF")),
+    ])
+    run_dfs = {
+        "run1": pd.DataFrame(
+            collections.OrderedDict([
+                ("ABC Accuracy", [1., 2., 3., 4.]),
+                ("DEF Exact Match", [0., 10., 3., 0.]),
+                ("DEF Accuracy", [4., 7., 8., 0.]),
+            ]),
+            index=[10, 20, 30, 40],
+        ),
+        "run2": pd.DataFrame(
+            collections.OrderedDict([
+                ("ABC Accuracy", [5., np.nan]),
+                ("DEF Exact Match", [1., 2.]),
+                ("DEF Accuracy", [1., 1.]),
+            ]),
+            index=[10, 20],
+        ),
+    }
+    df = pd.concat(run_dfs, names=["run", "step"])
+    metric_max, metric_max_step = eval_utils.metric_group_max_per_run(
+        df, metric_names)
+    self.assertListEqual(list(metric_max.index), ["run1", "run2"])
+    self.assertTrue(metric_max.columns.equals(df.columns))
+    self.assertTrue(metric_max_step.columns.equals(df.columns))
+    for run, run_df in run_dfs.items():
+      expected_max, expected_max_step = eval_utils.metric_group_max(
+          run_df, metric_names)
+      self.assertListEqual(
+          list(metric_max.loc[run]), list(expected_max.values))
+      self.assertListEqual(
+          list(metric_max_step.loc[run]), list(expected_max_step.values))
+
   def test_log_csv(self):
     metric_names = list(eval_utils.METRIC_NAMES.values())
     df = pd.DataFrame(
@@ -20,8 +20,14 @@ return a dict of metrics.
 Functions should assume all text inputs are unicode strings.
 """
 
+import abc
 import collections
+import concurrent.futures
+import dataclasses
+import functools
 import itertools
+import multiprocessing
+import os
 import re
 import string
 from typing import Any, Dict, Mapping, Optional, Sequence, Tuple, Union
@@ -29,7 +35,6 @@ from typing import Any, Dict, Mapping, Optional, Sequence, Tuple, Union
 from absl import logging
 import editdistance
 import flax
-import jax.numpy as jnp
 import numpy as np
 import sacrebleu
 import scipy.stats
@@ -39,7 +44,6 @@ from t5.evaluation import qa_utils
 import tensorflow.compat.v2 as tf
 
 from rouge_score import rouge_scorer
-from rouge_score import scoring
 
 
 ModelOutputType = seqio.metrics.ModelOutputType
@@ -80,47 +84,138 @@ def _prepare_summary_rouge(summary):
   return summary
 
 
+# Defaults of `rouge_score.scoring.BootstrapAggregator`.
+_BOOTSTRAP_SAMPLES = 1000
+_BOOTSTRAP_CONFIDENCE_INTERVAL = 0.95
+# Upper bound on the number of gathered scores held in memory at once while
+# bootstrap resampling.
+_BOOTSTRAP_MAX_CHUNK_ELEMENTS = 2**24
+# Number of examples scored per task when a metric runs on a process pool.
+_PARALLEL_CHUNK_SIZE = 1000
+
+
+def _map_chunks(fn, args, items, num_workers=None,
+                chunk_size=_PARALLEL_CHUNK_SIZE):
+  """Applies `fn(*args, chunk)` to consecutive chunks of `items`.
+
+  The chunks are processed on a process pool when there is more than one chunk
+  and more than one worker, and serially otherwise. Workers are spawned rather
+  than forked, since forking a process that has started TensorFlow threads can
+  deadlock.
+
+  Args:
+    fn: a picklable, module-level function returning a list or array.
+    args: tuple of picklable leading arguments passed to `fn`.
+    items: list of items to split into chunks.
+    num_workers: number of worker processes, defaults to the number of CPUs.
+    chunk_size: number of items per chunk.
+
+  Returns:
+    the outputs of `fn` for each chunk, in order.
+  """
+  fn = functools.partial(fn, *args)
+  chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+  num_workers = min(num_workers or os.cpu_count() or 1, len(chunks))
+  if num_workers <= 1:
+    return [fn(chunk) for chunk in chunks]
+  with concurrent.futures.ProcessPoolExecutor(
+      num_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+    return list(executor.map(fn, chunks))
+
+
+def _rouge_fmeasures(score_keys, scorer_kwargs, pairs):
+  """Returns a [len(pairs), len(score_keys)] array of ROUGE F-measures."""
+  scorer = rouge_scorer.RougeScorer(rouge_types=score_keys, **scorer_kwargs)
+  fmeasures = np.zeros((len(pairs), len(score_keys)), np.float64)
+  for i, (target, prediction) in enumerate(pairs):
+    scores = scorer.score(target=_prepare_summary_rouge(target),
+                          prediction=_prepare_summary_rouge(prediction))
+    fmeasures[i] = [scores[key].fmeasure for key in score_keys]
+  return fmeasures
+
+
+def _bootstrap_percentiles(
+    scores,
+    seed=None,
+    n_samples=_BOOTSTRAP_SAMPLES,
+    confidence_interval=_BOOTSTRAP_CONFIDENCE_INTERVAL):
+  """Vectorized, seeded version of `BootstrapAggregator._bootstrap_resample`.
+
+  Args:
+    scores: a 2-d array of (example, measure).
+    seed: seed for the resampling, or None for fresh entropy.
+    n_samples: number of bootstrap samples.
+    confidence_interval: confidence interval to compute on the mean.
+
+  Returns:
+    A 2-d array of (bounds, measure) with the low, mid and high percentiles of
+    the bootstrapped means.
+  """
+  rng = np.random.default_rng(seed)
+  num_examples = scores.shape[0]
+  samples_per_chunk = max(
+      1, _BOOTSTRAP_MAX_CHUNK_ELEMENTS // (num_examples * scores.shape[1]))
+  sample_means = []
+  for start in range(0, n_samples, samples_per_chunk):
+    # Matrix of (bootstrap sample, resampled example index).
+    sample_idx = rng.integers(
+        num_examples, size=(min(samples_per_chunk, n_samples - start),
+                            num_examples))
+    sample_means.append(scores[sample_idx].mean(axis=1))
+  percentile_delta = (1 - confidence_interval) / 2
+  q = 100 * np.array([percentile_delta, 0.5, 1 - percentile_delta])
+  return np.percentile(np.concatenate(sample_means), q, axis=0)
+
+
 def rouge(
     targets,
     predictions,
     score_keys=("rouge1", "rouge2", "rougeLsum"),
+    seed=0,
+    num_workers=1,
     **kwargs,
 ):
-  """Computes rouge score nondeterministically using the bootstrap.
+  """Computes rouge score using the bootstrap.
+
+  The pairs can be scored in chunks on a process pool, and the bootstrap
+  resampling is seeded so results are reproducible. Passing `seed=None`
+  restores the nondeterministic behavior.
 
   Args:
     targets: list of strings
     predictions: list of strings
     score_keys: list of strings with the keys to compute.
+    seed: int or None, seed for the bootstrap resampling.
+    num_workers: number of processes used for scoring, or None for the number
+      of CPUs. Defaults to 1, which scores in the current process.
     **kwargs: additional keyword arguments for RougeScorer.
 
   Returns:
     dict with score_key: rouge score across all targets and predictions
   """
-
-  scorer = rouge_scorer.RougeScorer(rouge_types=score_keys, **kwargs)
-  aggregator = scoring.BootstrapAggregator()
-
-  for prediction, target in zip(predictions, targets):
-    target = _prepare_summary_rouge(target)
-    prediction = _prepare_summary_rouge(prediction)
-    aggregator.add_scores(scorer.score(target=target, prediction=prediction))
-  result = aggregator.aggregate()
-  for key in score_keys:
+  if not predictions:
+    raise ValueError("Predictions and targets must both have nonzero length")
+  score_keys = tuple(score_keys)
+  fmeasures = np.concatenate(
+      _map_chunks(_rouge_fmeasures, (score_keys, kwargs),
+                  list(zip(targets, predictions)), num_workers=num_workers))
+  low, mid, high = _bootstrap_percentiles(fmeasures, seed=seed)
+  for i, key in enumerate(score_keys):
     logging.info(
         "%s = %.2f, 95%% confidence [%.2f, %.2f]",
         key,
-        result[key].mid.fmeasure*100,
-        result[key].low.fmeasure*100,
-        result[key].high.fmeasure*100,
+        mid[i]*100,
+        low[i]*100,
+        high[i]*100,
     )
-  return {key: result[key].mid.fmeasure*100 for key in score_keys}
+  return {key: mid[i]*100 for i, key in enumerate(score_keys)}
 
 
 def rouge_mean(
     targets,
     predictions,
     score_keys=("rouge1", "rouge2", "rougeLsum"),
+    num_workers=1,
     **kwargs,
 ):
   """Computes rouge score deterministically (no bootstrap).
@@ -129,26 +224,21 @@ def rouge_mean(
     targets: list of strings
     predictions: list of strings
     score_keys: list of strings with the keys to compute
+    num_workers: number of processes used for scoring, or None for the number
+      of CPUs. Defaults to 1, which scores in the current process.
     **kwargs: additional keyword arguments for RougeScorer.
 
   Returns:
     dict with score_key: rouge score across all targets and predictions
   """
-
-  scorer = rouge_scorer.RougeScorer(rouge_types=score_keys, **kwargs)
-  count = 0
-  sum_scores = collections.defaultdict(float)
-  for prediction, target in zip(predictions, targets):
-    target = _prepare_summary_rouge(target)
-    prediction = _prepare_summary_rouge(prediction)
-    scores = scorer.score(target=target, prediction=prediction)
-    count += 1
-    for k, v in scores.items():
-      sum_scores[k] += v.fmeasure
-  if count == 0:
+  if not predictions:
     raise ValueError("Predictions and targets must both have nonzero length")
-  result = {k: v / count for k, v in sum_scores.items()}
-  return {key: result[key] * 100 for key in score_keys}
+  score_keys = tuple(score_keys)
+  fmeasures = np.concatenate(
+      _map_chunks(_rouge_fmeasures, (score_keys, kwargs),
+                  list(zip(targets, predictions)), num_workers=num_workers))
+  result = fmeasures.sum(axis=0) / len(fmeasures)
+  return {key: result[i] * 100 for i, key in enumerate(score_keys)}
 
 
 def span_squad(targets, predictions):
@@ -554,35 +644,31 @@ def rank_classification(
     raise ValueError(
         f"`targets` should contain 4 elements but has {len(targets[0])}.")
 
-  normalized_scores = []
-  if normalize_by_target_length:
-    for target, score in zip(targets, scores):
-      _, _, _, target_length = target
-      score = score / target_length
-      normalized_scores.append(score)
-
-    scores = normalized_scores
-
   idx_0 = targets[0][0]
   if not hasattr(idx_0, "__len__") or len(idx_0) != idx_len:
     raise ValueError("The first element of `targets` ('idx') should be "
                      f"{idx_len}-dimensional. Got {idx_0}.")
 
-  # Sort by 'idx' since the function relies on this assumption.
-  # ((idx, is_correct, weight, target_length), score)
-  get_idx = lambda x: x[0][0]
-  targets, scores = zip(*sorted(zip(targets, scores), key=get_idx))
-
-  def all_unique(indices):
-    seen = set()
-    for idx in indices:
-      if idx in seen:
-        return False
-      seen.add(idx)
-    return True
-
-  indices = (t[0] for t in targets)
-  if not all_unique(indices):
+  indices = np.array([t[0] for t in targets])
+  is_correct = np.array([t[1] for t in targets])
+  weights = np.array([t[2] for t in targets])
+  scores = np.asarray(scores)
+  if not np.issubdtype(scores.dtype, np.floating):
+    scores = scores.astype(np.float64)
+  if normalize_by_target_length:
+    target_lengths = np.array([t[3] for t in targets])
+    scores = scores / target_lengths.astype(scores.dtype)
+
+  # Sort by 'idx' since the function relies on this assumption. `np.lexsort`
+  # uses its last key as the primary one.
+  order = np.lexsort(indices.T[::-1])
+  indices = indices[order]
+  is_correct = is_correct[order]
+  weights = weights[order]
+  scores = scores[order]
+
+  # Duplicates are adjacent once sorted.
+  if np.any(np.all(indices[1:] == indices[:-1], axis=-1)):
     err_msg = (
         "rank_classification metric function received targets list with"
         " non-unique indices. There's no way to distinguish the items, so the"
@@ -595,26 +681,26 @@ def rank_classification(
 
   if not num_classes:
     # Assuming variable classes. Can only compute accuracy.
-    num_correct = 0
-    total = 0
-
-    # (((input idx, output idx), is_correct, weight, target_length), score)
-    get_grp = lambda x: x[0][0][0]
-
-    for _, grp in itertools.groupby(zip(targets, scores), get_grp):
-      exs, log_likelihoods = zip(*grp)
-      prediction = np.argmax(log_likelihoods)
-      weights = exs[prediction][2]
-      num_correct += exs[prediction][1] * weights
-      total += weights
+    # Each run of equal input indices is one example, and the prediction is
+    # the first candidate of the run with the highest score (as `np.argmax`).
+    starts = np.flatnonzero(
+        np.concatenate([[True], indices[1:, 0] != indices[:-1, 0]]))
+    group_max = np.repeat(np.maximum.reduceat(scores, starts),
+                          np.diff(np.append(starts, len(scores))))
+    is_max = (scores == group_max) | (np.isnan(scores) & np.isnan(group_max))
+    positions = np.where(is_max, np.arange(len(scores)), len(scores))
+    predictions = np.minimum.reduceat(positions, starts)
+
+    weights = weights[predictions]
+    # Cumulative sums add in order, matching a running Python sum exactly.
+    num_correct = np.cumsum(is_correct[predictions] * weights)[-1]
+    total = np.cumsum(weights)[-1]
     return {"accuracy": 100 * num_correct / total}
 
   assert len(targets) % num_classes == 0, f"{len(targets)} % {num_classes} != 0"
 
-  labels_indicator = np.array([is_correct for _, is_correct, _, _ in targets
-                              ]).reshape((-1, num_classes))
-  weights = np.array([weight for _, _, weight, _ in targets]).reshape(
-      (-1, num_classes))[:, 0]
+  labels_indicator = is_correct.reshape((-1, num_classes))
+  weights = weights.reshape((-1, num_classes))[:, 0]
   log_likelihoods = np.array(scores, np.float32).reshape((-1, num_classes))
   predictions = log_likelihoods.argmax(-1)
 
@@ -673,6 +759,11 @@ def rank_classification(
   return metrics
 
 
+_COQA_ARTICLES_RE = re.compile(r"\b(a|an|the)\b", re.UNICODE)
+_COQA_PUNCTUATION_TABLE = str.maketrans("", "", string.punctuation)
+_NON_WORD_RE = re.compile("[^\\w]")
+
+
 def _coqa_tokenize(inp: str) -> Sequence[str]:
   """Normalize English text and tokenize into words based on spaces.
 
@@ -685,19 +776,8 @@ def _coqa_tokenize(inp: str) -> Sequence[str]:
   Returns:
     Tokenization of normalized text as List[str]
   """
-
-  def remove_articles(text):
-    regex = re.compile(r"\b(a|an|the)\b", re.UNICODE)
-    return re.sub(regex, " ", text)
-
-  def normalize_whitespace(text):
-    return " ".join(text.split())
-
-  def remove_punc(text):
-    exclude = set(string.punctuation)
-    return "".join(ch for ch in text if ch not in exclude)
-
-  return normalize_whitespace(remove_articles(remove_punc(inp.lower()))).split()
+  text = inp.lower().translate(_COQA_PUNCTUATION_TABLE)
+  return _COQA_ARTICLES_RE.sub(" ", text).split()
 
 
 def _sequence_f1(target_tokens: Sequence[str],
@@ -707,10 +787,13 @@ def _sequence_f1(target_tokens: Sequence[str],
   if not (target_tokens or prediction_tokens):
     return int(target_tokens == prediction_tokens)
 
-  common_token_counts = (
-      collections.Counter(target_tokens) &
-      collections.Counter(prediction_tokens))
-  sum_common = sum(common_token_counts.values())
+  # Size of the multiset intersection of the tokens.
+  target_token_counts = collections.Counter(target_tokens)
+  sum_common = 0
+  for token in prediction_tokens:
+    if target_token_counts[token] > 0:
+      target_token_counts[token] -= 1
+      sum_common += 1
   if sum_common == 0:
     return 0
 
@@ -721,53 +804,142 @@ def _sequence_f1(target_tokens: Sequence[str],
 
 
 def coqa_f1(
-    targets: Sequence[Sequence[str]], predictions: Sequence[str]
+    targets: Sequence[Sequence[str]],
+    predictions: Sequence[str],
+    num_workers: Optional[int] = 1,
 ) -> Mapping[str, float]:
-  """Return mean sequence F1 score over all QA turns."""
+  """Return mean sequence F1 score over all QA turns.
+
+  Args:
+    targets: list of lists of acceptable answers for each turn.
+    predictions: list of strings
+    num_workers: number of processes used for scoring, or None for the number
+      of CPUs. Defaults to 1, which scores in the current process.
+
+  Returns:
+    dict with the mean F1 score.
+  """
+  f1s = _coqa_f1s(targets, predictions, num_workers=num_workers)
+  return {"f1": np.mean(np.array(f1s)) * 100}
+
+
+def _coqa_f1_chunk(
+    examples: Sequence[Tuple[Sequence[str], str]]) -> Sequence[float]:
+  """Returns the sequence F1 of (targets, prediction) pairs."""
   f1s = []
-  for (target, p) in zip(targets, predictions):
+  for target, prediction in examples:
     assert isinstance(target, Sequence)
-    prediction_tokens = _coqa_tokenize(p)
-    example_f1s = [
-        _sequence_f1(_coqa_tokenize(t), prediction_tokens) for t in target
-    ]
-    f1s.append(max(example_f1s))
-  return {"f1": np.mean(np.array(f1s)) * 100}
+    prediction_tokens = _coqa_tokenize(prediction)
+    f1s.append(max(_sequence_f1(_coqa_tokenize(t), prediction_tokens)
+                   for t in target))
+  return f1s
+
+
+def _coqa_f1s(
+    targets: Sequence[Sequence[str]],
+    predictions: Sequence[str],
+    num_workers: Optional[int] = None,
+) -> Sequence[float]:
+  """Returns the sequence F1 of each QA turn, maximized over its targets."""
+  return list(itertools.chain.from_iterable(_map_chunks(
+      _coqa_f1_chunk, (), list(zip(targets, predictions)),
+      num_workers=num_workers)))
+
 
+def edit_distance(targets, predictions, lower=True, num_workers=1):
+  """Word-level edit distance between targets and predictions.
 
-def edit_distance(targets, predictions, lower=True):
-  """Word-level edit distance between targets and predictions."""
+  Args:
+    targets: list of strings
+    predictions: list of strings
+    lower: bool, whether to lowercase targets and predictions first.
+    num_workers: number of processes used for scoring, or None for the number
+      of CPUs. Defaults to 1, which scores in the current process.
+
+  Returns:
+    dict with the min, max, mean, median and sum of the edit distances.
+  """
+  edit_distances = _edit_distances(
+      targets, predictions, lower=lower, num_workers=num_workers)
+  return {"min_edit": min(edit_distances),
+          "max_edit": max(edit_distances),
+          "mean_edit": np.mean(edit_distances),
+          "median_edit": np.median(edit_distances),
+          "sum_edit": sum(edit_distances)}
+
+
+def _edit_distance_chunk(lower, pairs):
+  """Returns the word-level edit distance of (target, prediction) pairs."""
   edit_distances = []
-  for pred, target in zip(predictions, targets):
+  for target, pred in pairs:
     if lower:
       pred = pred.lower()
       target = target.lower()
 
     # For simplicity, use regex-based tokenization that treats each
     # contiguous chunk of characters matched by \w as a word.
-    pred = re.split("[^\\w]", pred)
-    target = re.split("[^\\w]", target)
-    edit_distances.append(editdistance.distance(pred, target))
+    edit_distances.append(editdistance.distance(
+        _NON_WORD_RE.split(pred), _NON_WORD_RE.split(target)))
+  return edit_distances
 
-  return {"min_edit": min(edit_distances),
-          "max_edit": max(edit_distances),
-          "mean_edit": np.mean(edit_distances),
-          "median_edit": np.median(edit_distances),
-          "sum_edit": sum(edit_distances)}
+
+def _edit_distances(targets, predictions, lower=True, num_workers=None):
+  """Returns the word-level edit distance of each target/prediction pair."""
+  return list(itertools.chain.from_iterable(_map_chunks(
+      _edit_distance_chunk, (lower,), list(zip(targets, predictions)),
+      num_workers=num_workers)))
+
+
+def _decode_predictions(
+    vocab: seqio.Vocabulary,
+    model_output: np.ndarray,
+    mask: np.ndarray,
+) -> Sequence[str]:
+  """Decodes the rows of `model_output` selected by the boolean `mask`.
+
+  Rows are decoded one at a time with `vocab.decode`, as in
+  `seqio.metrics.LegacyMetric`; a single `vocab.decode_tf` call over the batch
+  gives the same strings but is slower for SentencePiece vocabularies.
+  """
+  return [vocab.decode(tokens) for tokens in np.asarray(model_output)[mask]]
+
+
+def _included_mask(model_output: np.ndarray,
+                   mask: Optional[np.ndarray]) -> np.ndarray:
+  if mask is None:
+    return np.ones((len(model_output),), dtype=bool)
+  return np.asarray(mask, dtype=bool)
 
 
 @flax.struct.dataclass
 class ShardedSquad(seqio.metrics.Metric):
-  """Implements SQuAD metrics, maximizing over answers per question."""
+  """Implements SQuAD metrics, maximizing over answers per question.
 
-  f1: float = 0.0
-  em: float = 0.0
+  Accumulates the sums of the per-example EM and F1 scores and the number of
+  examples, so merging any number of shards is exact up to float64 addition.
+  The `f1` and `em` fields of earlier versions, which held running averages,
+  are replaced by `f1_sum` and `em_sum`; the averages remain readable through
+  the `f1` and `em` properties.
+  """
+
+  f1_sum: float = 0.0
+  em_sum: float = 0.0
   count: int = 0
   model_output_type: ModelOutputType = ModelOutputType.PREDICTION
 
+  @property
+  def f1(self) -> float:
+    """The average F1 score in percent, or NaN without examples."""
+    return self.compute()["f1"]
+
+  @property
+  def em(self) -> float:
+    """The average exact match score in percent, or NaN without examples."""
+    return self.compute()["em"]
+
   @classmethod
   def empty(cls) -> "ShardedSquad":
-    return cls(f1=0.0, em=0.0, count=0)
+    return cls(f1_sum=0.0, em_sum=0.0, count=0)
 
   @classmethod
   def from_model_output(
@@ -780,42 +952,458 @@ class ShardedSquad(seqio.metrics.Metric):
       indices_2d: Optional[np.ndarray] = None) -> "ShardedSquad":
 
     del indices_2d
-    if mask is None:
-      mask = jnp.ones((len(inputs),))
+    mask = _included_mask(model_output, mask)
 
     # Postprocesses the targets here.
-    postprocessed_targets = [[
-        tf.compat.as_text(answers) for answers in example["answers"]
+    targets = [[
+        qa_utils.normalize_squad(tf.compat.as_text(answers))
+        for answers in example["answers"]
     ] for example, included in zip(inputs, mask) if included]
 
     # Decodes the predictions here.
     vocab = features[target_field_name].vocabulary
     predictions = [
-        vocab.decode(tokens)
-        for tokens, included in zip(model_output, mask)
-        if included
+        qa_utils.normalize_squad(p)
+        for p in _decode_predictions(vocab, model_output, mask)
     ]
 
-    squad_result = squad(targets=postprocessed_targets, predictions=predictions)
-    return cls(f1=squad_result["f1"], em=squad_result["em"], count=mask.sum())
+    sums = qa_utils.qa_metric_sums(targets, predictions)
+    return cls(f1_sum=sums["f1"], em_sum=sums["em"], count=len(predictions))
 
   def merge(self, other: "ShardedSquad") -> "ShardedSquad":
     """Returns `Squad` that is the accumulation of `self` and `other`.
 
     Args:
       other: A `Squad` whose inermediate values should be accumulated onto the
-        values of `self`. Note that in a distributed setting, `other` will
-        typically be the output of a `jax.lax` parallel operator and thus have a
-        dimension added to the dataclass returned by `.from_model_output()`.
+        values of `self`. In a distributed setting, `other` will typically be
+        the output of a `jax.lax` parallel operator and thus have a dimension
+        added to the dataclass returned by `.from_model_output()`; the sums
+        and counts of all its shards are added at once.
 
     Returns:
       A new `Squad` that accumulates the value from both `self` and `other`.
     """
-    count = self.count + other.count
-    f1 = (self.f1 * self.count + other.f1 * other.count)/count
-    em = (self.em * self.count + other.em * other.count)/count
+    def add(x, y):
+      return np.sum(x, dtype=np.float64) + np.sum(y, dtype=np.float64)
+
+    return type(self)(
+        f1_sum=add(self.f1_sum, other.f1_sum),
+        em_sum=add(self.em_sum, other.em_sum),
+        count=int(np.sum(self.count) + np.sum(other.count)))
+
+  def reduce(self) -> "ShardedSquad":
+    """Merges the shards stacked along the first axis into a single one."""
+    return self.empty().merge(self)
+
+  def compute(self):
+    if not self.count:
+      return {"f1": float("nan"), "em": float("nan")}
+    return {"f1": 100 * float(self.f1_sum) / self.count,
+            "em": 100 * float(self.em_sum) / self.count}
+
+
+def _postprocessed_targets_and_predictions(
+    inputs: Sequence[Mapping[str, Any]],
+    model_output: np.ndarray,
+    features: Mapping[str, seqio.Feature],
+    target_field_name: str = "targets",
+    mask: Optional[np.ndarray] = None,
+    postprocess_fn: Optional[Any] = None,
+) -> Tuple[Sequence[Any], Sequence[Any]]:
+  """Decodes and postprocesses the targets and predictions of a batch.
+
+  Mirrors the target and prediction handling of `seqio.metrics.LegacyMetric`,
+  restricted to the examples selected by `mask`.
+
+  Args:
+    inputs: examples in the batch.
+    model_output: 2d array of predicted token ids, one row per example.
+    features: output features of the task.
+    target_field_name: field name of the target sequence.
+    mask: optional boolean array indicating which examples are included.
+    postprocess_fn: optional function applied to each decoded target and
+      prediction with `example` and `is_target` keyword arguments.
+
+  Returns:
+    a (targets, predictions) tuple of lists.
+  """
+  mask = _included_mask(model_output, mask)
+  vocab = features[target_field_name].vocabulary
+  pretokenized_target_field_name = target_field_name + "_pretokenized"
+  examples = [
+      example for example, included in zip(inputs, mask) if included]
+
+  targets = []
+  predictions = []
+  for example, prediction in zip(
+      examples, _decode_predictions(vocab, model_output, mask)):
+    if pretokenized_target_field_name in example:
+      target = example[pretokenized_target_field_name]
+    else:
+      target = vocab.decode(list(example[target_field_name]))
+    target = tf.compat.as_text(target)
+    if postprocess_fn is not None:
+      target = postprocess_fn(target, example=example, is_target=True)
+      prediction = postprocess_fn(prediction, example=example, is_target=False)
+    targets.append(target)
+    predictions.append(prediction)
+  return targets, predictions
+
+
+@flax.struct.dataclass
+class _ShardedMetric(seqio.metrics.Metric, metaclass=abc.ABCMeta):
+  """Base class for metrics accumulating mergeable sufficient statistics.
+
+  Subclasses hold only fixed-size statistics (counts, sums, confusion matrices
+  or histograms) so that evaluation can be split across batches or hosts and
+  the partial results combined with `merge` before calling `compute`. Options
+  are static fields set through `empty`, e.g.
+  `ShardedBleu.empty(tokenizer="13a")`, and the configured instance is passed
+  to `seqio.Task` as one of its `metric_objs`.
+  """
+
+  model_output_type: ModelOutputType = flax.struct.field(
+      pytree_node=False, default=ModelOutputType.PREDICTION)
+  postprocess_fn: Optional[Any] = flax.struct.field(
+      pytree_node=False, default=None)
+
+  def from_model_output(  # pytype: disable=signature-mismatch
+      self,
+      inputs: Sequence[Mapping[str, Any]],
+      model_output: np.ndarray,
+      features: Mapping[str, seqio.Feature],
+      target_field_name: str = "targets",
+      mask: Optional[np.ndarray] = None,
+      indices_2d: Optional[np.ndarray] = None) -> "_ShardedMetric":
+    del indices_2d
+    targets, predictions = _postprocessed_targets_and_predictions(
+        inputs, model_output, features, target_field_name, mask,
+        self.postprocess_fn)
+    return self.from_targets_and_predictions(targets, predictions)
+
+  @abc.abstractmethod
+  def from_targets_and_predictions(
+      self, targets: Sequence[Any], predictions: Sequence[Any]
+  ) -> "_ShardedMetric":
+    """Returns the statistics of a batch of postprocessed examples."""
+    raise NotImplementedError
+
+
+@flax.struct.dataclass
+class ShardedAccuracy(_ShardedMetric):
+  """Mergeable version of `accuracy`."""
+
+  num_correct: int = 0
+  count: int = 0
+
+  @classmethod
+  def empty(cls, **kwargs) -> "ShardedAccuracy":
+    return cls(**kwargs)
+
+  def from_targets_and_predictions(self, targets, predictions):
+    assert len(targets) == len(predictions)
+    return self.replace(
+        num_correct=sum(int(t == p) for t, p in zip(targets, predictions)),
+        count=len(targets))
+
+  def merge(self, other: "ShardedAccuracy") -> "ShardedAccuracy":
+    return self.replace(num_correct=self.num_correct + other.num_correct,
+                        count=self.count + other.count)
+
+  def compute(self):
+    if not self.count:
+      return {"accuracy": float("nan")}
+    return {"accuracy": 100 * self.num_correct / self.count}
+
+
+@flax.struct.dataclass
+class ShardedSequenceAccuracy(ShardedAccuracy):
+  """Mergeable version of `sequence_accuracy`."""
+
+  def compute(self):
+    if not self.count:
+      return {"sequence_accuracy": float("nan")}
+    return {"sequence_accuracy": 100 * self.num_correct / self.count}
+
+
+@flax.struct.dataclass
+class ShardedBleu(_ShardedMetric):
+  """Mergeable version of `bleu`.
+
+  Accumulates the hypothesis and reference lengths and the matching and total
+  n-gram counts for n = 1..4, from which sacrebleu computes the corpus score.
+  As with `bleu`, `targets` is either a list with one reference per
+  prediction or a list of reference streams, each of which has one reference
+  per prediction.
+  """
+
+  count: int = 0
+  sys_len: int = 0
+  ref_len: int = 0
+  correct: np.ndarray = flax.struct.field(
+      default_factory=lambda: np.zeros((4,), np.int64))
+  total: np.ndarray = flax.struct.field(
+      default_factory=lambda: np.zeros((4,), np.int64))
+  tokenizer: str = flax.struct.field(pytree_node=False, default="intl")
+
+  @classmethod
+  def empty(cls, **kwargs) -> "ShardedBleu":
+    return cls(**kwargs)
+
+  def from_targets_and_predictions(self, targets, predictions):
+    if not predictions:
+      return self.replace()
+    if isinstance(targets[0], list):
+      references = [[x for x in target] for target in targets]
+      if any(len(refs) != len(predictions) for refs in references):
+        raise ValueError(
+            "Every example must have the same number of references; got "
+            f"reference streams of lengths {[len(r) for r in references]} "
+            f"for {len(predictions)} predictions.")
+    else:
+      assert len(targets) == len(predictions)
+      references = [targets]
+    bleu_score = sacrebleu.BLEU(
+        lowercase=False,
+        force=False,
+        tokenize=self.tokenizer,
+        smooth_method="exp",
+        smooth_value=0.0,
+        effective_order=False).corpus_score(predictions, references)
+    return self.replace(
+        count=len(predictions),
+        sys_len=bleu_score.sys_len,
+        ref_len=bleu_score.ref_len,
+        correct=np.array(bleu_score.counts, np.int64),
+        total=np.array(bleu_score.totals, np.int64))
+
+  def merge(self, other: "ShardedBleu") -> "ShardedBleu":
+    return self.replace(count=self.count + other.count,
+                        sys_len=self.sys_len + other.sys_len,
+                        ref_len=self.ref_len + other.ref_len,
+                        correct=self.correct + other.correct,
+                        total=self.total + other.total)
+
+  def compute(self):
+    if not self.count:
+      return {"bleu": float("nan")}
+    bleu_score = sacrebleu.BLEU.compute_bleu(
+        correct=[int(c) for c in self.correct],
+        total=[int(t) for t in self.total],
+        sys_len=int(self.sys_len),
+        ref_len=int(self.ref_len),
+        smooth_method="exp",
+        smooth_value=0.0,
+        effective_order=False)
+    return {"bleu": bleu_score.score}
+
+
+@flax.struct.dataclass
+class ShardedRougeMean(_ShardedMetric):
+  """Mergeable version of `rouge_mean`.
+
+  Accumulates the sum of the per-example F-measure of each score key. Like
+  with `rouge_mean`, keyword arguments of `empty` that are not fields of the
+  metric, e.g. `use_stemmer`, are passed to `RougeScorer`.
+  """
+
+  sum_scores: np.ndarray = flax.struct.field(
+      default_factory=lambda: np.zeros((3,), np.float64))
+  count: int = 0
+  score_keys: Tuple[str, ...] = flax.struct.field(
+      pytree_node=False, default=("rouge1", "rouge2", "rougeLsum"))
+  # Sorted (name, value) pairs, so that the field is hashable.
+  scorer_kwargs: Tuple[Tuple[str, Any], ...] = flax.struct.field(
+      pytree_node=False, default=())
+
+  @classmethod
+  def empty(cls, score_keys=("rouge1", "rouge2", "rougeLsum"),
+            **kwargs) -> "ShardedRougeMean":
+    score_keys = tuple(score_keys)
+    field_names = {f.name for f in dataclasses.fields(cls)}
+    scorer_kwargs = tuple(sorted(
+        (k, v) for k, v in kwargs.items() if k not in field_names))
+    kwargs = {k: v for k, v in kwargs.items() if k in field_names}
+    return cls(sum_scores=np.zeros((len(score_keys),), np.float64),
+               score_keys=score_keys, scorer_kwargs=scorer_kwargs, **kwargs)
+
+  def from_targets_and_predictions(self, targets, predictions):
+    assert len(targets) == len(predictions)
+    fmeasures = _rouge_fmeasures(
+        self.score_keys, dict(self.scorer_kwargs),
+        list(zip(targets, predictions)))
+    return self.replace(sum_scores=fmeasures.sum(axis=0), count=len(targets))
+
+  def merge(self, other: "ShardedRougeMean") -> "ShardedRougeMean":
+    return self.replace(sum_scores=self.sum_scores + other.sum_scores,
+                        count=self.count + other.count)
+
+  def compute(self):
+    if not self.count:
+      return {key: float("nan") for key in self.score_keys}
+    return {key: 100 * s / self.count
+            for key, s in zip(self.score_keys, self.sum_scores)}
+
+
+@flax.struct.dataclass
+class ShardedEditDistance(_ShardedMetric):
+  """Mergeable version of `edit_distance`.
+
+  Accumulates a histogram of the word-level edit distances, whose length is
+  one more than the largest distance seen.
+  """
+
+  histogram: np.ndarray = flax.struct.field(
+      default_factory=lambda: np.zeros((0,), np.int64))
+  lower: bool = flax.struct.field(pytree_node=False, default=True)
+
+  @classmethod
+  def empty(cls, **kwargs) -> "ShardedEditDistance":
+    return cls(**kwargs)
+
+  def from_targets_and_predictions(self, targets, predictions):
+    distances = _edit_distances(
+        targets, predictions, lower=self.lower, num_workers=1)
+    return self.replace(
+        histogram=np.bincount(np.asarray(distances, np.int64)).astype(np.int64))
+
+  def merge(self, other: "ShardedEditDistance") -> "ShardedEditDistance":
+    size = max(len(self.histogram), len(other.histogram))
+    histogram = np.zeros((size,), np.int64)
+    histogram[:len(self.histogram)] += self.histogram
+    histogram[:len(other.histogram)] += other.histogram
+    return self.replace(histogram=histogram)
+
+  def compute(self):
+    count = int(self.histogram.sum())
+    if not count:
+      return {key: float("nan") for key in (
+          "min_edit", "max_edit", "mean_edit", "median_edit", "sum_edit")}
+    nonzero = np.flatnonzero(self.histogram)
+    total = int(np.dot(np.arange(len(self.histogram)), self.histogram))
+    # The k-th smallest distance is the first bin whose cumulative count
+    # exceeds k.
+    cumulative = np.cumsum(self.histogram)
+    lower_median, upper_median = np.searchsorted(
+        cumulative, [(count - 1) // 2, count // 2], side="right")
+    return {"min_edit": int(nonzero[0]),
+            "max_edit": int(nonzero[-1]),
+            "mean_edit": total / count,
+            "median_edit": (lower_median + upper_median) / 2,
+            "sum_edit": total}
+
+
+@flax.struct.dataclass
+class ShardedCoqaF1(_ShardedMetric):
+  """Mergeable version of `coqa_f1`."""
+
+  sum_f1: float = 0.0
+  count: int = 0
+
+  @classmethod
+  def empty(cls, **kwargs) -> "ShardedCoqaF1":
+    return cls(**kwargs)
+
+  def from_targets_and_predictions(self, targets, predictions):
+    f1s = _coqa_f1s(targets, predictions, num_workers=1)
+    return self.replace(sum_f1=float(np.sum(f1s)), count=len(f1s))
+
+  def merge(self, other: "ShardedCoqaF1") -> "ShardedCoqaF1":
+    return self.replace(sum_f1=self.sum_f1 + other.sum_f1,
+                        count=self.count + other.count)
 
-    return type(self)(f1=f1, em=em, count=count)
+  def compute(self):
+    if not self.count:
+      return {"f1": float("nan")}
+    return {"f1": 100 * self.sum_f1 / self.count}
+
+
+def _f1_from_confusion(tp, fp, fn):
+  """F1 from confusion counts, 0 when undefined as in `sklearn.metrics`."""
+  denominator = 2 * tp + fp + fn
+  return np.divide(2 * tp, denominator,
+                   out=np.zeros_like(denominator, dtype=np.float64),
+                   where=denominator > 0)
+
+
+@flax.struct.dataclass
+class ShardedF1ScoreWithInvalid(_ShardedMetric):
+  """Mergeable version of `f1_score_with_invalid`.
+
+  Accumulates the binary confusion counts, counting any prediction other than
+  0 or 1 as wrong.
+  """
+
+  tp: int = 0
+  fp: int = 0
+  fn: int = 0
+  count: int = 0
+
+  @classmethod
+  def empty(cls, **kwargs) -> "ShardedF1ScoreWithInvalid":
+    return cls(**kwargs)
+
+  def from_targets_and_predictions(self, targets, predictions):
+    targets, predictions = np.asarray(targets), np.asarray(predictions)
+    invalid = np.logical_and(predictions != 0, predictions != 1)
+    predictions = np.where(invalid, 1 - targets, predictions)
+    return self.replace(
+        tp=int(np.sum((targets == 1) & (predictions == 1))),
+        fp=int(np.sum((targets != 1) & (predictions == 1))),
+        fn=int(np.sum((targets == 1) & (predictions != 1))),
+        count=len(targets))
+
+  def merge(
+      self, other: "ShardedF1ScoreWithInvalid") -> "ShardedF1ScoreWithInvalid":
+    return self.replace(tp=self.tp + other.tp, fp=self.fp + other.fp,
+                        fn=self.fn + other.fn, count=self.count + other.count)
+
+  def compute(self):
+    if not self.count:
+      return {"f1": float("nan")}
+    return {"f1": 100 * float(_f1_from_confusion(self.tp, self.fp, self.fn))}
+
+
+@flax.struct.dataclass
+class ShardedMeanMulticlassF1(_ShardedMetric):
+  """Mergeable version of `mean_multiclass_f1`.
+
+  Accumulates a confusion matrix with rows indexed by target and columns by
+  prediction. The last row and column collect labels outside of
+  `range(num_classes)`.
+  """
+
+  confusion_matrix: np.ndarray = flax.struct.field(
+      default_factory=lambda: np.zeros((3, 3), np.int64))
+  num_classes: int = flax.struct.field(pytree_node=False, default=2)
+
+  @classmethod
+  def empty(cls, num_classes=2, **kwargs) -> "ShardedMeanMulticlassF1":
+    return cls(
+        confusion_matrix=np.zeros((num_classes + 1, num_classes + 1), np.int64),
+        num_classes=num_classes, **kwargs)
+
+  def from_targets_and_predictions(self, targets, predictions):
+    def to_index(labels):
+      labels = np.asarray(labels, np.int64)
+      in_range = (labels >= 0) & (labels < self.num_classes)
+      return np.where(in_range, labels, self.num_classes)
+
+    confusion_matrix = np.zeros_like(self.confusion_matrix)
+    np.add.at(confusion_matrix, (to_index(targets), to_index(predictions)), 1)
+    return self.replace(confusion_matrix=confusion_matrix)
+
+  def merge(
+      self, other: "ShardedMeanMulticlassF1") -> "ShardedMeanMulticlassF1":
+    return self.replace(
+        confusion_matrix=self.confusion_matrix + other.confusion_matrix)
 
   def compute(self):
-    return {"f1": self.f1, "em": self.em}
+    n = self.num_classes
+    if not self.confusion_matrix.sum():
+      return {"mean_%dclass_f1" % n: float("nan")}
+    tp = np.diag(self.confusion_matrix)[:n]
+    fp = self.confusion_matrix[:, :n].sum(axis=0) - tp
+    fn = self.confusion_matrix[:n, :].sum(axis=1) - tp
+    return {"mean_%dclass_f1" % n:
+                100 * float(np.mean(_f1_from_confusion(tp, fp, fn)))}
@@ -17,6 +17,7 @@
 from unittest import mock
 
 from absl.testing import absltest
+import jax
 import numpy as np
 import seqio
 import sklearn.metrics
@@ -64,6 +65,27 @@ class MetricsTest(test_utils.BaseMetricsTest):
         {"rouge1": 0, "rouge2": 0, "rougeLsum": 0},
     )
 
+  def test_rouge_seed(self):
+    targets = ["this is a string . and more", "the cat sat", "x y z",
+               "one two three", "a b c d"]
+    predictions = ["this is a string . and less", "a cat sat", "", "one two",
+                   "a c"]
+    result = metrics.rouge(targets, predictions, seed=1)
+    self.assertDictEqual(
+        result, metrics.rouge(targets, predictions, seed=1, num_workers=1))
+    self.assertNotEqual(result, metrics.rouge(targets, predictions, seed=2))
+
+  def test_rouge_parallel_chunks(self):
+    pairs = [("this is a string", "this is"), ("the cat sat", "a cat sat"),
+             ("x y z", ""), ("one two three", "one two"), ("a b", "a b")]
+    score_keys = ("rouge1", "rougeLsum")
+    serial = metrics._rouge_fmeasures(score_keys, {}, pairs)
+    parallel = metrics._map_chunks(
+        metrics._rouge_fmeasures, (score_keys, {}), pairs, num_workers=2,
+        chunk_size=2)
+    self.assertLen(parallel, 3)
+    np.testing.assert_array_equal(np.concatenate(parallel), serial)
+
   def test_same_squad(self):
     ref = "this is a string"
     self.assertDictClose(
@@ -628,6 +650,29 @@ class MetricsTest(test_utils.BaseMetricsTest):
             "f1": 66.6666667,
         })
 
+  def test_rank_classification_variable_classes_ties(self):
+    # Ties go to the candidate with the smallest 'idx', regardless of the
+    # order of the targets.
+    self.assertDictClose(
+        metrics.rank_classification(
+            [
+                ((1, 1), False, 1.0, 1),
+                ((0, 2), True, 1.0, 1),
+                ((1, 0), True, 1.0, 1),
+                ((0, 1), False, 1.0, 1),
+                ((2, 0), True, 3.0, 1),
+                ((0, 0), False, 1.0, 1),
+            ],
+            [
+                0.5, 0.7,
+                0.5, 0.7,
+                -1.0, 0.1
+            ],
+            num_classes=None),
+        {
+            "accuracy": 80.,
+        })
+
   def test_rank_classification_raise(self):
     with self.assertRaisesWithLiteralMatch(
         ValueError,
@@ -716,6 +761,17 @@ class MetricsTest(test_utils.BaseMetricsTest):
             "sum_edit": 0
         })
 
+  def test_parallel_edit_distance_and_coqa_f1(self):
+    targets = ["This is a sentence.", "jump the box", "Maru", ""] * 600
+    predictions = ["This is a different SENTENCE.", "jump", "cat", "a"] * 600
+    self.assertDictEqual(
+        metrics.edit_distance(targets, predictions, num_workers=2),
+        metrics.edit_distance(targets, predictions, num_workers=1))
+    coqa_targets = [[t, "climb box"] for t in targets]
+    self.assertDictEqual(
+        metrics.coqa_f1(coqa_targets, predictions, num_workers=2),
+        metrics.coqa_f1(coqa_targets, predictions, num_workers=1))
+
 
 def mock_decode(self, ids):
   decode_dict = {v: k for k, v in self._encode_dict.items()}
@@ -837,6 +893,204 @@ class ShardedSquadTest(test_utils.BaseMetricsTest):
       metric = metric1.merge(metric2)
       self.assertDictClose(metric.compute(), {"em": 25., "f1": 35.}, places=2)
 
+  def test_many_small_batches(self):
+    inputs = [
+        {"answers": ["big moose", "hippo"]},
+        {"answers": ["correct1"]},
+        {"answers": ["correct2.1", "correct2.2"]},
+        {"answers": ["a", "b"]},
+    ] * 25
+    predictions = ["‘a big Moose!‘", "wrong", "correct2.2", "c"] * 25
+
+    with mock.patch.object(
+        seqio.test_utils.MockVocabulary, "decode", new=mock_decode):
+      vocabulary = seqio.test_utils.MockVocabulary(
+          {
+              "‘a": 2,
+              "big": 3,
+              "Moose!‘": 4,
+              "wrong": 5,
+              "correct2.2": 6,
+              "c": 7
+          }, vocab_size=10)
+
+      model_output = np.array([[2, 3, 4], [5, 0, 0], [6, 0, 0], [7, 0, 0]] * 25)
+      features = {"targets": seqio.Feature(vocabulary)}
+      shards = []
+      for i in range(0, 100, 3):
+        shards.append(metrics.ShardedSquad.from_model_output(
+            inputs[i:i + 3], model_output[i:i + 3], features))
+      # Fully masked shards contribute nothing.
+      shards.append(metrics.ShardedSquad.from_model_output(
+          inputs[:2], model_output[:2], features, mask=np.zeros((2,))))
+
+      metric = metrics.ShardedSquad.empty()
+      for shard in shards:
+        metric = metric.merge(shard)
+      expected = metrics.squad([x["answers"] for x in inputs], predictions)
+      self.assertDictClose(metric.compute(), expected)
+      self.assertAlmostEqual(metric.f1, expected["f1"])
+      self.assertAlmostEqual(metric.em, expected["em"])
+
+      # Merge all shards at once, as after a `jax.lax.all_gather`.
+      stacked = jax.tree_util.tree_map(lambda *x: np.stack(x), *shards)
+      self.assertDictClose(
+          metrics.ShardedSquad.empty().merge(stacked).compute(), expected)
+      self.assertDictClose(stacked.reduce().compute(), expected)
+
+  def test_empty_merge(self):
+    metric = metrics.ShardedSquad.empty().merge(metrics.ShardedSquad.empty())
+    self.assertEqual(metric.count, 0)
+    self.assertEqual(metric.f1_sum, 0.0)
+    self.assertTrue(np.isnan(metric.f1))
+
+
+class ShardedMetricsTest(test_utils.BaseMetricsTest):
+
+  def assertShardedEqual(self, metric, metric_fn, targets, predictions):
+    """Checks that merging the statistics of 3 shards matches `metric_fn`."""
+    result = metric
+    for i in range(3):
+      result = result.merge(metric.from_targets_and_predictions(
+          targets[i::3], predictions[i::3]))
+    self.assertDictClose(result.compute(), metric_fn(targets, predictions))
+
+  def test_accuracy(self):
+    self.assertShardedEqual(
+        metrics.ShardedAccuracy.empty(), metrics.accuracy,
+        [0, 1, 2, 0, 1, 2, 1], [0, 1, 1, 0, 2, 2, 1])
+    self.assertShardedEqual(
+        metrics.ShardedSequenceAccuracy.empty(), metrics.sequence_accuracy,
+        ["a", "b", "c", "d"], ["a", "c", "c", "e"])
+
+  def test_bleu(self):
+    targets = ["this is a string", "another string here", "the cat sat",
+               "one two three four five"]
+    predictions = ["this is a string", "another string", "a cat sat down",
+                   "one two three four"]
+    self.assertShardedEqual(
+        metrics.ShardedBleu.empty(), metrics.bleu, targets, predictions)
+    self.assertShardedEqual(
+        metrics.ShardedBleu.empty(tokenizer="13a"),
+        lambda t, p: metrics.bleu(t, p, tokenizer="13a"),
+        targets, predictions)
+
+  def test_bleu_multiple_references(self):
+    # As with `bleu`, each target list is a stream holding one reference for
+    # every prediction.
+    targets = [["this is a string", "another string here", "the cat sat",
+                "one two three four five"],
+               ["this is string", "one more string", "a cat sat down",
+                "one two three four"]]
+    predictions = ["this is a string", "another string", "a cat sat down",
+                   "one two three four"]
+    result = metrics.ShardedBleu.empty()
+    for i in range(3):
+      result = result.merge(metrics.ShardedBleu.empty()
+                            .from_targets_and_predictions(
+                                [refs[i::3] for refs in targets],
+                                predictions[i::3]))
+    self.assertDictClose(result.compute(), metrics.bleu(targets, predictions))
+
+    with self.assertRaisesRegex(ValueError, "same number of references"):
+      metrics.ShardedBleu.empty().from_targets_and_predictions(
+          [targets[0], targets[1][:3]], predictions)
+
+  def test_rouge_mean(self):
+    targets = ["this is a string . and more", "the cat sat", "x y z",
+               "one two three"]
+    predictions = ["this is a string . and less", "a cat sat", "", "one two"]
+    self.assertShardedEqual(
+        metrics.ShardedRougeMean.empty(), metrics.rouge_mean,
+        targets, predictions)
+    self.assertShardedEqual(
+        metrics.ShardedRougeMean.empty(score_keys=("rougeL",)),
+        lambda t, p: metrics.rouge_mean(t, p, score_keys=("rougeL",)),
+        targets, predictions)
+    # Other keyword arguments are passed to `RougeScorer`, like `rouge_mean`.
+    targets = ["the cats are running", "he walked home"]
+    predictions = ["the cat runs", "he walks home"]
+    self.assertShardedEqual(
+        metrics.ShardedRougeMean.empty(use_stemmer=True),
+        lambda t, p: metrics.rouge_mean(t, p, use_stemmer=True),
+        targets, predictions)
+    self.assertNotEqual(
+        metrics.ShardedRougeMean.empty(use_stemmer=True)
+        .from_targets_and_predictions(targets, predictions).compute(),
+        metrics.ShardedRougeMean.empty()
+        .from_targets_and_predictions(targets, predictions).compute())
+
+  def test_edit_distance(self):
+    targets = ["This is a sentence.", "a b c d", "x", "one two", "a b", ""]
+    predictions = ["This is a different SENTENCE.", "a c", "x", "three", "",
+                   "a b c d e f"]
+    self.assertShardedEqual(
+        metrics.ShardedEditDistance.empty(), metrics.edit_distance,
+        targets, predictions)
+    self.assertShardedEqual(
+        metrics.ShardedEditDistance.empty(lower=False),
+        lambda t, p: metrics.edit_distance(t, p, lower=False),
+        targets[:5], predictions[:5])
+
+  def test_coqa_f1(self):
+    self.assertShardedEqual(
+        metrics.ShardedCoqaF1.empty(), metrics.coqa_f1,
+        [["jump the box", "climb box"], ["maru"], ["jump box"], ["a b c"]],
+        ["jump box", "cat", "jump", "b c"])
+
+  def test_f1_score_with_invalid(self):
+    self.assertShardedEqual(
+        metrics.ShardedF1ScoreWithInvalid.empty(),
+        metrics.f1_score_with_invalid,
+        [0, 1, 1, 0, 1, 0, 1], [0, 1, -1, 2, 0, 1, 1])
+
+  def test_mean_multiclass_f1(self):
+    self.assertShardedEqual(
+        metrics.ShardedMeanMulticlassF1.empty(num_classes=4),
+        metrics.mean_multiclass_f1(num_classes=4),
+        [0, 1, 2, 0, 1, 2, 2, 1], [0, 2, 2, 0, 1, -1, 2, 0])
+
+  def test_empty(self):
+    for metric, keys in [
+        (metrics.ShardedAccuracy, ["accuracy"]),
+        (metrics.ShardedSequenceAccuracy, ["sequence_accuracy"]),
+        (metrics.ShardedCoqaF1, ["f1"]),
+        (metrics.ShardedEditDistance,
+         ["min_edit", "max_edit", "mean_edit", "median_edit", "sum_edit"]),
+        (metrics.ShardedBleu, ["bleu"]),
+        (metrics.ShardedRougeMean, ["rouge1", "rouge2", "rougeLsum"]),
+        (metrics.ShardedF1ScoreWithInvalid, ["f1"]),
+        (metrics.ShardedMeanMulticlassF1, ["mean_2class_f1"]),
+        (metrics.ShardedSquad, ["f1", "em"]),
+    ]:
+      result = metric.empty().merge(metric.empty()).compute()
+      self.assertSameElements(result.keys(), keys)
+      for key in keys:
+        self.assertTrue(np.isnan(result[key]), msg=f"{metric.__name__} {key}")
+
+  def test_from_model_output(self):
+    inputs = [
+        {"targets_pretokenized": b"1"},
+        {"targets_pretokenized": b"0"},
+        {"targets_pretokenized": b"1"},
+    ]
+    vocabulary = seqio.test_utils.MockVocabulary(
+        {"0": 2, "1": 3, "2": 4}, vocab_size=10)
+    features = {"targets": seqio.Feature(vocabulary)}
+    metric = metrics.ShardedMeanMulticlassF1.empty(
+        num_classes=2,
+        postprocess_fn=lambda x, **unused_kwargs: int(x))
+
+    with mock.patch.object(
+        seqio.test_utils.MockVocabulary, "decode", new=mock_decode):
+      result = metric.from_model_output(
+          inputs, np.array([[3], [3], [4]]), features,
+          mask=np.array([1, 1, 0])).merge(
+              metric.from_model_output(inputs[2:], np.array([[3]]), features))
+    self.assertDictClose(
+        result.compute(),
+        metrics.mean_multiclass_f1(num_classes=2)([1, 0, 1], [1, 1, 1]))
+
 
 if __name__ == "__main__":
   absltest.main()
@@ -18,6 +18,7 @@ Matches results on the SQuAD (v1.1) and TriviaQA (v1.0) evaluation scripts.
 """
 
 import collections
+import functools
 import re
 import string
 
@@ -25,15 +26,22 @@ from absl import logging
 import numpy as np
 
 
+_ARTICLES_RE = re.compile(r"\b(a|an|the)\b")
+
+
+@functools.lru_cache(maxsize=None)
+def _punctuation_table(punc_chars, punc_repl):
+  return str.maketrans({ch: punc_repl for ch in punc_chars})
+
+
 def _normalize_answer(text, punc_chars, punc_repl):
   """Lower text and remove punctuation, articles and extra whitespace."""
 
   def remove_articles(s):
-    return re.sub(r"\b(a|an|the)\b", " ", s)
+    return _ARTICLES_RE.sub(" ", s)
 
   def replace_punctuation(s):
-    to_replace = set(punc_chars)
-    return "".join(punc_repl if ch in to_replace else ch for ch in s)
+    return s.translate(_punctuation_table(punc_chars, punc_repl))
 
   def white_space_fix(s):
     return " ".join(s.split())
@@ -83,19 +91,44 @@ def _f1_score(target, prediction):
   return f1
 
 
-def qa_metrics(targets, predictions):
-  """Computes exact match and f1 QA scores, expecting pre-normalized text."""
+def _qa_example_scores(targets, predictions):
+  """Returns per-example exact match and f1 scores in [0, 1]."""
   if len(targets) != len(predictions):
     raise ValueError("Number of targets and predictions must match.")
-  em = np.mean([
+  em = np.array([
       _metric_max_over_ground_truths(_exact_match_score, t, p)
       for p, t in zip(predictions, targets)
-  ])
-  f1 = np.mean([
+  ], dtype=np.float64)
+  f1 = np.array([
       _metric_max_over_ground_truths(_f1_score, t, p)
       for p, t in zip(predictions, targets)
-  ])
+  ], dtype=np.float64)
+  return em, f1
+
+
+def qa_metrics(targets, predictions):
+  """Computes exact match and f1 QA scores, expecting pre-normalized text."""
+  em, f1 = _qa_example_scores(targets, predictions)
+  em = np.mean(em)
+  f1 = np.mean(f1)
   em *= 100
   f1 *= 100
   logging.info("EM = %.2f, F1 = %.2f", em, f1)
   return {"em": em, "f1": f1}
+
+
+def qa_metric_sums(targets, predictions):
+  """Computes unnormalized sums of exact match and f1 QA scores.
+
+  Unlike `qa_metrics`, the results can be accumulated over batches and divided
+  by the total number of examples at the end.
+
+  Args:
+    targets: list of lists of pre-normalized strings.
+    predictions: list of pre-normalized strings.
+
+  Returns:
+    dict with the sums of the per-example "em" and "f1" scores in [0, 1].
+  """
+  em, f1 = _qa_example_scores(targets, predictions)
+  return {"em": float(np.sum(em)), "f1": float(np.sum(f1))}
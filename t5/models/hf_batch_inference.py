@@ -0,0 +1,226 @@
+# Copyright 2023 The T5 Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Sharded multi-process batch inference for Hugging Face PyTorch T5 models.
+
+The lines of an input file are split round-robin into `num_shards` shards.
+Each shard is predicted by its own worker process holding its own copy of the
+model and limited to `num_threads_per_shard` PyTorch threads, so that the
+workers together do not oversubscribe the CPU. Workers stream their
+predictions with `HfPyTorchModel.predict(stream=True)`, so an interrupted run
+resumes where each shard stopped. The shard outputs are then merged back into
+the order of the input lines.
+
+Usage example:
+
+```Python
+stats = t5.models.hf_batch_inference.predict_sharded(
+    "t5-small", "/tmp/hft5/", "/tmp/inputs.txt", "/tmp/predictions.txt",
+    sequence_length={"inputs": 512}, batch_size=32, num_shards=8)
+```
+"""
+
+import concurrent.futures
+import multiprocessing
+import os
+import time
+
+from absl import logging
+import seqio
+from t5.models import hf_model
+import tensorflow.compat.v1 as tf
+import torch
+
+
+def write_task_inputs(mixture_or_task_name, split, output_file):
+  """Writes the pretokenized inputs of a Task or Mixture split to a file.
+
+  The inputs of a Mixture are those of each of its Tasks with the split, in
+  order, read once each rather than sampled.
+
+  Args:
+    mixture_or_task_name: str, the name of a registered Task or Mixture.
+    split: str, the split to write.
+    output_file: str, path to write the inputs to, one per line. Newlines
+      within an input are replaced by spaces.
+
+  Returns:
+    The number of inputs written.
+  """
+  tasks = seqio.get_subtasks(seqio.get_mixture_or_task(mixture_or_task_name))
+  num_inputs = 0
+  with tf.io.gfile.GFile(output_file, "w") as f:
+    for task in tasks:
+      if split not in task.splits:
+        logging.info("Skipping %s without split %s.", task.name, split)
+        continue
+      dataset = task.get_dataset(
+          sequence_length=None, split=split, shuffle=False, num_epochs=1)
+      for ex in dataset.as_numpy_iterator():
+        inputs = ex["inputs_pretokenized"].decode("utf-8")
+        f.write(" ".join(inputs.splitlines()) + "\n")
+        num_inputs += 1
+  return num_inputs
+
+
+def _count_lines(filename):
+  """Returns the number of lines in a text file."""
+  with tf.io.gfile.GFile(filename) as f:
+    return sum(1 for _ in f)
+
+
+def merge_shard_outputs(output_file, num_shards, num_lines=None,
+                        remove_shards=True):
+  """Merges round-robin shard outputs back into the order of the inputs.
+
+  Args:
+    output_file: str, the `output_file` the shards were predicted for. The
+      merged predictions are written here.
+    num_shards: int, the number of shards.
+    num_lines: int, the expected number of lines, i.e. of inputs, or None to
+      only check that the shard sizes are consistent.
+    remove_shards: bool, whether to delete the shard files once merged.
+
+  Returns:
+    The number of merged lines.
+
+  Raises:
+    ValueError: if the shard sizes are not those of a round-robin split of
+      `num_lines` lines, e.g. because a shard is incomplete.
+  """
+  shard_files = [hf_model.shard_output_file(output_file, i, num_shards)
+                 for i in range(num_shards)]
+  shards = [tf.io.gfile.GFile(f) for f in shard_files]
+  num_merged = 0
+  try:
+    with tf.io.gfile.GFile(output_file, "w") as f:
+      while True:
+        line = shards[num_merged % num_shards].readline()
+        if not line:
+          break
+        f.write(line)
+        num_merged += 1
+    # Shard i holds lines i, i + num_shards, ..., so once one shard is
+    # exhausted, all of them must be.
+    for shard_file, shard in zip(shard_files, shards):
+      if shard.readline():
+        raise ValueError(
+            f"{shard_file} has more lines than a round-robin split of "
+            f"{num_merged} lines.")
+  finally:
+    for shard in shards:
+      shard.close()
+  if num_lines is not None and num_merged != num_lines:
+    raise ValueError(
+        f"Expected {num_lines} lines in a round-robin split, found only "
+        f"{num_merged} before shard {num_merged % num_shards} ended.")
+  if remove_shards:
+    for shard_file in shard_files:
+      tf.io.gfile.remove(shard_file)
+  return num_merged
+
+
+def _predict_shard(model_spec, model_dir, input_file, output_file,
+                   sequence_length, batch_size, num_shards, num_threads,
+                   checkpoint_step, vocabulary, generate_kwargs, shard_index):
+  """Predicts one shard in a worker process, returns (count, seconds)."""
+  torch.set_num_threads(num_threads)
+  start = time.time()
+  model = hf_model.HfPyTorchModel(model_spec, model_dir, torch.device("cpu"))
+  if checkpoint_step is not None:
+    model.load_checkpoint(checkpoint_step)
+  num_predicted = model.predict(
+      input_file, sequence_length, batch_size, output_file=output_file,
+      vocabulary=vocabulary, stream=True, num_shards=num_shards,
+      shard_index=shard_index, **generate_kwargs)
+  return num_predicted, time.time() - start
+
+
+def predict_sharded(model_spec,
+                    model_dir,
+                    input_file,
+                    output_file,
+                    sequence_length,
+                    batch_size,
+                    num_shards=None,
+                    num_threads_per_shard=None,
+                    checkpoint_step=None,
+                    vocabulary=None,
+                    remove_shards=True,
+                    **generate_kwargs):
+  """Predicts the lines of `input_file` with several CPU worker processes.
+
+  Args:
+    model_spec: str or T5Config, passed to `HfPyTorchModel` in each worker.
+    model_dir: str, directory with model checkpoints. Without a
+      `checkpoint_step`, the latest checkpoint is used, if any.
+    input_file: str, path to a text file with one input per line.
+    output_file: str, path to write the predictions to, one per line.
+    sequence_length: dict of int, a dict mapping feature name to length.
+    batch_size: int, the number of padded sequences in each batch.
+    num_shards: int, the number of worker processes, defaults to the number of
+      CPUs divided by `num_threads_per_shard`, or to the number of CPUs.
+    num_threads_per_shard: int, the number of PyTorch threads of each worker,
+      defaults to the number of CPUs divided by `num_shards`.
+    checkpoint_step: int, the checkpoint step to load in each worker or None.
+    vocabulary: seqio.Vocabulary or dict of them, see
+      `HfPyTorchModel.predict`.
+    remove_shards: bool, whether to delete the shard outputs once merged.
+      Keeping them allows a later run to resume from them.
+    **generate_kwargs: Additional keyword arguments to pass to
+      `transformers.PretrainedModel.generate()`.
+
+  Returns:
+    A dict with the number of predictions made by this run, the wall-clock
+    seconds and the aggregate predictions per second.
+  """
+  num_cpus = os.cpu_count() or 1
+  if num_shards is None:
+    num_shards = max(1, num_cpus // (num_threads_per_shard or 1))
+  if num_threads_per_shard is None:
+    num_threads_per_shard = max(1, num_cpus // num_shards)
+  logging.info("Predicting %s with %d shards of %d threads.", input_file,
+               num_shards, num_threads_per_shard)
+
+  start = time.time()
+  # Forking a process that has initialized PyTorch or TensorFlow thread pools
+  # is unsafe, so workers are spawned.
+  with concurrent.futures.ProcessPoolExecutor(
+      num_shards, mp_context=multiprocessing.get_context("spawn")) as executor:
+    futures = [
+        executor.submit(_predict_shard, model_spec, model_dir, input_file,
+                        output_file, sequence_length, batch_size, num_shards,
+                        num_threads_per_shard, checkpoint_step, vocabulary,
+                        generate_kwargs, shard_index)
+        for shard_index in range(num_shards)]
+    num_predicted = 0
+    for shard_index, future in enumerate(futures):
+      shard_predicted, shard_seconds = future.result()
+      logging.info("Shard %d predicted %d inputs in %.1fs (%.1f/s).",
+                   shard_index, shard_predicted, shard_seconds,
+                   shard_predicted / max(shard_seconds, 1e-9))
+      num_predicted += shard_predicted
+  seconds = time.time() - start
+
+  num_lines = merge_shard_outputs(
+      output_file, num_shards, _count_lines(input_file), remove_shards)
+  stats = {
+      "predictions": num_predicted,
+      "seconds": seconds,
+      "predictions_per_sec": num_predicted / max(seconds, 1e-9),
+  }
+  logging.info("Wrote %d predictions to %s; this run predicted %d in %.1fs "
+               "(%.1f/s).", num_lines, output_file, num_predicted, seconds,
+               stats["predictions_per_sec"])
+  return stats
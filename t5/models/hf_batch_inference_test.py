@@ -0,0 +1,117 @@
+# Copyright 2023 The T5 Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for t5.models.hf_batch_inference."""
+
+import os
+
+from absl.testing import absltest
+import seqio
+from t5.models import hf_batch_inference
+from t5.models import hf_model
+import tensorflow.compat.v1 as tf
+
+
+def _add_task(name, inputs):
+  vocabulary = seqio.ByteVocabulary()
+  seqio.TaskRegistry.add(
+      name,
+      source=seqio.FunctionDataSource(
+          lambda split, shuffle_files: tf.data.Dataset.from_tensor_slices(
+              {"inputs": inputs, "targets": ["t"] * len(inputs)}),
+          splits=["validation"]),
+      preprocessors=[seqio.preprocessors.tokenize],
+      output_features={
+          "inputs": seqio.Feature(vocabulary),
+          "targets": seqio.Feature(vocabulary),
+      })
+
+
+class WriteTaskInputsTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    _add_task("hf_batch_inference_task_a", ["a 1", "a\n2"])
+    _add_task("hf_batch_inference_task_b", ["b 1"])
+    seqio.MixtureRegistry.add(
+        "hf_batch_inference_mixture",
+        ["hf_batch_inference_task_a", "hf_batch_inference_task_b"],
+        default_rate=1.0)
+
+  def tearDown(self):
+    seqio.MixtureRegistry.remove("hf_batch_inference_mixture")
+    seqio.TaskRegistry.remove("hf_batch_inference_task_a")
+    seqio.TaskRegistry.remove("hf_batch_inference_task_b")
+    super().tearDown()
+
+  def test_write_task_inputs(self):
+    output_file = os.path.join(self.create_tempdir().full_path, "inputs")
+    self.assertEqual(
+        hf_batch_inference.write_task_inputs(
+            "hf_batch_inference_task_a", "validation", output_file), 2)
+    with tf.io.gfile.GFile(output_file) as f:
+      self.assertEqual(f.read(), "a 1\na 2\n")
+
+  def test_write_mixture_inputs(self):
+    output_file = os.path.join(self.create_tempdir().full_path, "inputs")
+    # Each task of the mixture is read once instead of repeating forever.
+    self.assertEqual(
+        hf_batch_inference.write_task_inputs(
+            "hf_batch_inference_mixture", "validation", output_file), 3)
+    with tf.io.gfile.GFile(output_file) as f:
+      self.assertEqual(f.read(), "a 1\na 2\nb 1\n")
+
+
+class MergeShardOutputsTest(absltest.TestCase):
+
+  def _write_shards(self, output_file, lines, num_shards):
+    for i in range(num_shards):
+      with tf.io.gfile.GFile(
+          hf_model.shard_output_file(output_file, i, num_shards), "w") as f:
+        f.write("".join(l + "\n" for l in lines[i::num_shards]))
+
+  def test_merge_shard_outputs(self):
+    output_file = os.path.join(self.create_tempdir().full_path, "predictions")
+    lines = ["prediction %d" % i for i in range(10)] + [""]
+    self._write_shards(output_file, lines, 3)
+    self.assertEqual(
+        hf_batch_inference.merge_shard_outputs(output_file, 3, len(lines)),
+        len(lines))
+    with tf.io.gfile.GFile(output_file) as f:
+      self.assertEqual(f.read(), "".join(l + "\n" for l in lines))
+    self.assertFalse(tf.io.gfile.exists(
+        hf_model.shard_output_file(output_file, 0, 3)))
+
+  def test_merge_shard_outputs_incomplete(self):
+    output_file = os.path.join(self.create_tempdir().full_path, "predictions")
+    self._write_shards(output_file, ["a", "b", "c", "d", "e"], 2)
+    # Drop the last line of the first shard.
+    with tf.io.gfile.GFile(
+        hf_model.shard_output_file(output_file, 0, 2), "w") as f:
+      f.write("a\nc\n")
+    with self.assertRaisesRegex(ValueError, "found only 4"):
+      hf_batch_inference.merge_shard_outputs(output_file, 2, num_lines=5)
+
+  def test_merge_shard_outputs_too_long(self):
+    output_file = os.path.join(self.create_tempdir().full_path, "predictions")
+    self._write_shards(output_file, ["a", "b", "c", "d"], 2)
+    with tf.io.gfile.GFile(
+        hf_model.shard_output_file(output_file, 1, 2), "a") as f:
+      f.write("f\n")
+    with self.assertRaisesRegex(ValueError, "more lines"):
+      hf_batch_inference.merge_shard_outputs(output_file, 2)
+
+
+if __name__ == "__main__":
+  absltest.main()
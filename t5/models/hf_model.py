@@ -174,6 +174,73 @@ def _get_dataset(mixture_or_task_or_name,
   return task.get_dataset(sequence_length, split, shuffle=shuffle)
 
 
+def _get_vocabularies(vocabulary):
+  """Returns a dict with the "inputs" and "targets" vocabularies."""
+  if vocabulary is None:
+    vocab = t5.data.get_default_vocabulary()
+    return {"inputs": vocab, "targets": vocab}
+  elif isinstance(vocabulary, seqio.Vocabulary):
+    return {"inputs": vocabulary, "targets": vocabulary}
+  elif isinstance(vocabulary, dict):
+    return vocabulary
+  else:
+    raise ValueError("vocabulary must be a dict, a Vocabulary, or None")
+
+
+def _encode_inputs(dataset, vocabs, sequence_length, batch_size):
+  """Encodes a dataset of input strings into batches of padded token ids."""
+  dataset = dataset.map(
+      lambda x: {"inputs": tf.cast(vocabs["inputs"].encode_tf(x), tf.int64)},
+      num_parallel_calls=tf.data.experimental.AUTOTUNE,
+  )
+  return tokens_to_batches(dataset, sequence_length, batch_size, ["inputs"])
+
+
+def shard_output_file(output_file, shard_index, num_shards):
+  """Returns the path the given shard of a streaming predict writes to."""
+  if num_shards == 1:
+    return output_file
+  return "{}-{:05d}-of-{:05d}".format(output_file, shard_index, num_shards)
+
+
+def _resume_output_file(output_file, chunk_size=2**24):
+  """Returns the number of complete lines in `output_file`.
+
+  A partial last line, e.g. left by a crash during a write, is removed so that
+  the file can be appended to.
+
+  Args:
+    output_file: str, path to a file written by a streaming predict.
+    chunk_size: int, number of bytes to read at a time.
+
+  Returns:
+    The number of newline-terminated lines in the file, or 0 if it does not
+    exist.
+  """
+  if not tf.io.gfile.exists(output_file):
+    return 0
+  num_lines = 0
+  complete_size = 0
+  size = 0
+  with tf.io.gfile.GFile(output_file, "rb") as f:
+    while True:
+      chunk = f.read(chunk_size)
+      if not chunk:
+        break
+      num_lines += chunk.count(b"\n")
+      last_newline = chunk.rfind(b"\n")
+      if last_newline >= 0:
+        complete_size = size + last_newline + 1
+      size += len(chunk)
+  if complete_size < size:
+    logging.info("Removing partial last line of %s.", output_file)
+    with tf.io.gfile.GFile(output_file, "rb") as f:
+      complete = f.read(complete_size)
+    with tf.io.gfile.GFile(output_file, "wb") as f:
+      f.write(complete)
+  return num_lines
+
+
 class HfPyTorchModel(T5Model):
   """Wrapper class for Hugging Face Transformers PyTorch T5 model."""
 
@@ -462,6 +529,10 @@ class HfPyTorchModel(T5Model):
       batch_size,
       output_file=None,
       vocabulary=None,
+      stream=False,
+      flush_every=1000,
+      num_shards=1,
+      shard_index=0,
       **generate_kwargs,
   ):
     """Evaluate the model on the given Mixture or Task.
@@ -472,6 +543,15 @@ class HfPyTorchModel(T5Model):
     should call `save_checkpoint` before `eval` to avoid losing its parameter
     values and state.
 
+    With `stream=True`, `inputs` must be the path to a text file. Its lines are
+    read lazily and the predictions are appended to `output_file` as they are
+    generated, one per line. If `output_file` already holds predictions, e.g.
+    from a run that crashed, prediction resumes after the last complete line.
+    With `num_shards` > 1, only every `num_shards`-th line starting at line
+    `shard_index` is predicted and written to
+    `shard_output_file(output_file, shard_index, num_shards)`, so that shards
+    can be run by separate processes.
+
     Args:
       inputs: list of str or str, either a list of inputs to feed into the
         model or the path to a text file that contains a single input on each
@@ -486,11 +566,30 @@ class HfPyTorchModel(T5Model):
         decoding the predictions, or None (default) to use a
         t5.data.SentencePieceVocabulary with the provided
         sentencepiece_model_path (as was used in all pre-trained T5 models).
+      stream: bool, whether to stream predictions from the `inputs` file to
+        `output_file` instead of holding them in memory.
+      flush_every: int, with `stream=True`, flush `output_file` after this many
+        predictions.
+      num_shards: int, with `stream=True`, the number of shards the input lines
+        are split into.
+      shard_index: int, with `stream=True`, the shard to predict.
       **generate_kwargs: Additional keyword arguments to pass to
         `transformers.PretrainedModel.generate()`, for example to change the
         decoding strategy. See the documentation for
         `transformers.PretrainedModel.generate()` for options.
+
+    Returns:
+      With `stream=True`, the number of predictions written by this call, not
+      counting those resumed from. Otherwise None.
     """
+    if stream:
+      if not isinstance(inputs, str) or output_file is None:
+        raise ValueError(
+            "stream=True requires a path for `inputs` and an `output_file`.")
+      return self._predict_stream(
+          inputs, sequence_length, batch_size, output_file, vocabulary,
+          flush_every, num_shards, shard_index, **generate_kwargs)
+
     if isinstance(inputs, str):
       if not tf.io.gfile.exists(inputs):
         raise ValueError(
@@ -501,30 +600,18 @@ class HfPyTorchModel(T5Model):
       with tf.io.gfile.GFile(inputs) as f:
         inputs = [l.strip() for l in f]
 
-    if vocabulary is None:
-      vocab = t5.data.get_default_vocabulary()
-      vocabs = {"inputs": vocab, "targets": vocab}
-    elif isinstance(vocabulary, seqio.Vocabulary):
-      vocabs = {"inputs": vocabulary, "targets": vocabulary}
-    elif isinstance(vocabulary, dict):
-      vocabs = vocabulary
-    else:
-      raise ValueError("vocabulary must be a dict, a Vocabulary, or None")
-
-    dataset = tf.data.Dataset.from_tensor_slices(inputs)
-    dataset = dataset.map(
-        lambda x: {"inputs": tf.cast(vocabs["inputs"].encode_tf(x), tf.int64)},
-        num_parallel_calls=tf.data.experimental.AUTOTUNE,
-    )
-    dataset = tokens_to_batches(
-        dataset, sequence_length, batch_size, ["inputs"]
-    )
+    vocabs = _get_vocabularies(vocabulary)
+    dataset = _encode_inputs(
+        tf.data.Dataset.from_tensor_slices(inputs), vocabs, sequence_length,
+        batch_size)
 
+    self._model.eval()
     predictions = []
     for batch in dataset:
-      predicted_tokens = self._model.generate(
-          input_ids=self.to_tensor(batch["inputs"]), **generate_kwargs
-      )
+      with torch.no_grad():
+        predicted_tokens = self._model.generate(
+            input_ids=self.to_tensor(batch["inputs"]), **generate_kwargs
+        )
       predicted_tokens = predicted_tokens.cpu().numpy().tolist()
       predictions.extend(
           [vocabs["targets"].decode(p) for p in predicted_tokens]
@@ -536,6 +623,59 @@ class HfPyTorchModel(T5Model):
     if output_file is not None:
       utils.write_lines_to_file(predictions, output_file)
 
+  def _predict_stream(self, input_file, sequence_length, batch_size,
+                      output_file, vocabulary, flush_every, num_shards,
+                      shard_index, **generate_kwargs):
+    """Streams predictions for a shard of `input_file`, see `predict`."""
+    if not tf.io.gfile.exists(input_file):
+      raise ValueError(f"Input file {input_file} does not exist.")
+    if not 0 <= shard_index < num_shards:
+      raise ValueError(
+          f"shard_index must be in [0, {num_shards}), got {shard_index}.")
+    output_file = shard_output_file(output_file, shard_index, num_shards)
+    num_done = _resume_output_file(output_file)
+    if num_done:
+      logging.info("Resuming %s after %d predictions.", output_file, num_done)
+
+    def _shard_lines():
+      with tf.io.gfile.GFile(input_file) as f:
+        shard_lines = itertools.islice(f, shard_index, None, num_shards)
+        for line in itertools.islice(shard_lines, num_done, None):
+          yield line.strip()
+
+    vocabs = _get_vocabularies(vocabulary)
+    dataset = _encode_inputs(
+        tf.data.Dataset.from_generator(
+            _shard_lines, output_signature=tf.TensorSpec([], tf.string)),
+        vocabs, sequence_length, batch_size)
+
+    self._model.eval()
+    num_predicted = 0
+    num_unflushed = 0
+    start = time.time()
+    with tf.io.gfile.GFile(output_file, "a") as f:
+      for batch in dataset:
+        with torch.no_grad():
+          predicted_tokens = self._model.generate(
+              input_ids=self.to_tensor(batch["inputs"]), **generate_kwargs
+          )
+        predicted_tokens = predicted_tokens.cpu().numpy().tolist()
+        # Each prediction must stay on one line for resuming to count them.
+        f.write("".join(
+            " ".join(vocabs["targets"].decode(p).splitlines()) + "\n"
+            for p in predicted_tokens))
+        num_predicted += len(predicted_tokens)
+        num_unflushed += len(predicted_tokens)
+        if num_unflushed >= flush_every:
+          f.flush()
+          num_unflushed = 0
+          logging.info("Wrote %d predictions to %s (%.1f/s).",
+                       num_done + num_predicted, output_file,
+                       num_predicted / (time.time() - start))
+    logging.info("Finished %s with %d predictions.", output_file,
+                 num_done + num_predicted)
+    return num_predicted
+
   def finetune(
       self,
       mixture_or_task_name,
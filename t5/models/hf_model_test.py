@@ -0,0 +1,110 @@
+# Copyright 2023 The T5 Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for t5.models.hf_model."""
+
+import os
+
+from absl.testing import absltest
+import seqio
+from t5.models import hf_model
+import tensorflow.compat.v1 as tf
+import transformers
+
+_SEQUENCE_LENGTH = {"inputs": 8}
+
+
+class HfPyTorchModelTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    hf_model.torch.manual_seed(0)
+    config = transformers.T5Config(
+        vocab_size=260, d_model=8, d_kv=4, d_ff=16, num_layers=1, num_heads=2,
+        dropout_rate=0.0, decoder_start_token_id=0)
+    self.model = hf_model.HfPyTorchModel(
+        config, self.create_tempdir().full_path, hf_model.torch.device("cpu"))
+    self.vocabulary = seqio.ByteVocabulary()
+    self.input_file = os.path.join(self.create_tempdir().full_path, "inputs")
+    self.inputs = ["input %d" % i for i in range(10)]
+    with tf.io.gfile.GFile(self.input_file, "w") as f:
+      f.write("\n".join(self.inputs))
+
+  def _read_predictions(self, output_file, stream=True):
+    with tf.io.gfile.GFile(output_file) as f:
+      text = f.read()
+    if not stream:
+      # `write_lines_to_file` does not terminate the last line.
+      return text.split("\n")
+    self.assertTrue(not text or text.endswith("\n"))
+    return text.split("\n")[:-1]
+
+  def _predict(self, output_file, stream=False, **kwargs):
+    self.model.predict(
+        self.input_file, _SEQUENCE_LENGTH, batch_size=3,
+        output_file=output_file, vocabulary=self.vocabulary, max_length=4,
+        do_sample=False, stream=stream, **kwargs)
+    return self._read_predictions(output_file, stream)
+
+  def test_predict_stream(self):
+    output_dir = self.create_tempdir().full_path
+    expected = self._predict(os.path.join(output_dir, "predictions"))
+    self.assertLen(expected, 10)
+    self.assertEqual(
+        self._predict(os.path.join(output_dir, "streamed"), stream=True,
+                      flush_every=2),
+        expected)
+
+  def test_predict_stream_resume(self):
+    output_dir = self.create_tempdir().full_path
+    expected = self._predict(os.path.join(output_dir, "predictions"))
+    # Simulate a crash after 4 complete lines and a partial one.
+    output_file = os.path.join(output_dir, "streamed")
+    with tf.io.gfile.GFile(output_file, "w") as f:
+      f.write("\n".join(expected[:4]) + "\npart")
+    self.assertEqual(self._predict(output_file, stream=True), expected)
+
+  def test_predict_stream_shards(self):
+    output_dir = self.create_tempdir().full_path
+    expected = self._predict(os.path.join(output_dir, "predictions"))
+    output_file = os.path.join(output_dir, "streamed")
+    for shard_index in range(3):
+      self.model.predict(
+          self.input_file, _SEQUENCE_LENGTH, batch_size=3,
+          output_file=output_file, vocabulary=self.vocabulary, max_length=4,
+          do_sample=False, stream=True, num_shards=3, shard_index=shard_index)
+      self.assertEqual(
+          self._read_predictions(
+              hf_model.shard_output_file(output_file, shard_index, 3)),
+          expected[shard_index::3])
+
+
+  def test_predict_stream_multiline(self):
+
+    class MultilineVocabulary(seqio.ByteVocabulary):
+
+      def decode(self, ids):
+        return "a\nb\r\nc"
+
+    output_file = os.path.join(self.create_tempdir().full_path, "streamed")
+    vocabulary = {"inputs": self.vocabulary, "targets": MultilineVocabulary()}
+    self.model.predict(
+        self.input_file, _SEQUENCE_LENGTH, batch_size=3,
+        output_file=output_file, vocabulary=vocabulary, max_length=4,
+        do_sample=False, stream=True)
+    self.assertEqual(self._read_predictions(output_file), ["a b c"] * 10)
+    self.assertEqual(hf_model._resume_output_file(output_file), 10)
+
+if __name__ == "__main__":
+  absltest.main()
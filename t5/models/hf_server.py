@@ -0,0 +1,361 @@
+# Copyright 2023 The T5 Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Local HTTP inference server for Hugging Face PyTorch T5 models.
+
+The server is a small asyncio HTTP/1.1 front end, listening on a TCP port or a
+Unix socket, in front of a `DynamicBatcher`. The batcher queues incoming
+prompts, groups them by length into batches that fit a token budget, and runs
+one `generate` call per group on a worker thread.
+
+Endpoints:
+  POST /predict with a JSON body {"inputs": [str, ...]} returns
+    {"outputs": [str, ...]}.
+  GET /metrics returns request, batch and latency counters.
+
+Usage example:
+
+```Python
+model = t5.models.HfPyTorchModel("t5-small", "/tmp/hft5/", torch.device("cpu"))
+batcher = t5.models.hf_server.DynamicBatcher(
+    t5.models.hf_server.make_generate_fn(model), max_batch_tokens=4096)
+server = t5.models.hf_server.InferenceServer(
+    batcher, t5.models.hf_server.make_encode_fn(max_input_length=512))
+asyncio.run(server.serve(port=8080))
+```
+"""
+
+import asyncio
+import collections
+import concurrent.futures
+import json
+import time
+
+from absl import logging
+import numpy as np
+import t5.data
+import torch
+
+
+def make_encode_fn(max_input_length, vocabulary=None):
+  """Returns a function encoding a prompt the same way as `predict` does.
+
+  Args:
+    max_input_length: int, prompts are truncated to this many tokens, and
+      truncated prompts end with EOS.
+    vocabulary: seqio.Vocabulary for the inputs or None (default) to use the
+      default T5 SentencePieceVocabulary.
+
+  Returns:
+    A function mapping a str to a list of token ids.
+  """
+  vocabulary = vocabulary or t5.data.get_default_vocabulary()
+
+  def encode_fn(prompt):
+    tokens = list(vocabulary.encode(prompt))[:max_input_length]
+    if len(tokens) == max_input_length:
+      # Like `transformer_dataset.ensure_dataset_eos`.
+      tokens[-1] = min(tokens[-1], 1)
+    return tokens
+
+  return encode_fn
+
+
+def make_generate_fn(model, vocabulary=None, **generate_kwargs):
+  """Returns a function generating predictions for a group of prompts.
+
+  Args:
+    model: an HfPyTorchModel.
+    vocabulary: seqio.Vocabulary used to decode predictions or None (default)
+      to use the default T5 SentencePieceVocabulary.
+    **generate_kwargs: Additional keyword arguments to pass to
+      `transformers.PretrainedModel.generate()`.
+
+  Returns:
+    A function mapping a list of token id lists to a list of decoded
+    predictions.
+  """
+  vocabulary = vocabulary or t5.data.get_default_vocabulary()
+
+  def generate_fn(token_ids):
+    input_ids = np.zeros(
+        (len(token_ids), max(len(t) for t in token_ids)), dtype=np.int64)
+    for i, t in enumerate(token_ids):
+      input_ids[i, :len(t)] = t
+    model.model.eval()
+    with torch.no_grad():
+      predicted_tokens = model.model.generate(
+          input_ids=model.to_tensor(input_ids),
+          attention_mask=model.to_tensor(input_ids > 0),
+          **generate_kwargs)
+    return [
+        vocabulary.decode(p) for p in predicted_tokens.cpu().numpy().tolist()
+    ]
+
+  return generate_fn
+
+
+class _Request(object):
+  """A prompt waiting in a DynamicBatcher."""
+
+  def __init__(self, tokens, future):
+    self.tokens = tokens
+    self.future = future
+    self.start_time = time.time()
+
+
+class DynamicBatcher(object):
+  """Groups queued prompts of similar length into batches for `generate`.
+
+  Requests are collected until the queued prompts fill a batch or the oldest
+  one has waited `max_wait_secs`. The collected prompts are then sorted by
+  length and split into groups whose padded size, i.e. the number of prompts
+  times the longest prompt, is at most `max_batch_tokens`. Each group is
+  passed to `generate_fn` on a worker thread so that the event loop keeps
+  accepting requests.
+  """
+
+  def __init__(self, generate_fn, max_batch_tokens=4096, max_batch_size=64,
+               max_wait_secs=0.01, num_latencies=10000):
+    """DynamicBatcher constructor.
+
+    Args:
+      generate_fn: function, takes a list of token id lists and returns a list
+        with one prediction per prompt.
+      max_batch_tokens: int, maximum number of padded input tokens per group.
+        Prompts longer than this are run alone.
+      max_batch_size: int, maximum number of prompts per group.
+      max_wait_secs: float, maximum time a prompt waits for others to arrive
+        before its batch is run.
+      num_latencies: int, number of most recent request latencies to keep for
+        computing latency percentiles.
+    """
+    self._generate_fn = generate_fn
+    self._max_batch_tokens = max_batch_tokens
+    self._max_batch_size = max_batch_size
+    self._max_wait_secs = max_wait_secs
+    self._queue = None
+    self._task = None
+    # A single worker thread since the model runs one batch at a time.
+    self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    self._num_requests = 0
+    self._num_batches = 0
+    self._num_padded_tokens = 0
+    self._num_tokens = 0
+    self._latencies = collections.deque(maxlen=num_latencies)
+
+  def start(self):
+    """Starts processing requests on the running event loop."""
+    self._queue = asyncio.Queue()
+    self._task = asyncio.get_running_loop().create_task(self._run())
+
+  async def stop(self):
+    """Stops processing requests."""
+    self._task.cancel()
+    try:
+      await self._task
+    except asyncio.CancelledError:
+      pass
+    self._executor.shutdown()
+
+  async def submit(self, tokens):
+    """Returns the prediction for a prompt of token ids once it is ready."""
+    request = _Request(tokens, asyncio.get_running_loop().create_future())
+    self._queue.put_nowait(request)
+    return await request.future
+
+  def stats(self):
+    """Returns request, batch, padding and latency counters."""
+    stats = {
+        "requests": self._num_requests,
+        "batches": self._num_batches,
+        "queued": self._queue.qsize() if self._queue else 0,
+        "mean_batch_size": self._num_requests / max(self._num_batches, 1),
+        "padding_fraction": 1 - self._num_tokens / max(
+            self._num_padded_tokens, 1),
+    }
+    if self._latencies:
+      stats["latency_p50_secs"], stats["latency_p99_secs"] = np.percentile(
+          self._latencies, [50, 99])
+    return stats
+
+  def _is_full(self, requests):
+    if len(requests) >= self._max_batch_size:
+      return True
+    max_length = max(len(r.tokens) for r in requests)
+    return len(requests) * max_length >= self._max_batch_tokens
+
+  def _group(self, requests):
+    """Splits requests into groups of similar length within the budgets."""
+    groups = []
+    group = []
+    for request in sorted(requests, key=lambda r: len(r.tokens)):
+      # Requests are sorted, so the new request is the longest of the group.
+      padded_tokens = (len(group) + 1) * len(request.tokens)
+      if group and (len(group) == self._max_batch_size or
+                    padded_tokens > self._max_batch_tokens):
+        groups.append(group)
+        group = []
+      group.append(request)
+    if group:
+      groups.append(group)
+    return groups
+
+  async def _run(self):
+    """Collects and runs batches of queued requests until cancelled."""
+    while True:
+      requests = [await self._queue.get()]
+      deadline = requests[0].start_time + self._max_wait_secs
+      while not self._is_full(requests):
+        if not self._queue.empty():
+          requests.append(self._queue.get_nowait())
+          continue
+        timeout = deadline - time.time()
+        if timeout <= 0:
+          break
+        try:
+          requests.append(
+              await asyncio.wait_for(self._queue.get(), timeout=timeout))
+        except asyncio.TimeoutError:
+          break
+
+      for group in self._group(requests):
+        group = [r for r in group if not r.future.cancelled()]
+        if group:
+          await self._process(group)
+
+  async def _process(self, group):
+    """Runs `generate_fn` over a group and sets the results of its requests."""
+    # Any failure is passed on to the group's requests so that the loop keeps
+    # serving the others.
+    try:
+      predictions = list(await asyncio.get_running_loop().run_in_executor(
+          self._executor, self._generate_fn, [r.tokens for r in group]))
+      if len(predictions) != len(group):
+        raise ValueError("{} predictions for a batch of {} prompts.".format(
+            len(predictions), len(group)))
+      end = time.time()
+      for r, prediction in zip(group, predictions):
+        if not r.future.done():
+          r.future.set_result(prediction)
+        self._latencies.append(end - r.start_time)
+      self._num_requests += len(group)
+      self._num_batches += 1
+      self._num_tokens += sum(len(r.tokens) for r in group)
+      self._num_padded_tokens += len(group) * max(
+          len(r.tokens) for r in group)
+    except Exception as e:  # pylint:disable=broad-except
+      logging.exception("Generation failed for a batch of %d prompts.",
+                        len(group))
+      for r in group:
+        if not r.future.done():
+          r.future.set_exception(e)
+
+
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found",
+            500: "Internal Server Error"}
+
+
+class InferenceServer(object):
+  """A minimal asyncio HTTP/1.1 server in front of a DynamicBatcher."""
+
+  def __init__(self, batcher, encode_fn):
+    """InferenceServer constructor.
+
+    Args:
+      batcher: a DynamicBatcher.
+      encode_fn: function, maps a prompt str to a list of token ids.
+    """
+    self._batcher = batcher
+    self._encode_fn = encode_fn
+
+  async def serve(self, host="localhost", port=None, unix_socket=None,
+                  ready=None):
+    """Serves requests until cancelled.
+
+    Args:
+      host: str, address to listen on with TCP.
+      port: int, port to listen on with TCP. Use 0 to pick a free port.
+      unix_socket: str, path of a Unix socket to listen on instead of TCP.
+      ready: optional asyncio.Future, set to the listening server's sockets
+        once it accepts connections.
+    """
+    self._batcher.start()
+    if unix_socket:
+      server = await asyncio.start_unix_server(
+          self._handle_connection, path=unix_socket)
+    else:
+      server = await asyncio.start_server(
+          self._handle_connection, host=host, port=port)
+    logging.info("Serving on %s",
+                 ", ".join(str(s.getsockname()) for s in server.sockets))
+    if ready is not None:
+      ready.set_result(server.sockets)
+    try:
+      async with server:
+        await server.serve_forever()
+    finally:
+      await self._batcher.stop()
+
+  async def _route(self, method, path, body):
+    """Returns the (status, response) for a request."""
+    if method == "GET" and path == "/metrics":
+      return 200, self._batcher.stats()
+    if method == "POST" and path == "/predict":
+      try:
+        inputs = json.loads(body)["inputs"]
+        if isinstance(inputs, str):
+          inputs = [inputs]
+        tokens = [self._encode_fn(x) for x in inputs]
+      except (ValueError, KeyError, TypeError) as e:
+        return 400, {"error": str(e)}
+      try:
+        outputs = await asyncio.gather(
+            *[self._batcher.submit(t) for t in tokens])
+      except Exception as e:  # pylint:disable=broad-except
+        return 500, {"error": str(e)}
+      return 200, {"outputs": list(outputs)}
+    return 404, {"error": "No route for {} {}".format(method, path)}
+
+  async def _handle_connection(self, reader, writer):
+    """Serves the requests of a keep-alive connection."""
+    try:
+      while True:
+        request_line = await reader.readline()
+        if not request_line.strip():
+          break
+        method, path = request_line.decode("latin-1").split()[:2]
+        headers = {}
+        while True:
+          line = await reader.readline()
+          if not line.strip():
+            break
+          key, value = line.decode("latin-1").split(":", 1)
+          headers[key.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+        status, response = await self._route(method, path, body)
+        payload = json.dumps(response).encode("utf-8")
+        writer.write(
+            "HTTP/1.1 {} {}\r\nContent-Type: application/json\r\n"
+            "Content-Length: {}\r\n\r\n".format(
+                status, _REASONS[status], len(payload)).encode("latin-1") +
+            payload)
+        await writer.drain()
+        if headers.get("connection", "").lower() == "close":
+          break
+    except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+      pass
+    finally:
+      writer.close()
@@ -0,0 +1,130 @@
+# Copyright 2023 The T5 Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for t5.models.hf_server."""
+
+import asyncio
+import functools
+import json
+
+from absl.testing import absltest
+import seqio
+from t5.models import hf_server
+import torch
+import transformers
+
+
+async def _post(port, body):
+  reader, writer = await asyncio.open_connection("localhost", port)
+  payload = json.dumps(body).encode("utf-8")
+  writer.write(
+      b"POST /predict HTTP/1.1\r\nContent-Length: %d\r\n"
+      b"Connection: close\r\n\r\n%s" % (len(payload), payload))
+  response = await reader.read()
+  writer.close()
+  head, body = response.split(b"\r\n\r\n", 1)
+  return int(head.split()[1]), json.loads(body)
+
+
+class DynamicBatcherTest(absltest.TestCase):
+
+  def test_group(self):
+    batcher = hf_server.DynamicBatcher(
+        None, max_batch_tokens=12, max_batch_size=3)
+    requests = [
+        hf_server._Request(list(range(n)), None) for n in [5, 1, 2, 20, 3, 2]
+    ]
+    groups = batcher._group(requests)
+    self.assertEqual([[len(r.tokens) for r in g] for g in groups],
+                     [[1, 2, 2], [3, 5], [20]])
+
+  def test_server(self):
+    batches = []
+
+    def generate_fn(token_ids):
+      batches.append(token_ids)
+      return ["%d tokens" % len(t) for t in token_ids]
+
+    async def run():
+      batcher = hf_server.DynamicBatcher(
+          generate_fn, max_batch_tokens=100, max_wait_secs=0.05)
+      server = hf_server.InferenceServer(batcher, lambda x: x.split())
+      ready = asyncio.get_running_loop().create_future()
+      serve = asyncio.create_task(server.serve(port=0, ready=ready))
+      port = (await ready)[0].getsockname()[1]
+      responses = await asyncio.gather(
+          _post(port, {"inputs": ["a b", "a"]}),
+          _post(port, {"inputs": "a b c"}),
+          _post(port, {"prompts": []}))
+      stats = batcher.stats()
+      serve.cancel()
+      return responses, stats
+
+    responses, stats = asyncio.run(run())
+    self.assertEqual(responses, [
+        (200, {"outputs": ["2 tokens", "1 tokens"]}),
+        (200, {"outputs": ["3 tokens"]}),
+        (400, {"error": "'inputs'"}),
+    ])
+    # All prompts arrived within the wait deadline, so they form one batch.
+    self.assertEqual(batches, [[["a"], ["a", "b"], ["a", "b", "c"]]])
+    self.assertEqual(stats["requests"], 3)
+    self.assertEqual(stats["batches"], 1)
+    self.assertIn("latency_p99_secs", stats)
+
+  def test_bad_batch(self):
+    calls = []
+
+    def generate_fn(token_ids):
+      calls.append(token_ids)
+      if len(calls) == 1:
+        return []
+      return ["%d tokens" % len(t) for t in token_ids]
+
+    async def run():
+      batcher = hf_server.DynamicBatcher(generate_fn, max_wait_secs=0)
+      batcher.start()
+      with self.assertRaisesRegex(ValueError, "0 predictions"):
+        await batcher.submit([1, 2])
+      # The failed batch does not stop later batches.
+      prediction = await batcher.submit([1])
+      await batcher.stop()
+      return prediction
+
+    self.assertEqual(asyncio.run(run()), "1 tokens")
+
+  def test_make_generate_fn(self):
+    config = transformers.T5Config(
+        vocab_size=260, d_model=8, d_kv=4, d_ff=16, num_layers=1, num_heads=2,
+        decoder_start_token_id=0)
+    torch.manual_seed(0)
+    model = absltest.mock.Mock()
+    model.model = transformers.T5ForConditionalGeneration(config)
+    model.to_tensor = functools.partial(torch.as_tensor, dtype=torch.long)
+    vocabulary = seqio.ByteVocabulary()
+    encode_fn = hf_server.make_encode_fn(8, vocabulary)
+    generate_fn = hf_server.make_generate_fn(
+        model, vocabulary, max_length=5, do_sample=False)
+
+    prompts = ["a much longer prompt", "short"]
+    token_ids = [encode_fn(p) for p in prompts]
+    self.assertLen(token_ids[0], 8)
+    self.assertEqual(token_ids[0][-1], 1)
+    # Padding the shorter prompt must not change its prediction.
+    self.assertEqual(generate_fn(token_ids),
+                     [generate_fn([t])[0] for t in token_ids])
+
+
+if __name__ == "__main__":
+  absltest.main()
@@ -167,11 +167,15 @@ def mesh_inference_dataset_fn(
       if not priming_sequence_length or priming_sequence_length <= 0:
         logging.warning("Priming sequence length not specified so priming "
                         "with the empty string.")
-        ds = ds.map(_prepare_for_unprimed_inference)
+        ds = ds.map(
+            _prepare_for_unprimed_inference,
+            num_parallel_calls=tf.data.experimental.AUTOTUNE)
       else:
         logging.info("Using the first %d tokens of each target as input.",
                      priming_sequence_length)
-        ds = ds.map(_split_targets_for_primed_inference)
+        ds = ds.map(
+            _split_targets_for_primed_inference,
+            num_parallel_calls=tf.data.experimental.AUTOTUNE)
     elif priming_sequence_length is not None:
       raise ValueError(
           "Setting a priming sequence length only makes sense for decoder-only "
@@ -14,9 +14,15 @@
 
 """Mesh Tensorflow T5 Model."""
 
+import collections
 import functools
+import json
 import os
+import socketserver
+import time
+import uuid
 
+from absl import logging
 import gin
 import gin.tf
 import mesh_tensorflow as mtf
@@ -24,10 +30,12 @@ from mesh_tensorflow import optimize
 from mesh_tensorflow.transformer import dataset as transformer_dataset
 from mesh_tensorflow.transformer import learning_rate_schedules
 from mesh_tensorflow.transformer import utils as mtf_utils
+import numpy as np
 from t5.models import mesh_transformer
 from t5.models import utils
 from t5.models.t5_model import T5Model
 import tensorflow.compat.v1 as tf
+import tensorflow_datasets as tfds
 
 
 def _parse_operative_config(model_dir):
@@ -37,6 +45,260 @@ def _parse_operative_config(model_dir):
         skip_unknown=mesh_transformer.DEPRECATED_GIN_REFERENCES)
 
 
+def _pad_eval_features(tasks, datasets, sequence_length):
+  """Pads the cached eval examples of `tasks` into fixed-shape arrays.
+
+  The result matches what `mesh_transformer.mesh_eval_dataset_fn` produces for
+  each task when given `sequence_length`, with the examples of all tasks
+  concatenated.
+
+  Args:
+    tasks: list, tasks whose examples to pad, in order.
+    datasets: dict mapping task names to cached, unpadded eval datasets.
+    sequence_length: dict mapping feature names to their padded length.
+
+  Returns:
+    A dict mapping model feature names to arrays of shape
+    [num_examples, sequence_length].
+  """
+  features = collections.defaultdict(list)
+  for task in tasks:
+    eos_keys = {k for k, f in task.output_features.items() if f.add_eos}
+    for ex in tfds.as_numpy(datasets[task.name]):
+      for k, v in utils.filter_features(ex).items():
+        padded = np.zeros(sequence_length[k], dtype=v.dtype)
+        v = v[:sequence_length[k]]
+        padded[:len(v)] = v
+        # Like `transformer_dataset.ensure_dataset_eos`, replace a truncated
+        # final token with EOS.
+        if k in eos_keys:
+          padded[-1] = min(padded[-1], 1)
+        features[k].append(padded)
+  return {k: np.stack(v) for k, v in features.items()}
+
+
+def _features_input_fn(features, batch_size, records_file):
+  """Returns an estimator input_fn serving `features` in full batches.
+
+  The batches are written once to `records_file` and read back with a
+  `TFRecordDataset`, so that the input_fn does not depend on Python state and
+  can be run by remote TPU input workers.
+
+  Args:
+    features: dict mapping feature names to integer arrays of shape
+      [num_examples, length].
+    batch_size: int, the final batch is padded with empty examples to this
+      size.
+    records_file: str, path of the TFRecord file to write, with one
+      `tf.train.Example` per batch. It must be readable by the input workers.
+
+  Returns:
+    An input_fn for `mtf_utils.decode` or `mtf_utils.score_with_estimator`.
+  """
+  num_pad = -len(next(iter(features.values()))) % batch_size
+  features = {k: np.pad(v, [(0, num_pad), (0, 0)]) for k, v in features.items()}
+  num_examples = len(next(iter(features.values())))
+
+  tf.io.gfile.makedirs(os.path.dirname(records_file))
+  with tf.io.TFRecordWriter(records_file) as writer:
+    for i in range(0, num_examples, batch_size):
+      example = tf.train.Example(features=tf.train.Features(feature={
+          k: tf.train.Feature(int64_list=tf.train.Int64List(
+              value=v[i:i + batch_size].ravel().tolist()))
+          for k, v in features.items()
+      }))
+      writer.write(example.SerializeToString())
+
+  shapes = {k: [batch_size, v.shape[1]] for k, v in features.items()}
+  dtypes = {k: tf.as_dtype(v.dtype) for k, v in features.items()}
+  feature_spec = {
+      k: tf.io.FixedLenFeature([np.prod(shape)], tf.int64)
+      for k, shape in shapes.items()
+  }
+
+  def _parse(record):
+    parsed = tf.io.parse_single_example(record, feature_spec)
+    return {k: tf.cast(tf.reshape(v, shapes[k]), dtypes[k])
+            for k, v in parsed.items()}
+
+  def estimator_input_fn(params):
+    """Eval input function for estimator."""
+    del params
+    ds = tf.data.TFRecordDataset(records_file)
+    ds = ds.map(_parse, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+    return ds.prefetch(tf.data.experimental.AUTOTUNE)
+
+  return estimator_input_fn
+
+
+def _first_batch_seconds(estimator_input_fn):
+  """Returns the seconds `estimator_input_fn` takes to produce a batch.
+
+  The input pipeline is built in a separate graph and session, so the time
+  includes building the datasets and preprocessing the first batch.
+
+  Args:
+    estimator_input_fn: an eval input_fn taking a `params` dict.
+
+  Returns:
+    float, the elapsed time in seconds.
+  """
+  start = time.time()
+  with tf.Graph().as_default():
+    iterator = tf.data.make_initializable_iterator(estimator_input_fn({}))
+    batch = iterator.get_next()
+    with tf.Session() as sess:
+      sess.run([iterator.initializer, tf.tables_initializer()])
+      sess.run(batch)
+  return time.time() - start
+
+
+def _length_buckets(features, batch_size, num_buckets):
+  """Groups examples into buckets of similar input length.
+
+  Examples are sorted by input length and split into `num_buckets` buckets with
+  about the same number of full batches, so that only the last bucket has a
+  partial batch.
+
+  Args:
+    features: dict mapping feature names to padded arrays of shape
+      [num_examples, length].
+    batch_size: int, the number of examples per batch.
+    num_buckets: int, the maximum number of buckets.
+
+  Returns:
+    A list of (indices, sequence_length) tuples, where indices are the
+    positions of the bucket's examples in `features` and sequence_length maps
+    each feature to the longest example in the bucket. The concatenated
+    indices form a permutation of all examples.
+  """
+  # Padding only occurs at the end of each example.
+  lengths = {
+      k: np.max(np.where(v != 0, np.arange(1, v.shape[1] + 1), 0), axis=1)
+      for k, v in features.items()
+  }
+  order = np.argsort(lengths["inputs"], kind="stable")
+  num_batches = -(-len(order) // batch_size)
+  buckets = []
+  for batches in np.array_split(np.arange(num_batches), num_buckets):
+    if not batches.size:
+      continue
+    indices = order[batches[0] * batch_size:(batches[-1] + 1) * batch_size]
+    buckets.append((indices, {
+        k: max(int(np.max(l[indices])), 1) for k, l in lengths.items()
+    }))
+  return buckets
+
+
+class MtfPredictor(object):
+  """Decodes or scores strings with a Mesh TF model loaded once on CPU.
+
+  The model is loaded from a SavedModel exported with `MtfModel.export`, so
+  that repeated calls do not parse the operative config, build an estimator or
+  restore checkpoint weights again. Concurrent calls are grouped into batches
+  of the exported batch size by a `utils.MicroBatcher`.
+
+  Use `MtfModel.predictor` to export and load a model in one step.
+  """
+
+  def __init__(self, export_dir, batch_size, eval_with_score=False,
+               max_wait_secs=0.0):
+    """MtfPredictor constructor.
+
+    Args:
+      export_dir: str, path to a SavedModel exported with `MtfModel.export`.
+      batch_size: int, the batch size the model was exported with.
+      eval_with_score: bool, whether the model was exported to compute
+        log-likelihood scores of targets instead of decoding.
+      max_wait_secs: float, how long to wait for concurrent requests before
+        running a partial batch.
+    """
+    self.export_dir = export_dir
+    self._graph = tf.Graph()
+    self._session = tf.Session(graph=self._graph)
+    with self._graph.as_default():
+      meta_graph = tf.saved_model.loader.load(
+          self._session, [tf.saved_model.tag_constants.SERVING], export_dir)
+    signature = meta_graph.signature_def[
+        tf.saved_model.signature_constants.DEFAULT_SERVING_SIGNATURE_DEF_KEY]
+    self._input_names = {k: v.name for k, v in signature.inputs.items()}
+    self._output_name = signature.outputs[
+        "scores" if eval_with_score else "outputs"].name
+    self._eval_with_score = eval_with_score
+    self._batcher = utils.MicroBatcher(
+        self._run_batch, batch_size, max_wait_secs=max_wait_secs)
+
+  def _run_batch(self, examples):
+    """Runs the model on a batch of example dicts."""
+    feed_dict = {
+        name: [ex[k] for ex in examples]
+        for k, name in self._input_names.items()
+    }
+    outputs = self._session.run(self._output_name, feed_dict=feed_dict)
+    # Scores are computed for the padded batch.
+    outputs = outputs[:len(examples)]
+    if self._eval_with_score:
+      return [float(o) for o in outputs]
+    return [tf.compat.as_text(o) for o in outputs]
+
+  def predict(self, inputs):
+    """Returns the decoded outputs for a list of input strings."""
+    if self._eval_with_score:
+      raise ValueError("This predictor was exported for scoring.")
+    return self._batcher([{"inputs": x} for x in inputs])
+
+  def score(self, targets, inputs=None):
+    """Returns the log-likelihood of each target, given its input if any."""
+    if not self._eval_with_score:
+      raise ValueError("This predictor was exported for decoding.")
+    if inputs is None:
+      examples = [{"targets": t} for t in targets]
+    else:
+      examples = [{"inputs": x, "targets": t} for x, t in zip(inputs, targets)]
+    return self._batcher(examples)
+
+  def stats(self):
+    """Returns request, batch, latency and throughput counters."""
+    return self._batcher.stats()
+
+  def serve(self, port, host="localhost"):
+    """Serves requests on a local socket until interrupted.
+
+    Each request is a line with a JSON object holding a list of "inputs" (and
+    "targets" when scoring), and is answered with a line holding a JSON object
+    with the list of "outputs" or "scores".
+
+    Args:
+      port: int, port to listen on.
+      host: str, address to listen on.
+    """
+    predictor = self
+
+    class _Handler(socketserver.StreamRequestHandler):
+
+      def handle(self):
+        for line in self.rfile:
+          try:
+            request = json.loads(line)
+            if predictor._eval_with_score:  # pylint:disable=protected-access
+              response = {"scores": predictor.score(
+                  request["targets"], request.get("inputs"))}
+            else:
+              response = {"outputs": predictor.predict(request["inputs"])}
+          except Exception as e:  # pylint:disable=broad-except
+            response = {"error": str(e)}
+          self.wfile.write(json.dumps(response).encode("utf-8") + b"\n")
+
+    with socketserver.ThreadingTCPServer((host, port), _Handler) as server:
+      logging.info("Serving %s predictions on %s:%d",
+                   "score" if self._eval_with_score else "decode", host, port)
+      server.serve_forever()
+
+  def close(self):
+    self._batcher.close()
+    self._session.close()
+
+
 @gin.configurable
 class MtfModel(T5Model):
   """Wrapper class for Mesh-TF models."""
@@ -239,6 +501,9 @@ class MtfModel(T5Model):
                            sequence_length,
                            split,
                            eval_with_score=False,
+                           datasets=None,
+                           padded_features_cache=None,
+                           num_length_buckets=1,
                            **unused_kwargs):
     """Helper function used by eval method to generate predictions or scores.
 
@@ -252,12 +517,91 @@ class MtfModel(T5Model):
       split: string, split to run the evaluation on.
       eval_with_score: bool, whether to compute log likelihood of targets
         instead of predictions.
+      datasets: optional dict mapping task names to the cached, unpadded eval
+        datasets built by `utils.run_eval`.
+      padded_features_cache: optional dict. If provided along with `datasets`,
+        the examples in `datasets` are padded once per sequence length,
+        written to TFRecord files under `model_dir/eval_inputs` and their
+        input functions stored here for reuse across checkpoints, instead of
+        rebuilding each task's dataset for every checkpoint.
+      num_length_buckets: int, if greater than 1 and the cached datasets are
+        used, examples are sorted by input length and evaluated in up to this
+        many buckets, each padded only to its own longest example. Outputs are
+        returned in the original dataset order.
     Returns:
       list of decoded predictions or scores depending on eval_with_score flag.
     """
-    estimator = self.estimator(
-        vocabulary, score_in_predict_mode=eval_with_score,
-        sequence_length=sequence_length)
+    def _predict_or_score(estimator_input_fn, sequence_length):
+      estimator = self.estimator(
+          vocabulary, score_in_predict_mode=eval_with_score,
+          sequence_length=sequence_length)
+      checkpoint_path = os.path.join(self._model_dir,
+                                     "model.ckpt-{}".format(checkpoint_step))
+      if eval_with_score:
+        outputs, _ = mtf_utils.score_with_estimator(
+            estimator,
+            estimator_input_fn,
+            checkpoint_step,
+            self._model_dir,
+            vocabulary)
+      else:
+        outputs = [
+            tf.compat.as_text(d) for d in mtf_utils.decode(
+                estimator, estimator_input_fn, vocabulary, checkpoint_path)
+        ]
+      return outputs
+
+    if datasets is not None and padded_features_cache is not None:
+      cache_key = tuple(sorted(sequence_length.items()))
+      if cache_key not in padded_features_cache:
+        start = time.time()
+        padded_features = _pad_eval_features(tasks, datasets, sequence_length)
+        if num_length_buckets > 1:
+          buckets = _length_buckets(
+              padded_features, self.batch_size, num_length_buckets)
+        else:
+          buckets = [(None, dict(sequence_length))]
+        inputs_dir = os.path.join(
+            self._model_dir, "eval_inputs", uuid.uuid4().hex)
+        eval_inputs = []
+        for i, (indices, bucket_length) in enumerate(buckets):
+          if indices is None:
+            bucket_features = padded_features
+          else:
+            if not eval_with_score:
+              # The decode length does not depend on the targets.
+              bucket_length["targets"] = sequence_length["targets"]
+            bucket_features = {
+                k: v[indices, :bucket_length[k]]
+                for k, v in padded_features.items()
+            }
+          eval_inputs.append((indices, bucket_length, _features_input_fn(
+              bucket_features, self.batch_size,
+              os.path.join(inputs_dir, "bucket-{}.tfrecord".format(i)))))
+        logging.info("Padded and wrote cached eval examples to %s in %.2f "
+                     "seconds.", inputs_dir, time.time() - start)
+        logging.info("Produced the first cached eval batch in %.2f seconds.",
+                     _first_batch_seconds(eval_inputs[0][2]))
+        padded_features_cache[cache_key] = eval_inputs
+      eval_inputs = padded_features_cache[cache_key]
+
+      if eval_inputs[0][0] is None:
+        _, bucket_length, bucket_input_fn = eval_inputs[0]
+        return _predict_or_score(bucket_input_fn, bucket_length)
+
+      outputs = []
+      permutation = []
+      for indices, bucket_length, bucket_input_fn in eval_inputs:
+        logging.info("Evaluating %d examples with sequence lengths %s",
+                     len(indices), bucket_length)
+        outputs.extend(_predict_or_score(bucket_input_fn, bucket_length))
+        permutation.extend(indices)
+      # Un-permute the outputs back to dataset order. Only the last bucket
+      # has a partial batch, so its padding outputs remain at the end.
+      unpermuted = [None] * len(permutation)
+      for i, output in zip(permutation, outputs):
+        unpermuted[i] = output
+      return unpermuted + outputs[len(permutation):]
 
     def estimator_input_fn(params):
       """Eval input function for estimator."""
@@ -280,22 +624,9 @@ class MtfModel(T5Model):
       combined_ds = combined_ds.prefetch(tf.data.experimental.AUTOTUNE)
       return combined_ds
 
-    checkpoint_path = os.path.join(self._model_dir,
-                                   "model.ckpt-{}".format(checkpoint_step))
-    if eval_with_score:
-      outputs, _ = mtf_utils.score_with_estimator(
-          estimator,
-          estimator_input_fn,
-          checkpoint_step,
-          self._model_dir,
-          vocabulary)
-    else:
-      outputs = [
-          tf.compat.as_text(d) for d in mtf_utils.decode(
-              estimator, estimator_input_fn, vocabulary, checkpoint_path)
-      ]
-
-    return outputs
+    logging.info("Produced the first eval batch in %.2f seconds.",
+                 _first_batch_seconds(estimator_input_fn))
+    return _predict_or_score(estimator_input_fn, sequence_length)
 
   def eval(self,
            mixture_or_task_name,
@@ -303,7 +634,9 @@ class MtfModel(T5Model):
            summary_dir=None,
            split="validation",
            eval_with_score=False,
-           compute_sequence_length=True):
+           compute_sequence_length=True,
+           use_cached_datasets=True,
+           num_length_buckets=1):
     """Evaluate the model on the given Mixture or Task.
 
     Args:
@@ -322,7 +655,16 @@ class MtfModel(T5Model):
         targets instead of decoded predictions.
       compute_sequence_length: bool, automatically compute maximum sequence
         length to use during eval mode.
+      use_cached_datasets: bool, whether to decode the examples cached by
+        `utils.run_eval`, padded once, instead of rebuilding and preprocessing
+        each task's dataset for every checkpoint.
+      num_length_buckets: int, if greater than 1, sort the eval examples by
+        input length and decode or score them in up to this many buckets with
+        shorter sequence lengths, to reduce time spent on padding. Each bucket
+        builds its own estimator and graph. Requires `use_cached_datasets`.
     """
+    if num_length_buckets > 1 and not use_cached_datasets:
+      raise ValueError("num_length_buckets > 1 requires use_cached_datasets.")
     _parse_operative_config(self._model_dir)
 
     summary_dir = summary_dir or os.path.join(self._model_dir,
@@ -342,9 +684,12 @@ class MtfModel(T5Model):
 
     utils.run_eval(
         mixture_or_task_name=mixture_or_task_name,
-        predict_or_score_fn=functools.partial(self._predict_or_score_fn,
-                                              eval_with_score=eval_with_score,
-                                              split=split),
+        predict_or_score_fn=functools.partial(
+            self._predict_or_score_fn,
+            eval_with_score=eval_with_score,
+            split=split,
+            padded_features_cache={} if use_cached_datasets else None,
+            num_length_buckets=num_length_buckets),
         checkpoint_steps=checkpoint_steps,
         dataset_fn=_get_task_eval_dataset,
         summary_dir=summary_dir,
@@ -408,10 +753,8 @@ class MtfModel(T5Model):
       vocabulary: vocabularies.Vocabulary object to use for tokenization, or
         None to use the default SentencePieceVocabulary.
     """
-    # TODO(sharannarang) : It would be nice to have a function like
-    # load_checkpoint that loads the model once and then call decode_from_file
-    # multiple times without having to restore the checkpoint weights again.
-    # This would be particularly useful in colab demo.
+    # To load the checkpoint weights once and predict many times, e.g. in a
+    # colab demo, use `predictor` instead.
 
     if checkpoint_steps == -1:
       checkpoint_steps = utils.get_latest_checkpoint_from_dir(self._model_dir)
@@ -547,3 +890,45 @@ class MtfModel(T5Model):
         self._sequence_length, self._model_type, batch_size=self.batch_size,
         checkpoint_path=os.path.join(self._model_dir, model_ckpt),
         eval_with_score=eval_with_score)
+
+  def predictor(self, checkpoint_step=-1, beam_size=1, temperature=1.0,
+                keep_top_k=-1, vocabulary=None, eval_with_score=False,
+                export_dir=None, max_wait_secs=0.0, saved_model_dir=None):
+    """Exports a checkpoint for CPU inference and loads it once for serving.
+
+    Exporting builds an estimator and restores the checkpoint, so pass the
+    `export_dir` attribute of a previous predictor, or the path returned by
+    `export`, as `saved_model_dir` to load that export again instead.
+
+    Args:
+      checkpoint_step: int, checkpoint to load. If -1 (default), use the latest
+        checkpoint from the model directory.
+      beam_size: int, a number >= 1 specifying the number of beams to use for
+        beam search.
+      temperature: float, a value between 0 and 1 (must be 0 if beam_size > 1)
+        0.0 means argmax, 1.0 means sample according to predicted distribution.
+      keep_top_k: integer, a value between 1 and the vocabulary size. When
+        sampling, only pick tokens that are in the k most likely.
+      vocabulary: vocabularies.Vocabulary object to use for tokenization, or
+        None to use the default SentencePieceVocabulary.
+      eval_with_score: If True, serve log-likelihood scores of targets.
+        If False, serve decoded outputs.
+      export_dir: str, a directory in which to export the SavedModel. Will use
+        `model_dir` if unspecified.
+      max_wait_secs: float, how long to wait for concurrent requests before
+        running a partial batch.
+      saved_model_dir: str, path to a SavedModel previously exported from this
+        model with the same `eval_with_score`. If given, it is loaded instead
+        of exporting a checkpoint, and the export arguments are ignored.
+
+    Returns:
+      An MtfPredictor.
+    """
+    if saved_model_dir is None:
+      saved_model_dir = self.export(
+          export_dir=export_dir, checkpoint_step=checkpoint_step,
+          beam_size=beam_size, temperature=temperature, keep_top_k=keep_top_k,
+          vocabulary=vocabulary, eval_with_score=eval_with_score)
+    return MtfPredictor(
+        tf.compat.as_text(saved_model_dir), self.batch_size,
+        eval_with_score=eval_with_score, max_wait_secs=max_wait_secs)
@@ -0,0 +1,83 @@
+# Copyright 2023 The T5 Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for t5.models.mtf_model."""
+
+import concurrent.futures
+import os
+
+from absl.testing import absltest
+from t5.models import mtf_model
+import tensorflow.compat.v1 as tf
+
+
+def _export_string_model(export_dir, eval_with_score=False):
+  """Exports a SavedModel with the string signature of `MtfModel.export`."""
+  with tf.Graph().as_default():
+    inputs = tf.placeholder(tf.string, [None], name="inputs")
+    signature_inputs = {"inputs": inputs}
+    if eval_with_score:
+      targets = tf.placeholder(tf.string, [None], name="targets")
+      signature_inputs["targets"] = targets
+      signature_outputs = {
+          "scores": -tf.cast(tf.strings.length(targets), tf.float32)
+      }
+    else:
+      signature_outputs = {
+          "outputs": tf.strings.join([tf.strings.upper(inputs), "!"])
+      }
+    builder = tf.saved_model.builder.SavedModelBuilder(export_dir)
+    with tf.Session() as sess:
+      builder.add_meta_graph_and_variables(
+          sess, [tf.saved_model.tag_constants.SERVING],
+          signature_def_map={
+              tf.saved_model.signature_constants
+              .DEFAULT_SERVING_SIGNATURE_DEF_KEY:
+                  tf.saved_model.signature_def_utils.predict_signature_def(
+                      signature_inputs, signature_outputs)
+          })
+    builder.save()
+
+
+class MtfPredictorTest(absltest.TestCase):
+
+  def test_predict(self):
+    export_dir = os.path.join(self.create_tempdir().full_path, "export")
+    _export_string_model(export_dir)
+    predictor = mtf_model.MtfPredictor(export_dir, batch_size=2)
+    self.assertEqual(predictor.export_dir, export_dir)
+    self.assertEqual(predictor.predict(["a", "bc", "d"]), ["A!", "BC!", "D!"])
+    with concurrent.futures.ThreadPoolExecutor(4) as pool:
+      outputs = list(pool.map(lambda x: predictor.predict([x]), "wxyz"))
+    self.assertEqual(outputs, [["W!"], ["X!"], ["Y!"], ["Z!"]])
+    with self.assertRaisesRegex(ValueError, "decoding"):
+      predictor.score(["a"])
+    self.assertEqual(predictor.stats()["examples"], 7)
+    predictor.close()
+
+  def test_score(self):
+    export_dir = os.path.join(self.create_tempdir().full_path, "export")
+    _export_string_model(export_dir, eval_with_score=True)
+    predictor = mtf_model.MtfPredictor(
+        export_dir, batch_size=2, eval_with_score=True)
+    self.assertEqual(
+        predictor.score(["a", "bc", "def"], inputs=["x", "y", "z"]),
+        [-1., -2., -3.])
+    with self.assertRaisesRegex(ValueError, "scoring"):
+      predictor.predict(["a"])
+    predictor.close()
+
+
+if __name__ == "__main__":
+  absltest.main()
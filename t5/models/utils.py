@@ -14,9 +14,19 @@
 
 """Utilities for models."""
 
+import bisect
+import collections
+import concurrent.futures
+import ctypes
+import ctypes.util
 import functools
 import os
+import queue
 import re
+import select
+import sys
+import threading
+import time
 from typing import Any, Callable, Iterable, Mapping, MutableSequence, Optional, Sequence, Tuple, Union
 
 from absl import logging
@@ -152,6 +162,155 @@ def get_latest_checkpoint_from_dir(model_dir):
   return int(re.sub(".*ckpt-", "", ckpt))
 
 
+class CheckpointIndex(object):
+  """Sorted index of the checkpoint steps in a model directory.
+
+  The directory is listed once, on construction or `refresh`, and lookups are
+  answered by bisection of the sorted steps.
+  """
+
+  def __init__(self, model_dir):
+    self._model_dir = model_dir
+    self.refresh()
+
+  def refresh(self):
+    """Lists the model directory again."""
+    steps = set()
+    for f in tf.io.gfile.listdir(self._model_dir):
+      try:
+        steps.add(get_step_from_checkpoint_path(f))
+      except ValueError:
+        continue
+    self._steps = sorted(steps)
+
+  @property
+  def steps(self):
+    """Sorted list of the checkpoint steps."""
+    return list(self._steps)
+
+  def closest(self, step):
+    """Returns the checkpoint step closest to `step`, the lower one on ties."""
+    if not self._steps:
+      raise ValueError("No checkpoint files found in {}".format(
+          self._model_dir))
+    i = bisect.bisect_left(self._steps, step)
+    if i == len(self._steps) or (
+        i > 0 and step - self._steps[i - 1] <= self._steps[i] - step):
+      i -= 1
+    closest = self._steps[i]
+    if closest != step:
+      logging.info(
+          "Using checkpoint at step %d which is closest to requested step %d",
+          closest,
+          step,
+      )
+    return closest
+
+
+class _DirectoryNotifier(object):
+  """Waits for files to be written or moved into a local directory.
+
+  Uses Linux inotify through libc. `create` returns None where inotify is not
+  available, e.g. on other platforms or remote filesystems.
+  """
+
+  _IN_CLOSE_WRITE = 0x00000008
+  _IN_MOVED_TO = 0x00000080
+  _IN_CREATE = 0x00000100
+
+  def __init__(self, fd):
+    self._fd = fd
+
+  @classmethod
+  def create(cls, directory):
+    """Returns a notifier for `directory`, or None if it cannot watch it."""
+    if not sys.platform.startswith("linux") or not os.path.isdir(directory):
+      return None
+    try:
+      libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+      fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+      return None
+    if fd < 0:
+      return None
+    mask = cls._IN_CLOSE_WRITE | cls._IN_MOVED_TO | cls._IN_CREATE
+    if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+      os.close(fd)
+      return None
+    return cls(fd)
+
+  def wait(self, timeout):
+    """Waits up to `timeout` seconds for an event, returns whether one came."""
+    readable, _, _ = select.select([self._fd], [], [], timeout)
+    if not readable:
+      return False
+    try:
+      while os.read(self._fd, 4096):
+        pass
+    except BlockingIOError:
+      pass
+    return True
+
+  def close(self):
+    os.close(self._fd)
+
+
+def watch_checkpoints(model_dir, timeout=None, min_poll_secs=1.0,
+                      max_poll_secs=60.0):
+  """Yields the step of each new latest checkpoint in `model_dir`.
+
+  Like `tf.train.checkpoints_iterator`, only the latest checkpoint recorded in
+  the checkpoint state file is yielded, so checkpoints written while the
+  caller is busy are skipped. For a local directory on Linux, the watcher
+  wakes up on filesystem notifications. Otherwise, it polls every
+  `min_poll_secs`, doubling the interval up to `max_poll_secs` while no new
+  checkpoint appears. With notifications, the polling interval only bounds
+  how long a missed notification can delay a checkpoint.
+
+  Args:
+    model_dir: str, model directory.
+    timeout: float, seconds to wait for a new checkpoint before returning, or
+      None to wait forever.
+    min_poll_secs: float, initial polling interval.
+    max_poll_secs: float, maximum polling interval.
+
+  Yields:
+    int, the global step of each new checkpoint.
+  """
+  notifier = _DirectoryNotifier.create(model_dir)
+  if notifier is None:
+    logging.info("Polling %s for new checkpoints.", model_dir)
+  last_checkpoint = None
+  poll_secs = min_poll_secs
+  deadline = None if timeout is None else time.time() + timeout
+  try:
+    while True:
+      checkpoint = tf.train.latest_checkpoint(model_dir)
+      if checkpoint is not None and checkpoint != last_checkpoint:
+        last_checkpoint = checkpoint
+        poll_secs = min_poll_secs
+        yield get_step_from_checkpoint_path(checkpoint)
+        deadline = None if timeout is None else time.time() + timeout
+        continue
+      wait_secs = poll_secs
+      if deadline is not None:
+        wait_secs = min(wait_secs, deadline - time.time())
+        if wait_secs <= 0:
+          logging.info("Timed out waiting for a checkpoint in %s.", model_dir)
+          return
+      if notifier is None:
+        notifier = _DirectoryNotifier.create(model_dir)
+      if notifier is not None:
+        if notifier.wait(wait_secs):
+          continue
+      else:
+        time.sleep(wait_secs)
+      poll_secs = min(poll_secs * 2, max_poll_secs)
+  finally:
+    if notifier is not None:
+      notifier.close()
+
+
 def get_checkpoints_iterator(checkpoint_steps, model_dir):
   """Get checkpoints from model directory.
 
@@ -163,66 +322,37 @@ def get_checkpoints_iterator(checkpoint_steps, model_dir):
       checkpoint_step is a list of ints, replace each int with the path to the
       checkpoint with the closest global step. If checkpoint_step == "all",
       return the path of every checkpoint in model_dir, starting from the
-      earliest checkpoint. if the checkpoint_steps is None, returns step from
-      the tf.train.checkpoint_iterator for continuous eval. If -1, get the
-      latest checkpoint from the model directory.
+      earliest checkpoint. if the checkpoint_steps is None, returns steps from
+      `watch_checkpoints` for continuous eval. If -1, get the latest
+      checkpoint from the model directory.
     model_dir: str, model directory. If model_dir is None, then checkpoint_steps
       must be an integer or list of integers.
   Returns:
     a iterator with the checkpoint steps (integers).
   """
-
-  def _get_closest_checkpoint(target_checkpoint):
-    """Returns checkpoint with closest global step to `target_checkpoint`."""
-    checkpoints = set()
-    for f in tf.io.gfile.listdir(model_dir):
-      try:
-        checkpoints.add(int(get_step_from_checkpoint_path(f)))
-      except ValueError:
-        continue
-    if not checkpoints:
-      raise ValueError("No checkpoint files found in {}".format(model_dir))
-    closest = float("inf")
-    for c in checkpoints:
-      if abs(target_checkpoint - c) < abs(target_checkpoint - closest):
-        closest = c
-    if closest != target_checkpoint:
-      logging.info(
-          "Using checkpoint at step %d which is closest to requested step %d",
-          closest,
-          target_checkpoint,
-      )
-    return closest
-
   if checkpoint_steps is None:
     if model_dir is None:
       raise ValueError("checkpoint_steps and model_dir both cannot be None.")
-
-    def _generate_checkpoints():
-      for c in tf.train.checkpoints_iterator(model_dir):
-        yield get_step_from_checkpoint_path(c)
-
-    return _generate_checkpoints()
+    return watch_checkpoints(model_dir)
 
   elif checkpoint_steps == "all":
     if model_dir is None:
       raise ValueError(
           "model_dir cannot be None when checkpoint_steps={}".format(
               checkpoint_steps))
-    ckpt_paths = tf.gfile.Glob(os.path.join(model_dir, "model.ckpt*"))
-    return [get_step_from_checkpoint_path(c) for c in ckpt_paths]
+    return CheckpointIndex(model_dir).steps
   elif isinstance(checkpoint_steps, int):
     if model_dir:
       if checkpoint_steps == -1:
         return [get_latest_checkpoint_from_dir(model_dir)]
       else:
-        return [_get_closest_checkpoint(checkpoint_steps)]
+        return [CheckpointIndex(model_dir).closest(checkpoint_steps)]
     else:
       return [checkpoint_steps]
   else:
     if model_dir:
-      closests = np.unique(
-          [_get_closest_checkpoint(c) for c in checkpoint_steps])
+      index = CheckpointIndex(model_dir)
+      closests = np.unique([index.closest(c) for c in checkpoint_steps])
       return closests
     else:
       return checkpoint_steps
@@ -453,3 +583,142 @@ def run_eval(
       if outputs and len(outputs) != expected_pad:
         raise ValueError("{} padded outputs, {} expected.".format(
             len(outputs), expected_pad))
+
+
+class _BatchRequest(object):
+  """A request queued on a MicroBatcher."""
+
+  def __init__(self, examples):
+    self.examples = examples
+    self.future = concurrent.futures.Future()
+    self.start_time = time.time()
+
+
+class MicroBatcher(object):
+  """Groups concurrent requests into batches for a batched function.
+
+  Requests may be submitted from any number of threads. A background thread
+  merges the queued requests into batches of at most `max_batch_size` examples,
+  waiting up to `max_wait_secs` after the first request of a batch for more
+  requests to arrive, and calls `batch_fn` once per batch. Requests with more
+  than `max_batch_size` examples are split across batches.
+
+  Latency and throughput counters are available through `stats`.
+  """
+
+  def __init__(self, batch_fn, max_batch_size, max_wait_secs=0.0,
+               num_latencies=10000):
+    """MicroBatcher constructor.
+
+    Args:
+      batch_fn: function, takes a list of at most `max_batch_size` examples and
+        returns a list with one result per example.
+      max_batch_size: int, maximum number of examples passed to `batch_fn`.
+      max_wait_secs: float, how long to wait for more requests before running
+        a partial batch.
+      num_latencies: int, number of most recent request latencies to keep for
+        computing latency percentiles.
+    """
+    self._batch_fn = batch_fn
+    self._max_batch_size = max_batch_size
+    self._max_wait_secs = max_wait_secs
+    self._queue = queue.Queue()
+    self._lock = threading.Lock()
+    self._num_requests = 0
+    self._num_examples = 0
+    self._num_batches = 0
+    self._busy_secs = 0.0
+    self._latencies = collections.deque(maxlen=num_latencies)
+    self._closed = False
+    self._thread = threading.Thread(target=self._run, daemon=True)
+    self._thread.start()
+
+  def submit(self, examples):
+    """Queues `examples` and returns a Future of the list of their results."""
+    request = _BatchRequest(list(examples))
+    with self._lock:
+      if self._closed:
+        raise RuntimeError("Cannot submit requests to a closed MicroBatcher.")
+      self._queue.put(request)
+    return request.future
+
+  def __call__(self, examples):
+    """Returns the results for `examples`, blocking until they are ready."""
+    return self.submit(examples).result()
+
+  def close(self):
+    """Processes the queued requests and stops the background thread."""
+    with self._lock:
+      if self._closed:
+        return
+      self._closed = True
+      self._queue.put(None)
+    self._thread.join()
+
+  def stats(self):
+    """Returns request, batch, latency and throughput counters."""
+    with self._lock:
+      latencies = np.array(self._latencies)
+      stats = {
+          "requests": self._num_requests,
+          "examples": self._num_examples,
+          "batches": self._num_batches,
+          "mean_batch_size": self._num_examples / max(self._num_batches, 1),
+          "examples_per_sec": self._num_examples / max(self._busy_secs, 1e-9),
+      }
+    if latencies.size:
+      stats["latency_p50_secs"], stats["latency_p99_secs"] = np.percentile(
+          latencies, [50, 99])
+    return stats
+
+  def _run(self):
+    """Collects queued requests into batches until closed."""
+    stopped = False
+    while not stopped:
+      request = self._queue.get()
+      if request is None:
+        break
+      requests = [request]
+      num_examples = len(request.examples)
+      deadline = time.time() + self._max_wait_secs
+      while num_examples < self._max_batch_size:
+        try:
+          request = self._queue.get(timeout=max(deadline - time.time(), 0))
+        except queue.Empty:
+          break
+        if request is None:
+          stopped = True
+          break
+        requests.append(request)
+        num_examples += len(request.examples)
+      self._process(requests)
+
+  def _process(self, requests):
+    """Runs `batch_fn` over the examples of `requests` and sets their results."""
+    examples = [ex for r in requests for ex in r.examples]
+    start = time.time()
+    try:
+      results = []
+      for i in range(0, len(examples), self._max_batch_size):
+        batch = examples[i:i + self._max_batch_size]
+        batch_results = list(self._batch_fn(batch))
+        if len(batch_results) != len(batch):
+          raise ValueError("{} results for a batch of {} examples.".format(
+              len(batch_results), len(batch)))
+        results.extend(batch_results)
+    except Exception as e:  # pylint:disable=broad-except
+      for r in requests:
+        r.future.set_exception(e)
+      return
+    end = time.time()
+
+    offset = 0
+    for r in requests:
+      r.future.set_result(results[offset:offset + len(r.examples)])
+      offset += len(r.examples)
+    with self._lock:
+      self._num_requests += len(requests)
+      self._num_examples += len(examples)
+      self._num_batches += -(-len(examples) // self._max_batch_size)
+      self._busy_secs += end - start
+      self._latencies.extend(end - r.start_time for r in requests)
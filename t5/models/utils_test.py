@@ -0,0 +1,171 @@
+# Copyright 2023 The T5 Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for t5.models.utils."""
+
+import concurrent.futures
+import os
+import threading
+from unittest import mock
+
+from absl.testing import absltest
+from t5.models import utils
+import tensorflow.compat.v1 as tf
+
+
+def _write_checkpoint(model_dir, step):
+  prefix = os.path.join(model_dir, "model.ckpt-%d" % step)
+  for suffix in (".index", ".data-00000-of-00001", ".meta"):
+    with tf.io.gfile.GFile(prefix + suffix, "w") as f:
+      f.write("")
+  tf.train.update_checkpoint_state(model_dir, prefix)
+
+
+class CheckpointIndexTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.model_dir = self.create_tempdir().full_path
+    for step in (1000, 2000, 4000):
+      _write_checkpoint(self.model_dir, step)
+    with tf.io.gfile.GFile(os.path.join(self.model_dir, "operative_config.gin"),
+                           "w") as f:
+      f.write("")
+
+  def test_closest(self):
+    index = utils.CheckpointIndex(self.model_dir)
+    self.assertEqual(index.steps, [1000, 2000, 4000])
+    self.assertEqual(index.closest(0), 1000)
+    self.assertEqual(index.closest(2000), 2000)
+    self.assertEqual(index.closest(1500), 1000)
+    self.assertEqual(index.closest(3100), 4000)
+    self.assertEqual(index.closest(10000), 4000)
+
+  def test_get_checkpoints_iterator_lists_once(self):
+    with mock.patch.object(
+        tf.io.gfile, "listdir", wraps=tf.io.gfile.listdir) as listdir:
+      self.assertEqual(
+          list(utils.get_checkpoints_iterator(
+              [900, 1100, 2500, 3500], self.model_dir)),
+          [1000, 2000, 4000])
+      self.assertEqual(listdir.call_count, 1)
+    self.assertEqual(
+        utils.get_checkpoints_iterator("all", self.model_dir),
+        [1000, 2000, 4000])
+
+  def test_closest_empty(self):
+    with self.assertRaisesRegex(ValueError, "No checkpoint files"):
+      utils.CheckpointIndex(self.create_tempdir().full_path).closest(1)
+
+
+class WatchCheckpointsTest(absltest.TestCase):
+
+  def _watch(self, model_dir, use_notifier):
+    with mock.patch.object(
+        utils._DirectoryNotifier, "create",
+        wraps=(utils._DirectoryNotifier.create if use_notifier
+               else lambda _: None)):
+      steps = utils.watch_checkpoints(
+          model_dir, timeout=5, min_poll_secs=0.01, max_poll_secs=0.05)
+      self.assertEqual(next(steps), 1000)
+      timer = threading.Timer(0.1, _write_checkpoint, (model_dir, 2000))
+      timer.start()
+      self.assertEqual(next(steps), 2000)
+      timer.join()
+      steps.close()
+
+  def test_watch_checkpoints(self):
+    model_dir = self.create_tempdir().full_path
+    _write_checkpoint(model_dir, 1000)
+    self._watch(model_dir, use_notifier=True)
+
+  def test_watch_checkpoints_polling(self):
+    model_dir = self.create_tempdir().full_path
+    _write_checkpoint(model_dir, 1000)
+    self._watch(model_dir, use_notifier=False)
+
+  def test_watch_checkpoints_timeout(self):
+    model_dir = self.create_tempdir().full_path
+    _write_checkpoint(model_dir, 1000)
+    self.assertEqual(
+        list(utils.watch_checkpoints(model_dir, timeout=0.1,
+                                     min_poll_secs=0.01)),
+        [1000])
+
+
+class MicroBatcherTest(absltest.TestCase):
+
+  def test_concurrent_requests_are_batched(self):
+    batches = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def batch_fn(examples):
+      # Hold the first batch so that the other requests queue up behind it.
+      started.set()
+      release.wait()
+      batches.append(examples)
+      return [x * 2 for x in examples]
+
+    batcher = utils.MicroBatcher(batch_fn, max_batch_size=4)
+    futures = [batcher.submit([0])]
+    started.wait()
+    futures.extend(batcher.submit([i]) for i in range(1, 5))
+    futures.append(batcher.submit([5, 6, 7, 8, 9]))
+    release.set()
+    results = [f.result() for f in futures]
+    batcher.close()
+
+    self.assertEqual(results, [[0], [2], [4], [6], [8], [10, 12, 14, 16, 18]])
+    # The first request runs alone, the queued ones in batches of up to 4.
+    self.assertEqual(batches, [[0], [1, 2, 3, 4], [5, 6, 7, 8], [9]])
+    stats = batcher.stats()
+    self.assertEqual(stats["requests"], 6)
+    self.assertEqual(stats["examples"], 10)
+    self.assertEqual(stats["batches"], 4)
+    self.assertIn("latency_p50_secs", stats)
+    self.assertIn("latency_p99_secs", stats)
+
+  def test_call_from_threads(self):
+    batcher = utils.MicroBatcher(
+        lambda examples: [x + 1 for x in examples], max_batch_size=8,
+        max_wait_secs=0.01)
+    with concurrent.futures.ThreadPoolExecutor(8) as pool:
+      results = list(pool.map(lambda i: batcher([i, -i]), range(100)))
+    batcher.close()
+    self.assertEqual(results, [[i + 1, 1 - i] for i in range(100)])
+    self.assertEqual(batcher.stats()["examples"], 200)
+
+  def test_batch_fn_error(self):
+
+    def batch_fn(examples):
+      raise ValueError("bad batch of %d" % len(examples))
+
+    batcher = utils.MicroBatcher(batch_fn, max_batch_size=2)
+    with self.assertRaisesRegex(ValueError, "bad batch of 1"):
+      batcher(["a"])
+    batcher.close()
+
+  def test_submit_after_close(self):
+    batcher = utils.MicroBatcher(lambda examples: examples, max_batch_size=2)
+    self.assertEqual(batcher(["a"]), ["a"])
+    batcher.close()
+    with self.assertRaisesRegex(RuntimeError, "closed"):
+      batcher.submit(["b"])
+    # Closing again is a no-op.
+    batcher.close()
+
+
+if __name__ == "__main__":
+  absltest.main()
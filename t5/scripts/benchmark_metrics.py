@@ -0,0 +1,256 @@
+# Copyright 2023 The T5 Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+r"""Benchmarks metric functions against their previous serial implementations.
+
+By default the benchmark runs on synthetic summaries of CNN/DM test set size.
+With `--use_tfds`, the CNN/DM test split is loaded from TFDS and the lead-3
+sentences of each article are scored against its highlights. For `coqa_f1`,
+the sentences of each target are used as its alternative answers.
+
+Example usage:
+python -m t5.scripts.benchmark_metrics \
+    --metric=rouge \
+    --num_examples=11490 \
+    --num_workers=8
+"""
+
+import collections
+import itertools
+import random
+import re
+import string
+import time
+
+from absl import app
+from absl import flags
+from absl import logging
+import editdistance
+import numpy as np
+from t5.evaluation import metrics
+
+from rouge_score import rouge_scorer
+from rouge_score import scoring
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_enum("metric", "rouge", ["rouge", "edit_distance", "coqa_f1"],
+                  "Metric to benchmark.")
+flags.DEFINE_integer("num_examples", 11490,
+                     "Number of (target, prediction) pairs.")
+flags.DEFINE_integer("num_workers", None,
+                     "Number of worker processes, defaults to the CPU count.")
+flags.DEFINE_integer("seed", 0, "Seed for data generation and bootstrapping.")
+flags.DEFINE_bool("use_tfds", False,
+                  "Whether to score lead-3 baselines on the CNN/DM test split "
+                  "instead of synthetic text.")
+flags.DEFINE_string("tfds_data_dir", None, "Data directory for TFDS.")
+
+
+def _synthetic_summaries(num_examples, seed):
+  """Returns (targets, predictions) resembling CNN/DM highlights."""
+  rng = random.Random(seed)
+  vocab = ["w%d" % i for i in range(20000)]
+  # Zipfian word frequencies, as in natural text.
+  cum_weights = list(itertools.accumulate(1 / (i + 1) for i in range(20000)))
+
+  def sentence():
+    words = rng.choices(vocab, cum_weights=cum_weights, k=rng.randint(8, 20))
+    return " ".join(words) + " ."
+
+  targets = []
+  predictions = []
+  for _ in range(num_examples):
+    target = [sentence() for _ in range(rng.randint(3, 4))]
+    # Predictions copy some of the target sentences and add new ones.
+    prediction = [s for s in target if rng.random() < 0.5]
+    prediction += [sentence() for _ in range(3 - min(len(prediction), 2))]
+    targets.append(" ".join(target))
+    predictions.append(" ".join(prediction))
+  return targets, predictions
+
+
+def _cnn_dailymail_summaries(num_examples):
+  """Returns (highlights, lead-3) pairs from the CNN/DM test split."""
+  import tensorflow_datasets as tfds  # pylint:disable=g-import-not-at-top
+  ds = tfds.load("cnn_dailymail", split="test", data_dir=FLAGS.tfds_data_dir)
+  targets = []
+  predictions = []
+  for ex in tfds.as_numpy(ds.take(num_examples)):
+    targets.append(ex["highlights"].decode("utf-8").replace("\n", " "))
+    article = ex["article"].decode("utf-8")
+    predictions.append(" . ".join(article.split(" . ")[:3]))
+  return targets, predictions
+
+
+def _legacy_rouge(targets, predictions,
+                  score_keys=("rouge1", "rouge2", "rougeLsum")):
+  """The serial scoring and unseeded bootstrap `metrics.rouge` replaced."""
+  scorer = rouge_scorer.RougeScorer(rouge_types=score_keys)
+  aggregator = scoring.BootstrapAggregator()
+  for prediction, target in zip(predictions, targets):
+    aggregator.add_scores(scorer.score(
+        target=metrics._prepare_summary_rouge(target),  # pylint:disable=protected-access
+        prediction=metrics._prepare_summary_rouge(prediction)))  # pylint:disable=protected-access
+  result = aggregator.aggregate()
+  return {key: result[key].mid.fmeasure * 100 for key in score_keys}
+
+
+def _legacy_edit_distance(targets, predictions, lower=True):
+  """The per-pair loop `metrics.edit_distance` replaced."""
+  edit_distances = []
+  for pred, target in zip(predictions, targets):
+    if lower:
+      pred = pred.lower()
+      target = target.lower()
+    pred = re.split("[^\\w]", pred)
+    target = re.split("[^\\w]", target)
+    edit_distances.append(editdistance.distance(pred, target))
+  return {"min_edit": min(edit_distances),
+          "max_edit": max(edit_distances),
+          "mean_edit": np.mean(edit_distances),
+          "median_edit": np.median(edit_distances),
+          "sum_edit": sum(edit_distances)}
+
+
+def _legacy_coqa_tokenize(inp):
+  """The tokenizer `metrics._coqa_tokenize` replaced."""
+
+  def remove_articles(text):
+    regex = re.compile(r"\b(a|an|the)\b", re.UNICODE)
+    return re.sub(regex, " ", text)
+
+  def normalize_whitespace(text):
+    return " ".join(text.split())
+
+  def remove_punc(text):
+    exclude = set(string.punctuation)
+    return "".join(ch for ch in text if ch not in exclude)
+
+  return normalize_whitespace(remove_articles(remove_punc(inp.lower()))).split()
+
+
+def _legacy_coqa_f1(targets, predictions):
+  """The per-example loop `metrics.coqa_f1` replaced."""
+
+  def sequence_f1(target_tokens, prediction_tokens):
+    if not (target_tokens or prediction_tokens):
+      return int(target_tokens == prediction_tokens)
+    common_token_counts = (
+        collections.Counter(target_tokens) &
+        collections.Counter(prediction_tokens))
+    sum_common = sum(common_token_counts.values())
+    if sum_common == 0:
+      return 0
+    precision = 1.0 * sum_common / len(prediction_tokens)
+    recall = 1.0 * sum_common / len(target_tokens)
+    return (2 * precision * recall) / (precision + recall)
+
+  f1s = []
+  for target, p in zip(targets, predictions):
+    prediction_tokens = _legacy_coqa_tokenize(p)
+    f1s.append(max(
+        sequence_f1(_legacy_coqa_tokenize(t), prediction_tokens)
+        for t in target))
+  return {"f1": np.mean(np.array(f1s)) * 100}
+
+
+def _time_variants(variants):
+  """Runs each (name, fn) variant once and returns (name, seconds, scores)."""
+  results = []
+  for name, fn in variants:
+    start = time.perf_counter()
+    scores = fn()
+    results.append((name, time.perf_counter() - start, scores))
+  return results
+
+
+def _check_equal(results, names):
+  """Raises if the scores of the named variants are not identical."""
+  scores = {name: s for name, _, s in results if name in names}
+  reference = scores[names[0]]
+  for name in names[1:]:
+    if scores[name] != reference:
+      raise ValueError("%s and %s scores differ: %s vs %s" %
+                       (names[0], name, reference, scores[name]))
+
+
+def benchmark_rouge(targets, predictions):
+  """Times `metrics.rouge` serially and in parallel against the legacy path."""
+  results = _time_variants([
+      ("legacy", lambda: _legacy_rouge(targets, predictions)),
+      ("serial", lambda: metrics.rouge(
+          targets, predictions, seed=FLAGS.seed, num_workers=1)),
+      ("parallel", lambda: metrics.rouge(
+          targets, predictions, seed=FLAGS.seed,
+          num_workers=FLAGS.num_workers)),
+  ])
+  # The seeded implementations must agree exactly, whatever the worker count.
+  _check_equal(results, ["serial", "parallel"])
+  return results
+
+
+def benchmark_edit_distance(targets, predictions):
+  """Times `metrics.edit_distance` against the legacy per-pair loop."""
+  results = _time_variants([
+      ("legacy", lambda: _legacy_edit_distance(targets, predictions)),
+      ("serial", lambda: metrics.edit_distance(
+          targets, predictions, num_workers=1)),
+      ("parallel", lambda: metrics.edit_distance(
+          targets, predictions, num_workers=FLAGS.num_workers)),
+  ])
+  _check_equal(results, ["legacy", "serial", "parallel"])
+  return results
+
+
+def benchmark_coqa_f1(targets, predictions):
+  """Times `metrics.coqa_f1` against the legacy per-example loop."""
+  targets = [t.split(" . ") for t in targets]
+  results = _time_variants([
+      ("legacy", lambda: _legacy_coqa_f1(targets, predictions)),
+      ("serial", lambda: metrics.coqa_f1(
+          targets, predictions, num_workers=1)),
+      ("parallel", lambda: metrics.coqa_f1(
+          targets, predictions, num_workers=FLAGS.num_workers)),
+  ])
+  _check_equal(results, ["legacy", "serial", "parallel"])
+  return results
+
+
+_BENCHMARKS = {
+    "rouge": benchmark_rouge,
+    "edit_distance": benchmark_edit_distance,
+    "coqa_f1": benchmark_coqa_f1,
+}
+
+
+def main(_):
+  if FLAGS.use_tfds:
+    targets, predictions = _cnn_dailymail_summaries(FLAGS.num_examples)
+  else:
+    targets, predictions = _synthetic_summaries(FLAGS.num_examples, FLAGS.seed)
+  logging.info("Benchmarking %s on %d examples.", FLAGS.metric, len(targets))
+
+  results = _BENCHMARKS[FLAGS.metric](targets, predictions)
+  baseline = results[0][1]
+  print("%-10s %10s %8s  %s" % ("variant", "seconds", "speedup", "scores"))
+  for name, seconds, scores in results:
+    scores = ", ".join(
+        "%s=%.4f" % (k, v) for k, v in sorted(scores.items()))
+    print("%-10s %10.2f %7.2fx  %s" % (
+        name, seconds, baseline / seconds, scores))
+
+
+if __name__ == "__main__":
+  app.run(main)
@@ -0,0 +1,603 @@
+# Copyright 2023 The T5 Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+r"""Benchmarks preprocessors against their previous implementations.
+
+By default the benchmark runs on synthetic examples shaped like those the
+preprocessor sees on TriviaQA RC. With `--use_tfds`, the examples are built
+from the TriviaQA RC split loaded from TFDS. Each variant runs with the same
+map seed and the outputs of all variants are checked to be identical.
+
+The peak resident memory of the process is reported after each variant. It
+only measures a variant on its own when `--variants` selects a single one.
+
+Example usage:
+python -m t5.scripts.benchmark_preprocessors \
+    --preprocessor=trivia_qa_truncate_inputs \
+    --num_examples=2000
+"""
+
+import collections
+import itertools
+import random
+import resource
+import time
+
+from absl import app
+from absl import flags
+from absl import logging
+import numpy as np
+import seqio
+import t5.data
+from t5.data import preprocessors
+import tensorflow.compat.v2 as tf
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_enum("preprocessor", "trivia_qa_truncate_inputs",
+                  ["trivia_qa_truncate_inputs", "trivia_qa",
+                   "concatenate_and_split_to_fixed_length", "record",
+                   "neighboring_pairs"],
+                  "Preprocessor to benchmark.")
+flags.DEFINE_list("variants", None,
+                  "Variants to run, e.g. `current`, defaults to all of them.")
+flags.DEFINE_integer("num_examples", 2000, "Number of examples.")
+flags.DEFINE_integer("seed", 0, "Seed for data generation and map seeds.")
+flags.DEFINE_integer("max_input_tokens", 512,
+                     "Length the inputs are truncated to.")
+flags.DEFINE_integer("max_tokens", 512,
+                     "Length of the chunks of concatenated tokens.")
+flags.DEFINE_integer("batch_size", 128,
+                     "Number of examples processed at a time by batched "
+                     "preprocessors.")
+flags.DEFINE_bool("use_tfds", False,
+                  "Whether to use TriviaQA RC, C4 for "
+                  "concatenate_and_split_to_fixed_length, SuperGLUE ReCoRD "
+                  "for record or Wikipedia for the word-level preprocessors, "
+                  "from TFDS instead of synthetic examples.")
+flags.DEFINE_string("tfds_split", "validation", "TFDS split to use.")
+flags.DEFINE_string("tfds_data_dir", None, "Data directory for TFDS.")
+
+
+def _synthetic_trivia_qa(num_examples, seed):
+  """Returns raw examples resembling TriviaQA RC."""
+  rng = random.Random(seed)
+  # The legacy loop treats answers as regexes, so the only metacharacter used
+  # is ".", which also matches itself.
+  vocab = ["w%d" % i for i in range(20000)] + [",", ".", "'s"]
+  cum_weights = list(itertools.accumulate(1 / (i + 1) for i in range(20003)))
+
+  def text(num_words):
+    return " ".join(rng.choices(vocab, cum_weights=cum_weights, k=num_words))
+
+  examples = []
+  for _ in range(num_examples):
+    wiki = [text(rng.randint(1000, 8000)) for _ in range(rng.randint(1, 2))]
+    search = [text(rng.randint(500, 4000)) for _ in range(rng.randint(0, 6))]
+    aliases = []
+    for _ in range(rng.randint(2, 10)):
+      if rng.random() < 0.3:
+        words = rng.choice(wiki + search).split()
+        start = rng.randrange(len(words) - 3)
+        aliases.append(" ".join(words[start:start + rng.randint(1, 3)]))
+      else:
+        aliases.append(text(rng.randint(1, 3)))
+    examples.append({
+        "question": text(rng.randint(5, 20)) + "?",
+        "entity_pages": {"wiki_context": wiki},
+        "search_results": {"search_context": search},
+        "answer": {"normalized_aliases": aliases},
+    })
+  return examples
+
+
+def _tfds_trivia_qa(num_examples):
+  """Returns raw examples from TriviaQA RC in TFDS."""
+  import tensorflow_datasets as tfds  # pylint:disable=g-import-not-at-top
+  ds = tfds.load("trivia_qa/rc", split=FLAGS.tfds_split,
+                 data_dir=FLAGS.tfds_data_dir)
+  return [{
+      "question": ex["question"],
+      "entity_pages": {"wiki_context": ex["entity_pages"]["wiki_context"]},
+      "search_results": {
+          "search_context": ex["search_results"]["search_context"]},
+      "answer": {"normalized_aliases": ex["answer"]["normalized_aliases"]},
+  } for ex in ds.take(num_examples).as_numpy_iterator()]
+
+
+def _synthetic_trivia_qa_tokens(num_examples, seed):
+  """Returns tokenized (context, answer) pairs resembling TriviaQA RC."""
+  rng = random.Random(seed)
+  # Zipfian token frequencies over a SentencePiece-sized vocabulary.
+  cum_weights = list(itertools.accumulate(1 / (i + 1) for i in range(32000)))
+  examples = []
+  for _ in range(num_examples):
+    context = rng.choices(range(32000), cum_weights=cum_weights,
+                          k=rng.randint(1000, 16000))
+    answer_len = rng.randint(1, 8)
+    if rng.random() < 0.9:
+      start = rng.randrange(len(context) - answer_len)
+      answer = context[start:start + answer_len]
+    else:
+      answer = rng.choices(range(32000), k=answer_len)
+    examples.append({"inputs": context, "targets": answer})
+  return examples
+
+
+def _tfds_trivia_qa_tokens(num_examples):
+  """Returns tokenized (context, answer) pairs from TriviaQA RC in TFDS."""
+  import tensorflow_datasets as tfds  # pylint:disable=g-import-not-at-top
+  vocabulary = t5.data.get_default_vocabulary()
+  ds = tfds.load("trivia_qa/rc", split=FLAGS.tfds_split,
+                 data_dir=FLAGS.tfds_data_dir)
+  ds = preprocessors.trivia_qa(ds).take(num_examples)
+  examples = []
+  for ex in ds.as_numpy_iterator():
+    examples.append({
+        "inputs": vocabulary.encode(ex["inputs"].decode("utf-8")),
+        "targets": vocabulary.encode(ex["targets"].decode("utf-8")),
+    })
+  return examples
+
+
+def _synthetic_documents(num_examples, seed):
+  """Returns tokenized documents with C4-like lengths."""
+  rng = np.random.RandomState(seed)
+  lengths = np.minimum(rng.geometric(1 / 400, num_examples), 20000)
+  return [{"targets": rng.randint(2, 32000, n).astype(np.int32)}
+          for n in lengths]
+
+
+def _tfds_documents(num_examples):
+  """Returns tokenized documents from C4 in TFDS."""
+  import tensorflow_datasets as tfds  # pylint:disable=g-import-not-at-top
+  vocabulary = t5.data.get_default_vocabulary()
+  ds = tfds.load("c4/en", split=FLAGS.tfds_split, data_dir=FLAGS.tfds_data_dir)
+  return [{"targets": np.array(vocabulary.encode(ex["text"].decode("utf-8")),
+                               np.int32)}
+          for ex in ds.take(num_examples).as_numpy_iterator()]
+
+
+def _synthetic_record(num_examples, seed):
+  """Returns raw examples resembling SuperGLUE ReCoRD."""
+  rng = random.Random(seed)
+  vocab = ["w%d" % i for i in range(20000)] + [",", "."]
+  cum_weights = list(itertools.accumulate(1 / (i + 1) for i in range(20002)))
+
+  def text(num_words):
+    return " ".join(rng.choices(vocab, cum_weights=cum_weights, k=num_words))
+
+  examples = []
+  for i in range(num_examples):
+    passage = text(rng.randint(100, 300)) + "."
+    for _ in range(rng.randint(1, 4)):
+      passage += "\n@highlight\n" + text(rng.randint(5, 20))
+    entities = [text(rng.randint(1, 3)) for _ in range(rng.randint(3, 25))]
+    # Most ReCoRD examples have a single answer.
+    answers = rng.sample(entities, min(len(entities), rng.choice([1, 1, 2, 3])))
+    examples.append({
+        "passage": passage,
+        "query": text(rng.randint(10, 40)) + " @placeholder .",
+        "entities": entities,
+        "answers": answers,
+        "idx": {"passage": i, "query": i},
+    })
+  return examples
+
+
+def _tfds_record(num_examples):
+  """Returns raw examples from SuperGLUE ReCoRD in TFDS."""
+  import tensorflow_datasets as tfds  # pylint:disable=g-import-not-at-top
+  ds = tfds.load("super_glue/record", split=FLAGS.tfds_split,
+                 data_dir=FLAGS.tfds_data_dir)
+  return [{
+      "passage": ex["passage"],
+      "query": ex["query"],
+      "entities": ex["entities"],
+      "answers": ex["answers"],
+      "idx": {"passage": ex["idx"]["passage"], "query": ex["idx"]["query"]},
+  } for ex in ds.take(num_examples).as_numpy_iterator()]
+
+
+def _synthetic_wikipedia(num_examples, seed):
+  """Returns articles with Wikipedia-like paragraph and sentence lengths."""
+  rng = random.Random(seed)
+  vocab = ["w%d" % i for i in range(20000)]
+  cum_weights = list(itertools.accumulate(1 / (i + 1) for i in range(20000)))
+
+  def sentence():
+    words = rng.choices(vocab, cum_weights=cum_weights, k=rng.randint(5, 40))
+    return " ".join(words) + rng.choice([".", ".", ".", "?", "!"])
+
+  examples = []
+  for _ in range(num_examples):
+    paragraphs = [
+        " ".join(sentence() for _ in range(rng.randint(1, 8)))
+        for _ in range(min(int(rng.expovariate(1 / 6)) + 1, 100))
+    ]
+    examples.append({"text": "\n\n".join(paragraphs)})
+  return examples
+
+
+def _tfds_wikipedia(num_examples):
+  """Returns articles from Wikipedia in TFDS."""
+  import tensorflow_datasets as tfds  # pylint:disable=g-import-not-at-top
+  # Wikipedia only has a train split.
+  ds = tfds.load("wikipedia/20190301.en:1.0.0", split="train",
+                 data_dir=FLAGS.tfds_data_dir)
+  return [{"text": ex["text"]}
+          for ex in ds.take(num_examples).as_numpy_iterator()]
+
+
+def _legacy_trivia_qa(dataset):
+  """The per-pair regex matching loop `trivia_qa` replaced."""
+
+  def triviaqa_question_answer_context(x):
+    contexts = tf.concat([x["entity_pages"]["wiki_context"],
+                          x["search_results"]["search_context"]], 0)
+    q = preprocessors._pad_punctuation(x["question"])  # pylint:disable=protected-access
+    answers = x["answer"]["normalized_aliases"]
+    combination_size = tf.size(answers) * tf.size(contexts)
+    find_answers = tf.TensorArray(
+        tf.bool, size=combination_size, dynamic_size=True)
+    selected_answers = tf.TensorArray(
+        tf.string, size=combination_size, dynamic_size=True)
+    join_q_c = tf.TensorArray(
+        tf.string, size=combination_size, dynamic_size=True)
+
+    def cond_fn(i, find_answers, selected_answers, join_q_c):
+      del find_answers, selected_answers, join_q_c  # Unused
+      return tf.less(i, combination_size)
+
+    def body_fn(i, find_answers, selected_answers, join_q_c):
+      context_idx = tf.math.floordiv(i, tf.size(answers))
+      answer_idx = tf.math.mod(i, tf.size(answers))
+      a = preprocessors._pad_punctuation(answers[answer_idx])  # pylint:disable=protected-access
+      a_ = tf.strings.join([".*", a, ".*"])
+      c = preprocessors._pad_punctuation(contexts[context_idx])  # pylint:disable=protected-access
+      find_a = tf.strings.regex_full_match(
+          tf.strings.lower(c), tf.strings.lower(a_))
+      find_answers = find_answers.write(i, find_a)
+      selected_answers = selected_answers.write(i, a)
+      join_q_c_str = preprocessors._string_join(  # pylint:disable=protected-access
+          ["question:", q, "context:", c])
+      join_q_c = join_q_c.write(i, join_q_c_str)
+      return (i + 1, find_answers, selected_answers, join_q_c)
+
+    _, find_answers, selected_answers, join_q_c = tf.while_loop(
+        cond_fn, body_fn,
+        loop_vars=[tf.constant(0), find_answers, selected_answers, join_q_c])
+    find_answers = find_answers.stack()
+    return (tf.boolean_mask(join_q_c.stack(), find_answers),
+            tf.boolean_mask(selected_answers.stack(), find_answers))
+
+  def my_fn(x):
+    join_q_c, a = triviaqa_question_answer_context(x)
+    return {"inputs": join_q_c, "targets": a}
+
+  return dataset.map(my_fn, num_parallel_calls=tf.data.AUTOTUNE).unbatch()
+
+
+def _legacy_trivia_qa_truncate_inputs(dataset, output_features,
+                                      sequence_length):
+  """The convolution-based answer search `trivia_qa_truncate_inputs` replaced."""
+  del output_features
+
+  @seqio.map_over_dataset(num_seeds=1)
+  def my_fn(features, seed):
+    inputs = features["inputs"]
+    targets = features["targets"]
+    ans_len = tf.shape(targets)[0]
+    max_input_tokens = sequence_length["inputs"]
+
+    def truncate_inputs():
+
+      def answer_in_context(context, answer):
+        conv_inp = tf.reshape(tf.cast(context, tf.float32), [1, -1, 1])
+        ans_len = tf.shape(answer)[0]
+        filters = tf.eye(ans_len, dtype=tf.float32)
+        strided = tf.nn.conv1d(
+            conv_inp, tf.reshape(filters, [ans_len, 1, ans_len]), 1, "VALID")
+        strided = tf.cast(strided[0], answer.dtype)
+        pos_mask = tf.reduce_all(
+            tf.equal(strided, tf.reshape(answer, [1, -1])), 1)
+        return tf.reduce_any(pos_mask), pos_mask
+
+      def slice_inputs(inputs, answer_len, pos_mask, seed=None):
+        ans_start_pos = tf.cast(tf.where(pos_mask)[0][0], tf.int32)
+        inputs_len = tf.shape(inputs)[0]
+        start_range_min = tf.maximum(
+            0, ans_start_pos - (max_input_tokens - answer_len))
+        start_range_max = tf.minimum(
+            ans_start_pos, inputs_len - max_input_tokens) + 1
+        start_pos = tf.random.stateless_uniform(
+            [], minval=start_range_min, maxval=start_range_max,
+            dtype=tf.int32, seed=seed)
+        return inputs[start_pos:start_pos + max_input_tokens]
+
+      result, pos_mask = answer_in_context(inputs, targets)
+      if result:
+        return slice_inputs(inputs, ans_len, pos_mask, seed=seed)
+      else:
+        return tf.constant([], dtype=inputs.dtype)
+
+    if tf.greater(tf.shape(inputs)[0], max_input_tokens):
+      inputs = truncate_inputs()
+    return {"inputs": inputs, "targets": features["targets"]}
+
+  dataset = my_fn(dataset)
+  return dataset.filter(lambda x: tf.size(x["inputs"]) > 0)
+
+
+def _legacy_record(dataset):
+  """The per-answer copies and formatting `record` replaced."""
+
+  def process_answers(x):
+    ex = x.copy()
+    num_answers = tf.size(ex["answers"])
+
+    def duplicate_along_first_dim(t):
+      n_duplicates = tf.math.maximum(num_answers, 1)
+      return tf.broadcast_to(
+          t, shape=tf.concat([[n_duplicates], tf.shape(t)], axis=0))
+
+    for k, v in x.items():
+      if k != "idx":
+        ex[k] = duplicate_along_first_dim(v)
+    ex["targets"] = tf.cond(
+        tf.greater(num_answers, 0),
+        lambda: x["answers"],
+        lambda: tf.constant(["<unk>"]))
+    ex["idx"] = {
+        "passage": duplicate_along_first_dim(x["idx"]["passage"]),
+        "query": duplicate_along_first_dim(x["idx"]["query"]),
+    }
+    return ex
+
+  def my_fn(x):
+    passage = x["passage"]
+    passage = tf.strings.regex_replace(
+        passage, r"(\.|\?|\!|\"|\')\n@highlight\n", r"\1 ")
+    passage = tf.strings.regex_replace(passage, r"\n@highlight\n", ". ")
+    joined = tf.strings.join([
+        "record query:", x["query"], "entities:",
+        tf.strings.reduce_join(x["entities"], separator=", "), "passage:",
+        passage], separator=" ")
+    return {
+        "idx/passage": x["idx"]["passage"],
+        "idx/query": x["idx"]["query"],
+        "inputs": joined,
+        "targets": x["targets"],
+        "answers": x["answers"],
+    }
+
+  dataset = dataset.map(process_answers, num_parallel_calls=tf.data.AUTOTUNE)
+  dataset = dataset.unbatch()
+  return dataset.map(my_fn, num_parallel_calls=tf.data.AUTOTUNE)
+
+
+def _trivia_qa_dataset(examples):
+  """Returns a dataset of the raw TriviaQA examples."""
+  strings = tf.TensorSpec([None], tf.string)
+  return tf.data.Dataset.from_generator(
+      lambda: iter(examples),
+      output_signature={
+          "question": tf.TensorSpec([], tf.string),
+          "entity_pages": {"wiki_context": strings},
+          "search_results": {"search_context": strings},
+          "answer": {"normalized_aliases": strings},
+      })
+
+
+def _token_dataset(examples):
+  """Returns a dataset of the tokenized examples."""
+  return tf.data.Dataset.from_generator(
+      lambda: iter(examples),
+      output_signature={
+          "inputs": tf.TensorSpec([None], tf.int32),
+          "targets": tf.TensorSpec([None], tf.int32),
+      })
+
+
+def _documents_dataset(examples):
+  """Returns a dataset of tokenized documents with an unused feature."""
+  return tf.data.Dataset.from_generator(
+      lambda: ({"targets": ex["targets"], "id": i}
+               for i, ex in enumerate(examples)),
+      output_signature={
+          "targets": tf.TensorSpec([None], tf.int32),
+          "id": tf.TensorSpec([], tf.int32),
+      })
+
+
+def _record_dataset(examples):
+  """Returns a dataset of the raw ReCoRD examples."""
+  strings = tf.TensorSpec([None], tf.string)
+  return tf.data.Dataset.from_generator(
+      lambda: iter(examples),
+      output_signature={
+          "passage": tf.TensorSpec([], tf.string),
+          "query": tf.TensorSpec([], tf.string),
+          "entities": strings,
+          "answers": strings,
+          "idx": {
+              "passage": tf.TensorSpec([], tf.int32),
+              "query": tf.TensorSpec([], tf.int32),
+          },
+      })
+
+
+def _text_dataset(examples):
+  """Returns a dataset of the text examples."""
+  return tf.data.Dataset.from_generator(
+      lambda: iter(examples),
+      output_signature={"text": tf.TensorSpec([], tf.string)})
+
+
+def _peak_rss_mb():
+  """Returns the peak resident memory of the process in MB."""
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _time_variants(variants, dataset):
+  """Runs each (name, preprocessor) variant over `dataset`.
+
+  The source examples are cached in memory first, and the timed pass only
+  counts the outputs inside the tf.data runtime, so that neither the Python
+  source nor Python iteration is measured. The outputs are collected by a
+  second, untimed pass.
+
+  Returns:
+    a list of (name, seconds, peak_rss_mb, outputs) tuples.
+  """
+  if FLAGS.variants:
+    variants = [(name, fn) for name, fn in variants if name in FLAGS.variants]
+  dataset = dataset.cache()
+  dataset.reduce(0, lambda count, _: count + 1)
+  results = []
+  for name, fn in variants:
+    with seqio.utils.map_seed_manager(FLAGS.seed):
+      ds = fn(dataset)
+    start = time.perf_counter()
+    ds.reduce(0, lambda count, _: count + 1)
+    seconds = time.perf_counter() - start
+    peak_rss_mb = _peak_rss_mb()
+    results.append((name, seconds, peak_rss_mb, list(ds.as_numpy_iterator())))
+  return results
+
+
+def _check_equal(results):
+  """Raises if the outputs of the variants are not identical."""
+  reference_name, _, _, reference = results[0]
+  for name, _, _, outputs in results[1:]:
+    if len(outputs) != len(reference):
+      raise ValueError("%s and %s output %d and %d examples." %
+                       (reference_name, name, len(reference), len(outputs)))
+    for i, (a, b) in enumerate(zip(reference, outputs)):
+      if a.keys() != b.keys() or any(
+          not np.array_equal(a[k], b[k]) for k in a):
+        raise ValueError("%s and %s outputs differ for example %d." %
+                         (reference_name, name, i))
+
+
+def benchmark_trivia_qa_truncate_inputs(examples):
+  """Times `trivia_qa_truncate_inputs` against the convolution search."""
+  sequence_length = {"inputs": FLAGS.max_input_tokens}
+  dataset = _token_dataset(examples)
+  return _time_variants([
+      ("legacy", lambda ds: _legacy_trivia_qa_truncate_inputs(
+          ds, None, sequence_length)),
+      ("current", lambda ds: preprocessors.trivia_qa_truncate_inputs(
+          ds, None, sequence_length)),
+  ], dataset)
+
+
+def benchmark_trivia_qa(examples):
+  """Times `trivia_qa` against the per-pair regex matching loop."""
+  dataset = _trivia_qa_dataset(examples)
+  return _time_variants([
+      ("legacy", _legacy_trivia_qa),
+      ("current", preprocessors.trivia_qa),
+  ], dataset)
+
+
+def benchmark_concatenate_and_split_to_fixed_length(examples):
+  """Times `concatenate_and_split_to_fixed_length` against unbatch/batch."""
+  sequence_length = {"targets": FLAGS.max_tokens}
+  output_features = {
+      "targets": seqio.Feature(t5.data.get_default_vocabulary())}
+  dataset = _documents_dataset(examples)
+  return _time_variants([
+      ("legacy", lambda ds: ds.map(lambda x: {"targets": x["targets"]})
+       .unbatch().batch(FLAGS.max_tokens - 1)),
+      ("current", lambda ds: (
+          preprocessors.concatenate_and_split_to_fixed_length(
+              ds, sequence_length, output_features))),
+  ], dataset)
+
+
+def benchmark_record(examples):
+  """Times `record` against the per-answer copies of every feature."""
+  dataset = _record_dataset(examples)
+  return _time_variants([
+      ("legacy", _legacy_record),
+      ("current", preprocessors.record),
+  ], dataset)
+
+
+def benchmark_neighboring_pairs(examples):
+  """Times `neighboring_pairs_batched` against `neighboring_pairs`."""
+  return _time_variants([
+      ("per_example", preprocessors.neighboring_pairs),
+      ("batched", lambda ds: preprocessors.neighboring_pairs_batched(
+          ds, batch_size=FLAGS.batch_size)),
+  ], _text_dataset(examples))
+
+
+def _count_examples(examples):
+  return len(examples)
+
+
+def _count_tokens(examples):
+  return sum(len(ex["targets"]) for ex in examples)
+
+
+_Benchmark = collections.namedtuple(
+    "_Benchmark",
+    ["benchmark_fn", "synthetic_fn", "tfds_fn", "unit", "count_fn"])
+
+_BENCHMARKS = {
+    "trivia_qa_truncate_inputs": _Benchmark(
+        benchmark_trivia_qa_truncate_inputs, _synthetic_trivia_qa_tokens,
+        _tfds_trivia_qa_tokens, "examples", _count_examples),
+    "trivia_qa": _Benchmark(
+        benchmark_trivia_qa, _synthetic_trivia_qa, _tfds_trivia_qa,
+        "examples", _count_examples),
+    "concatenate_and_split_to_fixed_length": _Benchmark(
+        benchmark_concatenate_and_split_to_fixed_length,
+        _synthetic_documents, _tfds_documents, "tokens", _count_tokens),
+    "record": _Benchmark(
+        benchmark_record, _synthetic_record, _tfds_record, "examples",
+        _count_examples),
+    "neighboring_pairs": _Benchmark(
+        benchmark_neighboring_pairs, _synthetic_wikipedia, _tfds_wikipedia,
+        "examples", _count_examples),
+}
+
+
+def main(_):
+  benchmark = _BENCHMARKS[FLAGS.preprocessor]
+  if FLAGS.use_tfds:
+    examples = benchmark.tfds_fn(FLAGS.num_examples)
+  else:
+    examples = benchmark.synthetic_fn(FLAGS.num_examples, FLAGS.seed)
+  count = benchmark.count_fn(examples)
+  logging.info("Benchmarking %s on %d examples, %d %s.", FLAGS.preprocessor,
+               len(examples), count, benchmark.unit)
+
+  results = benchmark.benchmark_fn(examples)
+  _check_equal(results)
+  baseline = results[0][1]
+  # Throughput is in input examples or tokens per second.
+  print("%-11s %10s %8s %12s %10s %12s" % (
+      "variant", "seconds", "speedup", benchmark.unit + "/s", "outputs",
+      "peak_rss_mb"))
+  for name, seconds, peak_rss_mb, outputs in results:
+    print("%-11s %10.2f %7.2fx %12.1f %10d %12.0f" % (
+        name, seconds, baseline / seconds, count / seconds, len(outputs),
+        peak_rss_mb))
+
+
+if __name__ == "__main__":
+  app.run(main)
@@ -0,0 +1,178 @@
+# Copyright 2023 The T5 Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+r"""Benchmarks reading and parsing TSV files as a `TextLineTask` does.
+
+Three variants read the same files:
+  sequential: a single `tf.data.TextLineDataset` over all files, parsed line
+    by line with `preprocess_tsv`.
+  interleave: the files read in parallel by `seqio.TextLineDataSource`, as in
+    `TextLineTask`, parsed line by line with `preprocess_tsv`.
+  batched: the files read in parallel by `seqio.TextLineDataSource`, parsed in
+    batches with `preprocess_tsv_batched`.
+
+By default, synthetic TSV files with an inputs and a targets field are
+written to `--output_dir` first. Use `--input_pattern` to read existing files
+instead. The timed pass of each variant only counts the outputs. With
+`--check_outputs`, an untimed pass checks that all variants produce the same
+examples, in any order.
+
+Example usage:
+python -m t5.scripts.benchmark_tsv_ingestion \
+    --output_dir=/tmp/tsv_benchmark \
+    --num_files=8 \
+    --file_size_mb=256
+"""
+
+import os
+import random
+import time
+
+from absl import app
+from absl import flags
+from absl import logging
+import seqio
+from t5.data import preprocessors
+import tensorflow.compat.v2 as tf
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string("input_pattern", None,
+                    "Glob of existing TSV files to read instead of synthetic "
+                    "files.")
+flags.DEFINE_string("output_dir", "/tmp/tsv_benchmark",
+                    "Directory to write synthetic TSV files to.")
+flags.DEFINE_integer("num_files", 8, "Number of synthetic TSV files.")
+flags.DEFINE_integer("file_size_mb", 256, "Size of each synthetic TSV file.")
+flags.DEFINE_integer("num_fields", 2, "Number of fields of each line.")
+flags.DEFINE_string("inputs_format", "{0}", "Format of the inputs.")
+flags.DEFINE_string("targets_format", "{1}", "Format of the targets.")
+flags.DEFINE_integer("batch_size", 1024,
+                     "Number of lines parsed at a time by the batched "
+                     "variant.")
+flags.DEFINE_integer("cycle_length", 16, "Number of files read in parallel.")
+flags.DEFINE_integer("block_length", 16,
+                     "Number of consecutive lines read from each file.")
+flags.DEFINE_list("variants", None,
+                  "Variants to run, defaults to all of them.")
+flags.DEFINE_bool("check_outputs", True,
+                  "Whether to check that all variants produce the same "
+                  "examples.")
+flags.DEFINE_integer("seed", 0, "Seed for data generation.")
+
+
+def _write_synthetic_files(output_dir, num_files, file_size_mb, seed):
+  """Writes TSV files of (inputs, targets) lines, returns their paths."""
+  rng = random.Random(seed)
+  vocab = ["w%d" % i for i in range(20000)]
+  tf.io.gfile.makedirs(output_dir)
+  filenames = []
+  for i in range(num_files):
+    filename = os.path.join(
+        output_dir, "synthetic-%05d-of-%05d.tsv" % (i, num_files))
+    filenames.append(filename)
+    if (tf.io.gfile.exists(filename) and
+        tf.io.gfile.stat(filename).length >= file_size_mb * 2**20):
+      continue
+    # Lines are drawn from a pool so that writing GBs is quick.
+    lines = [
+        "%s\t%s\n" % (" ".join(rng.choices(vocab, k=rng.randint(20, 200))),
+                      " ".join(rng.choices(vocab, k=rng.randint(1, 50))))
+        for _ in range(10000)
+    ]
+    size = 0
+    with tf.io.gfile.GFile(filename, "w") as f:
+      while size < file_size_mb * 2**20:
+        chunk = "".join(rng.choices(lines, k=1000))
+        f.write(chunk)
+        size += len(chunk)
+  return filenames
+
+
+def _source_dataset(filenames):
+  return seqio.TextLineDataSource(
+      {"train": filenames}, cycle_length=FLAGS.cycle_length,
+      block_length=FLAGS.block_length).get_dataset("train", shuffle=False)
+
+
+def _variants(filenames):
+  """Returns (name, dataset_fn) tuples."""
+  tsv_kwargs = dict(
+      num_fields=FLAGS.num_fields,
+      inputs_format=FLAGS.inputs_format,
+      targets_format=FLAGS.targets_format)
+  return [
+      ("sequential", lambda: preprocessors.preprocess_tsv(
+          tf.data.TextLineDataset(filenames), **tsv_kwargs)),
+      ("interleave", lambda: preprocessors.preprocess_tsv(
+          _source_dataset(filenames), **tsv_kwargs)),
+      ("batched", lambda: preprocessors.preprocess_tsv_batched(
+          _source_dataset(filenames), batch_size=FLAGS.batch_size,
+          **tsv_kwargs)),
+  ]
+
+
+def _checksum(ds):
+  """Returns an order independent (count, checksum) of the examples."""
+
+  def add(state, ex):
+    count, checksum = state
+    hashes = tf.strings.to_hash_bucket_fast(
+        tf.strings.join([ex["inputs"], ex["targets"]], separator="\t"),
+        2**62)
+    return count + 1, checksum + hashes
+
+  count, checksum = ds.reduce((tf.constant(0, tf.int64),
+                               tf.constant(0, tf.int64)), add)
+  return int(count), int(checksum)
+
+
+def main(_):
+  if FLAGS.input_pattern:
+    filenames = sorted(tf.io.gfile.glob(FLAGS.input_pattern))
+  else:
+    filenames = _write_synthetic_files(FLAGS.output_dir, FLAGS.num_files,
+                                       FLAGS.file_size_mb, FLAGS.seed)
+  num_mb = sum(tf.io.gfile.stat(f).length for f in filenames) / 2**20
+  logging.info("Benchmarking %d files, %.0f MB.", len(filenames), num_mb)
+
+  results = []
+  for name, dataset_fn in _variants(filenames):
+    if FLAGS.variants and name not in FLAGS.variants:
+      continue
+    ds = dataset_fn()
+    start = time.perf_counter()
+    num_lines = int(ds.reduce(tf.constant(0, tf.int64),
+                              lambda count, _: count + 1))
+    seconds = time.perf_counter() - start
+    checksum = _checksum(dataset_fn()) if FLAGS.check_outputs else None
+    results.append((name, seconds, num_lines, checksum))
+
+  if FLAGS.check_outputs:
+    reference_name, _, _, reference = results[0]
+    for name, _, _, checksum in results[1:]:
+      if checksum != reference:
+        raise ValueError("%s and %s outputs differ." % (reference_name, name))
+
+  baseline = results[0][1]
+  print("%-10s %10s %8s %10s %12s" % (
+      "variant", "seconds", "speedup", "MB/s", "lines/s"))
+  for name, seconds, num_lines, _ in results:
+    print("%-10s %10.2f %7.2fx %10.1f %12.1f" % (
+        name, seconds, baseline / seconds, num_mb / seconds,
+        num_lines / seconds))
+
+
+if __name__ == "__main__":
+  app.run(main)
@@ -31,38 +31,26 @@ from absl import flags
 # from mesh_tensorflow.transformer import utils
 import gin
 import seqio
+from t5.scripts import task_flags  # pylint: disable=unused-import
 
 import tensorflow.compat.v1 as tf
 
 tf.compat.v1.enable_eager_execution()
 
 try:
-  tf.flags.DEFINE_multi_string("gin_file", None, "Path to a Gin file.")
-  tf.flags.DEFINE_multi_string("gin_param", None, "Gin parameter binding.")
   tf.flags.DEFINE_list("gin_location_prefix", [], "Gin file search path.")
 except tf.flags.DuplicateFlagError:
   pass
 
-_DEFAULT_MODULE_IMPORTS = [
-]
-
 _DEFAULT_DELIMITERS = [
 ]
 
 FLAGS = flags.FLAGS
 
-flags.DEFINE_string("task", None, "A registered Task.")
-flags.DEFINE_string("mixture", None, "A registered Mixture.")
 flags.DEFINE_integer("max_examples", -1,
                      "maximum number of examples. -1 for no limit")
 flags.DEFINE_string("format_string", "{inputs}\t{targets}",
                     "format for printing examples")
-flags.DEFINE_multi_string(
-    "module_import", _DEFAULT_MODULE_IMPORTS,
-    "Modules to import. Use this when your Task or is defined outside "
-    "of the T5 codebase so that it is registered.")
-flags.DEFINE_string("split", "train",
-                    "which split of the dataset, e.g. train or validation")
 
 flags.DEFINE_bool("detokenize", False, "If True, then decode ids to strings.")
 
@@ -0,0 +1,140 @@
+# Copyright 2023 The T5 Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+r"""Load tests a local `t5.scripts.serve_hf_model` server.
+
+Sends `--num_requests` prediction requests from `--concurrency` keep-alive
+connections and reports throughput, client-side latency percentiles and the
+server's own metrics.
+
+Example usage:
+python -m t5.scripts.load_test_hf_server \
+    --port=8080 \
+    --num_requests=1000 \
+    --concurrency=32
+"""
+
+import asyncio
+import json
+import random
+import time
+
+from absl import app
+from absl import flags
+import numpy as np
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string("host", "localhost", "Address of the server.")
+flags.DEFINE_integer("port", 8080, "Port of the server.")
+flags.DEFINE_string("unix_socket", None,
+                    "Path of the server's Unix socket, instead of a port.")
+flags.DEFINE_integer("num_requests", 1000, "Total number of requests.")
+flags.DEFINE_integer("concurrency", 32, "Number of concurrent connections.")
+flags.DEFINE_integer("prompts_per_request", 1, "Number of prompts per request.")
+flags.DEFINE_string("prompts_file", None,
+                    "Optional file with one prompt per line. Synthetic "
+                    "prompts of varying length are used if unset.")
+flags.DEFINE_integer("seed", 0, "Seed for sampling prompts.")
+
+
+def _synthetic_prompts(num_prompts, seed):
+  rng = random.Random(seed)
+  words = ["the", "house", "is", "small", "and", "very", "old", "green"]
+  return [
+      "translate English to German: " +
+      " ".join(rng.choices(words, k=rng.randint(2, 60)))
+      for _ in range(num_prompts)
+  ]
+
+
+async def _open_connection():
+  if FLAGS.unix_socket:
+    return await asyncio.open_unix_connection(FLAGS.unix_socket)
+  return await asyncio.open_connection(FLAGS.host, FLAGS.port)
+
+
+async def _request(reader, writer, method, path, body=None):
+  """Sends one HTTP request on a keep-alive connection, returns the JSON."""
+  payload = json.dumps(body).encode("utf-8") if body is not None else b""
+  writer.write(
+      "{} {} HTTP/1.1\r\nHost: {}\r\nContent-Type: application/json\r\n"
+      "Content-Length: {}\r\n\r\n".format(
+          method, path, FLAGS.host, len(payload)).encode("latin-1") + payload)
+  await writer.drain()
+  status = int((await reader.readline()).split()[1])
+  headers = {}
+  while True:
+    line = await reader.readline()
+    if not line.strip():
+      break
+    key, value = line.decode("latin-1").split(":", 1)
+    headers[key.strip().lower()] = value.strip()
+  response = json.loads(
+      await reader.readexactly(int(headers["content-length"])))
+  if status != 200:
+    raise RuntimeError("Request failed with {}: {}".format(status, response))
+  return response
+
+
+async def _worker(requests, latencies):
+  reader, writer = await _open_connection()
+  try:
+    while requests:
+      prompts = requests.pop()
+      start = time.time()
+      await _request(reader, writer, "POST", "/predict", {"inputs": prompts})
+      latencies.append(time.time() - start)
+  finally:
+    writer.close()
+
+
+async def _load_test(prompts):
+  requests = [
+      [prompts[(i * FLAGS.prompts_per_request + j) % len(prompts)]
+       for j in range(FLAGS.prompts_per_request)]
+      for i in range(FLAGS.num_requests)
+  ]
+  latencies = []
+  start = time.time()
+  await asyncio.gather(
+      *[_worker(requests, latencies) for _ in range(FLAGS.concurrency)])
+  elapsed = time.time() - start
+
+  reader, writer = await _open_connection()
+  server_metrics = await _request(reader, writer, "GET", "/metrics")
+  writer.close()
+
+  p50, p99 = np.percentile(latencies, [50, 99])
+  print("requests:          %d" % len(latencies))
+  print("seconds:           %.2f" % elapsed)
+  print("requests/s:        %.2f" % (len(latencies) / elapsed))
+  print("prompts/s:         %.2f" %
+        (len(latencies) * FLAGS.prompts_per_request / elapsed))
+  print("client p50 (ms):   %.1f" % (1000 * p50))
+  print("client p99 (ms):   %.1f" % (1000 * p99))
+  print("server metrics:    %s" % json.dumps(server_metrics, sort_keys=True))
+
+
+def main(_):
+  if FLAGS.prompts_file:
+    with open(FLAGS.prompts_file) as f:
+      prompts = [l.strip() for l in f if l.strip()]
+  else:
+    prompts = _synthetic_prompts(FLAGS.num_requests, FLAGS.seed)
+  asyncio.run(_load_test(prompts))
+
+
+if __name__ == "__main__":
+  app.run(main)
@@ -17,36 +17,62 @@ r"""Parse TensorBoard events files and (optionally) log results to csv.
 
 Note that `--summary_dir` *must* point directly to the directory with .events
 files (e.g. `/validation_eval/`), not a parent directory.
+
+With `--events_index`, parsed events are stored in a local SQLite file so that
+repeated runs only parse records written since the previous run.
+
+To compare several runs, pass a glob of summary directories as `--run_dirs`
+instead of `--summary_dir`. The runs are parsed in parallel and written to a
+single CSV, or Parquet if `--out_file` ends in `.parquet`, with a `run` column.
+
+Example usage:
+python -m t5.scripts.parse_tb \
+    --run_dirs="/path/to/runs/*/validation_eval" \
+    --events_index=/tmp/events_index.db \
+    --out_file=/tmp/runs.csv
 """
 
+import concurrent.futures
 import os
+import time
 
 from absl import app
 from absl import flags
 from absl import logging
+import pandas as pd
 from t5.evaluation import eval_utils
 import tensorflow as tf
 
 FLAGS = flags.FLAGS
 
 flags.DEFINE_string("summary_dir", None, "Where to search for .events files.")
+flags.DEFINE_string("run_dirs", None,
+                    "Glob of summary directories of several runs to parse and "
+                    "aggregate. Mutually exclusive with --summary_dir.")
 flags.DEFINE_string("out_file", None, "Output file to write TSV.")
 flags.DEFINE_bool("perplexity_eval", False,
                   "Indicates if perplexity_eval mode was used for evaluation.")
 flags.DEFINE_bool("seqio_summaries", False, "Whether summaries are generated "
                   "from SeqIO Evaluator.")
+flags.DEFINE_string("events_index", None,
+                    "Optional local SQLite file used to index parsed events "
+                    "across runs.")
+flags.DEFINE_integer("num_workers", None,
+                     "Number of threads used to parse events files.")
 
 
-def main(_):
+def parse_summary_dir(summary_dir, index=None, num_workers=None):
+  """Returns the scores found in `summary_dir`, keyed by TensorBoard tag."""
   if FLAGS.seqio_summaries:
-    subdirs = tf.io.gfile.listdir(FLAGS.summary_dir)
-    summary_dirs = [os.path.join(FLAGS.summary_dir, d) for d in subdirs]
+    subdirs = tf.io.gfile.listdir(summary_dir)
+    summary_dirs = [os.path.join(summary_dir, d) for d in subdirs]
   else:
-    summary_dirs = [FLAGS.summary_dir]
+    summary_dirs = [summary_dir]
 
   scores = None
   for d in summary_dirs:
-    events = eval_utils.parse_events_files(d, FLAGS.seqio_summaries)
+    events = eval_utils.parse_events_files(
+        d, FLAGS.seqio_summaries, index=index, num_workers=num_workers)
     if FLAGS.perplexity_eval:
       task_metrics = events
     else:
@@ -57,6 +83,64 @@ def main(_):
       scores.update(task_metrics)
     else:
       scores = task_metrics
+  return scores
+
+
+def aggregate_runs(run_dirs, index=None, num_workers=None):
+  """Parses `run_dirs` in parallel into one DataFrame indexed by run/step."""
+  with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as pool:
+    run_scores = list(pool.map(
+        lambda d: parse_summary_dir(d, index=index, num_workers=1), run_dirs))
+
+  run_dfs = {}
+  for run_dir, scores in zip(run_dirs, run_scores):
+    if not scores:
+      logging.info("No evaluation events found in %s", run_dir)
+      continue
+    run_dfs[run_dir] = eval_utils.scores_to_df(scores)
+  if not run_dfs:
+    return None
+  df = pd.concat(run_dfs, names=["run"])
+  df = eval_utils.compute_avg_glue(df)
+  return eval_utils.sort_columns(df)
+
+
+def main(_):
+  if bool(FLAGS.summary_dir) == bool(FLAGS.run_dirs):
+    raise ValueError("Exactly one of --summary_dir and --run_dirs must be set.")
+
+  start = time.time()
+  index = None
+  if FLAGS.events_index:
+    index = eval_utils.EventsIndex(FLAGS.events_index)
+
+  if FLAGS.run_dirs:
+    run_dirs = sorted(tf.io.gfile.glob(FLAGS.run_dirs))
+    df = aggregate_runs(run_dirs, index=index, num_workers=FLAGS.num_workers)
+    if index is not None:
+      index.close()
+    logging.info("Parsed %d runs in %.2f seconds.", len(run_dirs),
+                 time.time() - start)
+    if df is None:
+      logging.info("No evaluation events found in %s", FLAGS.run_dirs)
+      return
+    metric_max, metric_max_step = eval_utils.metric_group_max_per_run(df)
+    logging.info("Max value per run:\n%s", metric_max.to_string())
+    logging.info("Step of max value per run:\n%s", metric_max_step.to_string())
+    if FLAGS.out_file:
+      if FLAGS.out_file.endswith(".parquet"):
+        with tf.io.gfile.GFile(FLAGS.out_file, "wb") as f:
+          f.write(df.reset_index().to_parquet())
+      else:
+        with tf.io.gfile.GFile(FLAGS.out_file, "w") as f:
+          f.write(df.to_csv(float_format="%.3f"))
+    logging.info("Finished in %.2f seconds.", time.time() - start)
+    return
+
+  scores = parse_summary_dir(
+      FLAGS.summary_dir, index=index, num_workers=FLAGS.num_workers)
+  if index is not None:
+    index.close()
 
   if not scores:
     logging.info("No evaluation events found in %s", FLAGS.summary_dir)
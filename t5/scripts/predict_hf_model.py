@@ -0,0 +1,93 @@
+# Copyright 2023 The T5 Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+r"""Runs sharded multi-process CPU inference with a Hugging Face T5 model.
+
+The inputs, either lines of `--input_file` or the pretokenized inputs of
+`--mixture_or_task` `--split`, are split round-robin into `--num_shards`
+shards, each predicted by a worker process with `--num_threads_per_shard`
+PyTorch threads. Predictions are written to `--output_file` in input order,
+and the aggregate throughput is logged. Rerunning an interrupted command
+resumes each shard where it stopped.
+
+Example usage:
+python -m t5.scripts.predict_hf_model \
+    --model_spec=t5-small \
+    --model_dir=/tmp/hft5 \
+    --mixture_or_task=glue_cola_v002 \
+    --split=validation \
+    --output_file=/tmp/cola_predictions.txt \
+    --num_shards=8
+"""
+
+from absl import app
+from absl import flags
+from absl import logging
+import t5.data.mixtures  # pylint:disable=unused-import
+from t5.models import hf_batch_inference
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string("model_spec", "t5-small",
+                    "Pretrained model name or path to load.")
+flags.DEFINE_string("model_dir", None, "Directory with model checkpoints.")
+flags.DEFINE_integer("checkpoint_step", None,
+                     "Checkpoint step to load, defaults to the latest.")
+flags.DEFINE_string("input_file", None, "Text file with one input per line.")
+flags.DEFINE_string("mixture_or_task", None,
+                    "Task or Mixture to predict instead of `--input_file`.")
+flags.DEFINE_string("split", "validation", "Split of `--mixture_or_task`.")
+flags.DEFINE_string("output_file", None, "File to write predictions to.")
+flags.DEFINE_integer("num_shards", None,
+                     "Number of worker processes, defaults to the number of "
+                     "CPUs divided by `--num_threads_per_shard`.")
+flags.DEFINE_integer("num_threads_per_shard", None,
+                     "PyTorch threads per worker, defaults to the number of "
+                     "CPUs divided by `--num_shards`.")
+flags.DEFINE_integer("max_input_length", 512,
+                     "Inputs are truncated to this many tokens.")
+flags.DEFINE_integer("max_decode_length", 128,
+                     "Maximum length of generated predictions.")
+flags.DEFINE_integer("batch_size", 32, "Number of inputs per batch.")
+flags.DEFINE_bool("keep_shards", False,
+                  "Whether to keep the shard outputs after merging them.")
+
+
+def main(_):
+  if bool(FLAGS.input_file) == bool(FLAGS.mixture_or_task):
+    raise app.UsageError(
+        "Exactly one of --input_file and --mixture_or_task must be set.")
+  input_file = FLAGS.input_file
+  if FLAGS.mixture_or_task:
+    input_file = FLAGS.output_file + ".inputs"
+    num_inputs = hf_batch_inference.write_task_inputs(
+        FLAGS.mixture_or_task, FLAGS.split, input_file)
+    logging.info("Wrote %d inputs to %s.", num_inputs, input_file)
+
+  stats = hf_batch_inference.predict_sharded(
+      FLAGS.model_spec, FLAGS.model_dir, input_file, FLAGS.output_file,
+      sequence_length={"inputs": FLAGS.max_input_length},
+      batch_size=FLAGS.batch_size,
+      num_shards=FLAGS.num_shards,
+      num_threads_per_shard=FLAGS.num_threads_per_shard,
+      checkpoint_step=FLAGS.checkpoint_step,
+      remove_shards=not FLAGS.keep_shards,
+      max_length=FLAGS.max_decode_length)
+  print("predictions: %d, seconds: %.1f, predictions/sec: %.1f" % (
+      stats["predictions"], stats["seconds"], stats["predictions_per_sec"]))
+
+
+if __name__ == "__main__":
+  flags.mark_flags_as_required(["model_dir", "output_file"])
+  app.run(main)
@@ -0,0 +1,253 @@
+# Copyright 2023 The T5 Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+r"""Profiles the preprocessing chain of a task stage by stage.
+
+The chain of each task is rebuilt one preprocessor at a time, the way
+`seqio.Task.get_dataset` applies it: preprocessors before the cache
+placeholder get no sequence length, those after it do, and the outputs are
+finally trimmed to the sequence length.
+
+The first `--num_examples` source examples are read once, which is timed as
+the `source` stage, and kept in memory. Each following stage then runs the
+chain up to and including it over the in-memory examples, after a warmup
+pass over `--warmup_examples` of them. Each stage reports the elements and
+bytes it outputs per second, and its marginal seconds, i.e. the seconds it
+adds to the previous stage. Every pipeline is built with the same map seed,
+so that all stages see the same random choices.
+
+With `--synthetic_features`, the source is replaced by in-memory examples
+with the given features, so that tasks can be profiled offline. Features are
+given as `name` for text of random words or `name:int64` for a random
+integer.
+
+Example usage:
+python -m t5.scripts.profile_task \
+    --task=c4_v220_span_corruption \
+    --synthetic_features=text \
+    --num_examples=2000 \
+    --output_json=/tmp/profile.json
+"""
+
+import functools
+import importlib
+import json
+import random
+import time
+
+from absl import app
+from absl import flags
+from absl import logging
+import gin
+import seqio
+from t5.scripts import task_flags  # pylint: disable=unused-import
+import tensorflow.compat.v2 as tf
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_integer("sequence_length", 512,
+                     "Sequence length of every output feature.")
+flags.DEFINE_integer("num_examples", 1000,
+                     "Number of source examples run through each stage.")
+flags.DEFINE_integer("warmup_examples", 100,
+                     "Number of source examples run through each stage "
+                     "before it is timed.")
+flags.DEFINE_integer("seed", 0, "Seed for map seeds and synthetic data.")
+flags.DEFINE_list("synthetic_features", None,
+                  "Features of synthetic source examples, e.g. "
+                  "`inputs,targets` or `text,label:int64`, instead of reading "
+                  "the task source.")
+flags.DEFINE_integer("synthetic_words", 200,
+                     "Average number of words of synthetic text features.")
+flags.DEFINE_string("output_json", None,
+                    "Path to write the stage results to as JSON.")
+
+
+def synthetic_source(features, num_examples, num_words=200, seed=0):
+  """Returns an in-memory dataset of random examples.
+
+  Args:
+    features: list of str, `name` for a text feature of random words or
+      `name:int64` for a random integer feature.
+    num_examples: int, the number of examples.
+    num_words: int, the average number of words of text features.
+    seed: int, the seed of the examples.
+
+  Returns:
+    a tf.data.Dataset of dicts.
+  """
+  rng = random.Random(seed)
+  vocab = ["w%d" % i for i in range(20000)]
+  columns = {}
+  for feature in features:
+    name, _, dtype = feature.partition(":")
+    if dtype == "int64":
+      columns[name] = [rng.randint(0, 1) for _ in range(num_examples)]
+    elif not dtype:
+      columns[name] = [
+          " ".join(rng.choices(vocab, k=rng.randint(1, 2 * num_words)))
+          for _ in range(num_examples)
+      ]
+    else:
+      raise ValueError("Unsupported synthetic feature type: %s" % feature)
+  return tf.data.Dataset.from_tensor_slices(columns)
+
+
+def _stage_name(fn):
+  while isinstance(fn, functools.partial):
+    fn = fn.func
+  return getattr(fn, "__name__", type(fn).__name__)
+
+
+def _stages(task, sequence_length):
+  """Returns the (name, dataset_fn) stages of the task's preprocessing."""
+  stages = []
+  stage_sequence_length = None
+  for prep_fn in task.preprocessors:
+    if isinstance(prep_fn, seqio.CacheDatasetPlaceholder):
+      # Only the preprocessors after the cache get the sequence length.
+      stage_sequence_length = sequence_length
+      continue
+    stages.append((_stage_name(prep_fn), seqio.utils.add_kwargs_to_transform(
+        prep_fn, sequence_length=stage_sequence_length,
+        output_features=task.output_features)))
+  stages.append(("trim_output_features", functools.partial(
+      seqio.utils.trim_dataset, sequence_length=sequence_length,
+      output_features=task.output_features)))
+  return stages
+
+
+def _num_bytes(element):
+  """Returns the number of bytes of the tensors of an element."""
+  num_bytes = tf.constant(0, tf.int64)
+  for t in tf.nest.flatten(element, expand_composites=True):
+    if t.dtype == tf.string:
+      n = tf.reduce_sum(tf.cast(tf.strings.length(t), tf.int64))
+    else:
+      n = tf.size(t, out_type=tf.int64) * t.dtype.size
+    num_bytes += n
+  return num_bytes
+
+
+def _run(dataset):
+  """Returns the (elements, bytes, seconds) of iterating over `dataset`."""
+  start = time.perf_counter()
+  num_elements, num_bytes = dataset.reduce(
+      (tf.constant(0, tf.int64), tf.constant(0, tf.int64)),
+      lambda state, ex: (state[0] + 1, state[1] + _num_bytes(ex)))
+  return int(num_elements), int(num_bytes), time.perf_counter() - start
+
+
+def profile_task(task, split, sequence_length, num_examples,
+                 warmup_examples=100, seed=0, source_dataset=None):
+  """Measures the throughput after each stage of a task's preprocessing.
+
+  Args:
+    task: a seqio.Task.
+    split: str, the split to read from the task source.
+    sequence_length: dict mapping feature key to int length.
+    num_examples: int, the number of source examples run through each stage.
+    warmup_examples: int, the number of source examples run through each
+      stage before it is timed.
+    seed: int, the map seed of every stage.
+    source_dataset: a tf.data.Dataset to use instead of the task source.
+
+  Returns:
+    a list with a dict of results for each stage, starting with the source.
+  """
+  if source_dataset is None:
+    source_dataset = task.source.get_dataset(
+        split=split, shuffle=False, seed=seed)
+  cached = source_dataset.take(num_examples).cache()
+  num_elements, num_bytes, seconds = _run(cached)
+  results = [{
+      "task": task.name,
+      "stage": "source",
+      "elements": num_elements,
+      "bytes": num_bytes,
+      "seconds": seconds,
+      "marginal_seconds": seconds,
+  }]
+  # The preprocessors are timed over the in-memory source examples.
+  _, _, previous_seconds = _run(cached)
+
+  stages = _stages(task, sequence_length)
+  for i, (name, _) in enumerate(stages):
+
+    def build(ds, num_stages=i + 1):
+      with seqio.utils.map_seed_manager(seed):
+        for _, stage_fn in stages[:num_stages]:
+          ds = stage_fn(ds)
+      return ds
+
+    _run(build(cached.take(warmup_examples)))
+    num_elements, num_bytes, seconds = _run(build(cached))
+    results.append({
+        "task": task.name,
+        "stage": name,
+        "elements": num_elements,
+        "bytes": num_bytes,
+        "seconds": seconds,
+        "marginal_seconds": seconds - previous_seconds,
+    })
+    previous_seconds = seconds
+  for r in results:
+    r["elements_per_sec"] = r["elements"] / max(r["seconds"], 1e-9)
+    r["bytes_per_sec"] = r["bytes"] / max(r["seconds"], 1e-9)
+  return results
+
+
+def main(_):
+  for module in FLAGS.module_import:
+    importlib.import_module(module)
+  gin.parse_config_files_and_bindings(FLAGS.gin_file, FLAGS.gin_param)
+
+  if FLAGS.task:
+    tasks = [seqio.TaskRegistry.get(FLAGS.task)]
+  elif FLAGS.mixture:
+    tasks = seqio.MixtureRegistry.get(FLAGS.mixture).tasks
+  else:
+    raise app.UsageError("One of --task or --mixture is required.")
+
+  results = []
+  for task in tasks:
+    sequence_length = {k: FLAGS.sequence_length for k in task.output_features}
+    source_dataset = None
+    if FLAGS.synthetic_features:
+      source_dataset = synthetic_source(
+          FLAGS.synthetic_features, FLAGS.num_examples,
+          num_words=FLAGS.synthetic_words, seed=FLAGS.seed)
+    logging.info("Profiling %s on %d examples.", task.name,
+                 FLAGS.num_examples)
+    results.extend(profile_task(
+        task, FLAGS.split, sequence_length, FLAGS.num_examples,
+        warmup_examples=FLAGS.warmup_examples, seed=FLAGS.seed,
+        source_dataset=source_dataset))
+
+  if FLAGS.output_json:
+    with tf.io.gfile.GFile(FLAGS.output_json, "w") as f:
+      json.dump(results, f, indent=2)
+
+  print("%-30s %-30s %10s %10s %12s %12s %10s" % (
+      "task", "stage", "elements", "seconds", "elements/s", "MB/s",
+      "marginal"))
+  for r in results:
+    print("%-30s %-30s %10d %10.2f %12.1f %12.2f %10.2f" % (
+        r["task"], r["stage"], r["elements"], r["seconds"],
+        r["elements_per_sec"], r["bytes_per_sec"] / 2**20,
+        r["marginal_seconds"]))
+
+
+if __name__ == "__main__":
+  app.run(main)
@@ -0,0 +1,99 @@
+# Copyright 2023 The T5 Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for profile_task."""
+
+import functools
+import json
+import os
+from unittest import mock
+
+from absl.testing import flagsaver
+import seqio
+from seqio import test_utils
+from t5.data import preprocessors
+from t5.scripts import profile_task
+import tensorflow as tf
+
+
+def _get_task():
+  vocab = test_utils.sentencepiece_vocab()
+  return seqio.Task(
+      "profile_test_task",
+      source=seqio.FunctionDataSource(
+          test_utils.get_fake_dataset, splits=["train"]),
+      preprocessors=[
+          functools.partial(
+              preprocessors.rekey,
+              key_map={"inputs": None, "targets": "suffix"}),
+          seqio.preprocessors.tokenize,
+          seqio.CacheDatasetPlaceholder(),
+          preprocessors.span_corruption,
+          seqio.preprocessors.append_eos_after_trim,
+      ],
+      output_features={
+          "inputs": seqio.Feature(vocab),
+          "targets": seqio.Feature(vocab),
+      },
+      metric_fns=[])
+
+
+class ProfileTaskTest(tf.test.TestCase):
+
+  def test_profile_task(self):
+    results = profile_task.profile_task(
+        _get_task(), "train", {"inputs": 16, "targets": 8}, num_examples=100,
+        warmup_examples=2)
+    self.assertEqual([r["stage"] for r in results], [
+        "source", "rekey", "tokenize", "span_corruption",
+        "append_eos_after_trim", "trim_output_features"
+    ])
+    # The fake dataset has 3 train examples.
+    self.assertEqual(results[0]["elements"], 3)
+    for r in results:
+      self.assertEqual(r["task"], "profile_test_task")
+      self.assertGreater(r["elements"], 0)
+      self.assertGreater(r["bytes"], 0)
+      self.assertGreater(r["elements_per_sec"], 0)
+
+  def test_synthetic_source(self):
+    ds = profile_task.synthetic_source(
+        ["text", "label:int64"], num_examples=5, num_words=3)
+    examples = list(ds.as_numpy_iterator())
+    self.assertLen(examples, 5)
+    for ex in examples:
+      self.assertBetween(len(ex["text"].split()), 1, 6)
+      self.assertIn(ex["label"], (0, 1))
+    with self.assertRaisesRegex(ValueError, "Unsupported synthetic feature"):
+      profile_task.synthetic_source(["text:float"], num_examples=1)
+
+  def test_main(self):
+    output_json = os.path.join(self.get_temp_dir(), "profile.json")
+    self.enter_context(
+        mock.patch.object(seqio.TaskRegistry, "get", return_value=_get_task()))
+    with flagsaver.flagsaver(
+        task="profile_test_task", mixture=None, module_import=[],
+        gin_file=None, gin_param=None, synthetic_features=["suffix"],
+        num_examples=20, warmup_examples=2, sequence_length=32,
+        output_json=output_json):
+      profile_task.main(None)
+    seqio.TaskRegistry.get.assert_called_once_with("profile_test_task")
+    with tf.io.gfile.GFile(output_json) as f:
+      results = json.load(f)
+    self.assertLen(results, 6)
+    self.assertEqual(results[0]["elements"], 20)
+
+
+if __name__ == "__main__":
+  tf.test.main()
@@ -0,0 +1,77 @@
+# Copyright 2023 The T5 Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+r"""Serves predictions from a Hugging Face PyTorch T5 model over HTTP.
+
+Prompts from concurrent requests are grouped by length into batches of at most
+`--max_batch_tokens` padded input tokens, or run once the oldest has waited
+`--max_wait_ms`. See `t5.models.hf_server` for the endpoints.
+
+Example usage:
+python -m t5.scripts.serve_hf_model \
+    --model_spec=t5-small \
+    --model_dir=/tmp/hft5 \
+    --port=8080
+
+curl -d '{"inputs": ["translate English to German: Hello."]}' \
+    localhost:8080/predict
+"""
+
+import asyncio
+
+from absl import app
+from absl import flags
+import t5.models
+from t5.models import hf_server
+import torch
+
+FLAGS = flags.FLAGS
+
+flags.DEFINE_string("model_spec", "t5-small",
+                    "Pretrained model name or path to load.")
+flags.DEFINE_string("model_dir", None, "Directory with model checkpoints.")
+flags.DEFINE_string("host", "localhost", "Address to listen on.")
+flags.DEFINE_integer("port", 8080, "Port to listen on.")
+flags.DEFINE_string("unix_socket", None,
+                    "Path of a Unix socket to listen on instead of a port.")
+flags.DEFINE_integer("max_input_length", 512,
+                     "Prompts are truncated to this many tokens.")
+flags.DEFINE_integer("max_decode_length", 128,
+                     "Maximum length of generated predictions.")
+flags.DEFINE_integer("max_batch_tokens", 8192,
+                     "Maximum number of padded input tokens per batch.")
+flags.DEFINE_integer("max_batch_size", 64, "Maximum number of prompts per "
+                     "batch.")
+flags.DEFINE_float("max_wait_ms", 10,
+                   "Maximum time a prompt waits for others to be batched "
+                   "with.")
+
+
+def main(_):
+  device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+  model = t5.models.HfPyTorchModel(FLAGS.model_spec, FLAGS.model_dir, device)
+  batcher = hf_server.DynamicBatcher(
+      hf_server.make_generate_fn(model, max_length=FLAGS.max_decode_length),
+      max_batch_tokens=FLAGS.max_batch_tokens,
+      max_batch_size=FLAGS.max_batch_size,
+      max_wait_secs=FLAGS.max_wait_ms / 1000)
+  server = hf_server.InferenceServer(
+      batcher, hf_server.make_encode_fn(FLAGS.max_input_length))
+  asyncio.run(server.serve(
+      host=FLAGS.host, port=FLAGS.port, unix_socket=FLAGS.unix_socket))
+
+
+if __name__ == "__main__":
+  flags.mark_flags_as_required(["model_dir"])
+  app.run(main)
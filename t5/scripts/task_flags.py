@@ -0,0 +1,42 @@
+# Copyright 2023 The T5 Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Flags shared by the scripts that load a registered Task or Mixture.
+
+Importing this module defines the flags, so that scripts such as `dump_task`
+and `profile_task` can be imported together.
+"""
+
+from absl import flags
+
+# Registers the T5 Tasks and Mixtures.
+DEFAULT_MODULE_IMPORTS = [
+    "t5.data.mixtures",
+]
+
+flags.DEFINE_string("task", None, "A registered Task.")
+flags.DEFINE_string("mixture", None, "A registered Mixture.")
+flags.DEFINE_multi_string(
+    "module_import", DEFAULT_MODULE_IMPORTS,
+    "Modules to import. Use this when your Task or Mixture is defined outside "
+    "of the T5 codebase so that it is registered.")
+flags.DEFINE_string("split", "train",
+                    "which split of the dataset, e.g. train or validation")
+
+# The Gin flags may also be defined by other libraries.
+try:
+  flags.DEFINE_multi_string("gin_file", None, "Path to a Gin file.")
+  flags.DEFINE_multi_string("gin_param", None, "Gin parameter binding.")
+except flags.DuplicateFlagError:
+  pass
@@ -35,10 +35,19 @@ them directly instead of looking for the latest checkpoint.
 
 The global step of the output checkpoint is set to either the value of the
 global_step flag (if nonzero) or the global step in the first input checkpoint.
+
+Variables are transformed one at a time, reading each from all the input
+checkpoints, so that at most one copy of a variable per input is in memory.
+Averages are accumulated in `--accumulator_dtype`. The transformed variables
+are grouped into shards of about `--max_shard_bytes`, which are written by
+`--num_workers` threads directly as checkpoint files, without building a graph.
 """
 
+import concurrent.futures
 import os
 import re
+import threading
+
 from absl import app
 from absl import flags
 from absl import logging
@@ -66,12 +75,160 @@ flags.DEFINE_integer(
 flags.DEFINE_integer("number_of_checkpoints", 4,
                      "number of last checkpoints for 'average_last_n'")
 
+flags.DEFINE_enum("accumulator_dtype", "float64", ["float64", "float32"],
+                  "dtype of the running sums when averaging")
+flags.DEFINE_integer("num_workers", 4,
+                     "number of output shards transformed in parallel")
+flags.DEFINE_integer("max_shard_bytes", 2**30,
+                     "approximate size of each output checkpoint shard")
+
+
+def average_tensors(tensors, accumulator_dtype=np.float64):
+  """Returns the mean of an iterable of same-shaped arrays.
+
+  Only a running sum and the current array are held in memory, so `tensors`
+  can be a generator reading each array when needed.
+
+  Args:
+    tensors: iterable of np.ndarray.
+    accumulator_dtype: dtype of the running sum.
+
+  Returns:
+    np.ndarray with the dtype of the first array.
+  """
+  result = None
+  count = 0
+  for t in tensors:
+    if result is None:
+      dtype = t.dtype
+      result = t.astype(accumulator_dtype)
+    else:
+      result += t
+    count += 1
+  result /= count
+  if np.issubdtype(dtype, np.integer):
+    result = np.round(result)
+  return result.astype(dtype)
+
+
+def _transformed_size(shape, dtype, operation, num_checkpoints,
+                      autoensemble_size):
+  """Returns the number of bytes of a transformed variable."""
+  size = int(np.prod(shape, dtype=np.int64)) * dtype.size
+  if operation == "ensemble":
+    return size * num_checkpoints
+  elif operation == "autoensemble":
+    return size * autoensemble_size
+  elif operation == "extract_first" and shape:
+    return size // shape[0]
+  return size
+
+
+def _shard_variables(names, sizes, max_shard_bytes):
+  """Groups variable names into consecutive shards of at most max bytes."""
+  shards = []
+  shard = []
+  shard_bytes = 0
+  for name in names:
+    if shard and shard_bytes + sizes[name] > max_shard_bytes:
+      shards.append(shard)
+      shard = []
+      shard_bytes = 0
+    shard.append(name)
+    shard_bytes += sizes[name]
+  if shard:
+    shards.append(shard)
+  return shards
+
+
+def transform_checkpoints(checkpoints,
+                          output_dir,
+                          operation,
+                          global_step=0,
+                          autoensemble_size=4,
+                          accumulator_dtype=np.float64,
+                          num_workers=4,
+                          max_shard_bytes=2**30):
+  """Transforms checkpoints into a new checkpoint in `output_dir`.
+
+  Args:
+    checkpoints: list of str, checkpoint prefixes to read.
+    output_dir: str, directory to write the new checkpoint to.
+    operation: str, one of the operations listed in the module docstring.
+    global_step: int, global step of the new checkpoint, or 0 to use the
+      global step of the first checkpoint.
+    autoensemble_size: int, ensemble size for "autoensemble".
+    accumulator_dtype: dtype of the running sums when averaging.
+    num_workers: int, number of output shards transformed in parallel.
+    max_shard_bytes: int, approximate size of each output shard. Memory use
+      is about `num_workers` times this, plus one input variable per worker.
+
+  Returns:
+    The prefix of the written checkpoint.
+  """
+  first_reader = tf.train.load_checkpoint(checkpoints[0])
+  var_shapes = first_reader.get_variable_to_shape_map()
+  var_dtypes = first_reader.get_variable_to_dtype_map()
+  for checkpoint in checkpoints[1:]:
+    dtypes = tf.train.load_checkpoint(checkpoint).get_variable_to_dtype_map()
+    for name, dtype in var_dtypes.items():
+      if dtypes.get(name) != dtype:
+        raise ValueError("Variable %s of %s has dtype %s instead of %s." %
+                         (name, checkpoint, dtypes.get(name), dtype))
+  if not global_step and "global_step" in var_shapes:
+    global_step = int(first_reader.get_tensor("global_step"))
+
+  names = sorted(var_shapes)
+  sizes = {
+      name: _transformed_size(var_shapes[name], var_dtypes[name], operation,
+                              len(checkpoints), autoensemble_size)
+      for name in names}
+  shards = _shard_variables(names, sizes, max_shard_bytes)
+  output_path = os.path.join(output_dir, "model.ckpt-" + str(global_step))
+  temp_dir = output_path + "_temp"
+  shard_prefixes = [os.path.join(temp_dir, "part-%05d-of-%05d" %
+                                 (i, len(shards))) for i in range(len(shards))]
+  logging.info("Writing %d variables in %d shards to %s", len(names),
+               len(shards), output_path)
+
+  # Checkpoint readers are not shared between threads.
+  local = threading.local()
+
+  def readers():
+    if not hasattr(local, "readers"):
+      local.readers = [tf.train.load_checkpoint(c) for c in checkpoints]
+    return local.readers
+
+  def transform(name):
+    dtype = var_dtypes[name].as_numpy_dtype
+    if name == "global_step":
+      return np.array(global_step, dtype=dtype)
+    tensors = (r.get_tensor(name) for r in readers())
+    if operation == "ensemble":
+      return np.stack(list(tensors))
+    elif operation == "autoensemble":
+      return np.stack([next(tensors)] * autoensemble_size)
+    elif operation in ("average", "average_last_n"):
+      return average_tensors(tensors, accumulator_dtype)
+    elif operation == "extract_first":
+      return next(tensors)[0]
+    else:
+      raise ValueError("unknown operation=%s" % operation)
 
-def average_tensors(tensors):
-  result = tensors[0]
-  for t in tensors[1:]:
-    result += t
-  return result / len(tensors)
+  def write_shard(shard, prefix):
+    tensors = [transform(name) for name in shard]
+    tf.raw_ops.SaveV2(
+        prefix=prefix, tensor_names=shard, shape_and_slices=[""] * len(shard),
+        tensors=tensors)
+    logging.info("Wrote %d variables to %s", len(shard), prefix)
+
+  with concurrent.futures.ThreadPoolExecutor(num_workers) as executor:
+    list(executor.map(write_shard, shards, shard_prefixes))
+  tf.raw_ops.MergeV2Checkpoints(
+      checkpoint_prefixes=shard_prefixes, destination_prefix=output_path,
+      delete_old_dirs=True)
+  tf.train.update_checkpoint_state(output_dir, output_path)
+  return output_path
 
 
 def main(_):
@@ -116,76 +273,16 @@ def main(_):
       raise ValueError(
           "operation %s requires exactly one checkpoint" % FLAGS.operation)
 
-  var_values = {}
-  var_dtypes = {}
-
-  for i in range(0, len(checkpoints)):
-    checkpoint = checkpoints[i]
-    logging.info("loading checkpoint %s", checkpoint)
-    reader = tf.train.load_checkpoint(checkpoint)
-    var_list = tf.train.list_variables(checkpoint)
-    for (name, _) in var_list:
-      if i:
-        assert name in var_values
-        tensor = reader.get_tensor(name)
-        assert tensor.dtype == var_dtypes[name]
-        var_values[name].append(tensor)
-      else:
-        tensor = reader.get_tensor(name)
-        var_dtypes[name] = tensor.dtype
-        var_values[name] = [tensor]
-        if not FLAGS.global_step:
-          if name == "global_step":
-            FLAGS.global_step = tensor
-
-    logging.info("Read from checkpoint %s", checkpoint)
-
-  new_var_values = {}
-
-  # stack the list of tensors along the 0th dimension.
-  for name, tensors in var_values.items():
-    tensor = tensors[0]
-    if name == "global_step":
-      new_val = np.int32(FLAGS.global_step)
-    elif FLAGS.operation == "ensemble":
-      new_val = np.stack(tensors)
-    elif FLAGS.operation == "autoensemble":
-      new_val = np.stack([tensor] * FLAGS.autoensemble_size)
-    elif FLAGS.operation == "average" or FLAGS.operation == "average_last_n":
-      new_val = average_tensors(tensors)
-    elif FLAGS.operation == "extract_first":
-      new_val = tensor[0]
-    else:
-      raise ValueError("unknown FLAGS.operation=%s" % FLAGS.operation)
-    new_var_values[name] = new_val
-
-  var_values = new_var_values
-
-  with tf.variable_scope(tf.get_variable_scope(), reuse=tf.AUTO_REUSE):
-    tf_vars = [
-        tf.get_variable(v, shape=var_values[v].shape, dtype=var_dtypes[v])
-        for v in var_values
-    ]
-
-  placeholders = [tf.placeholder(v.dtype, shape=v.shape) for v in tf_vars]
-  assign_ops = [tf.assign(v, p) for (v, p) in zip(tf_vars, placeholders)]
-  saver = tf.train.Saver(tf.all_variables())
-
-  output_file = "model.ckpt-" + str(FLAGS.global_step)
-  output_path = os.path.join(FLAGS.output_dir, output_file)
-
-  # Build a model consisting only of variables, set them to the average values.
-  with tf.Session() as sess:
-    sess.run(tf.global_variables_initializer())
-    for p, assign_op, (name, value) in zip(
-        placeholders, assign_ops, var_values.items()):
-      sess.run(assign_op, {p: value})
-    # Use the built saver to save the averaged checkpoint.
-    saver.save(sess, output_path)
+  output_path = transform_checkpoints(
+      checkpoints, FLAGS.output_dir, FLAGS.operation,
+      global_step=FLAGS.global_step,
+      autoensemble_size=FLAGS.autoensemble_size,
+      accumulator_dtype=np.dtype(FLAGS.accumulator_dtype),
+      num_workers=FLAGS.num_workers,
+      max_shard_bytes=FLAGS.max_shard_bytes)
 
   logging.info("Transformed checkpoints saved in %s", output_path)
 
 
 if __name__ == "__main__":
-  tf.disable_v2_behavior()
   app.run(main)
@@ -0,0 +1,101 @@
+# Copyright 2023 The T5 Authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for transform_checkpoints."""
+
+import os
+
+from absl.testing import absltest
+import numpy as np
+from t5.scripts import transform_checkpoints
+import tensorflow.compat.v1 as tf
+
+
+class TransformCheckpointsTest(absltest.TestCase):
+
+  def setUp(self):
+    super().setUp()
+    self.model_dir = self.create_tempdir().full_path
+    self.checkpoints = []
+    self.values = []
+    rng = np.random.RandomState(0)
+    for step in (100, 200, 300):
+      values = {
+          "global_step": np.int64(step),
+          "dense/kernel": rng.randn(4, 3).astype(np.float32),
+          "embedding": rng.randn(8, 2).astype(tf.bfloat16.as_numpy_dtype),
+          "counter": np.arange(3, dtype=np.int32) * step,
+      }
+      prefix = os.path.join(self.model_dir, "model.ckpt-%d" % step)
+      tf.raw_ops.SaveV2(
+          prefix=prefix, tensor_names=list(values),
+          shape_and_slices=[""] * len(values), tensors=list(values.values()))
+      self.checkpoints.append(prefix)
+      self.values.append(values)
+
+  def _transform(self, operation, checkpoints=None, **kwargs):
+    output_dir = self.create_tempdir().full_path
+    # A tiny shard size puts every variable in its own shard.
+    output_path = transform_checkpoints.transform_checkpoints(
+        checkpoints or self.checkpoints, output_dir, operation,
+        max_shard_bytes=1, **kwargs)
+    self.assertEqual(tf.train.latest_checkpoint(output_dir), output_path)
+    reader = tf.train.load_checkpoint(output_path)
+    return output_path, {
+        name: reader.get_tensor(name)
+        for name in reader.get_variable_to_shape_map()}
+
+  def test_average(self):
+    output_path, values = self._transform("average")
+    self.assertEqual(os.path.basename(output_path), "model.ckpt-100")
+    self.assertEqual(values["global_step"], 100)
+    self.assertEqual(values["global_step"].dtype, np.int64)
+    np.testing.assert_allclose(
+        values["dense/kernel"],
+        np.mean([v["dense/kernel"] for v in self.values], axis=0), rtol=1e-6)
+    self.assertEqual(values["embedding"].dtype, tf.bfloat16.as_numpy_dtype)
+    np.testing.assert_allclose(
+        values["embedding"].astype(np.float32),
+        np.mean([v["embedding"].astype(np.float32) for v in self.values],
+                axis=0), rtol=1e-2)
+    np.testing.assert_array_equal(values["counter"], [0, 200, 400])
+
+  def test_average_global_step(self):
+    output_path, values = self._transform("average", global_step=7)
+    self.assertEqual(os.path.basename(output_path), "model.ckpt-7")
+    self.assertEqual(values["global_step"], 7)
+
+  def test_ensemble(self):
+    _, values = self._transform("ensemble")
+    np.testing.assert_array_equal(
+        values["dense/kernel"],
+        np.stack([v["dense/kernel"] for v in self.values]))
+
+  def test_autoensemble_and_extract_first(self):
+    output_path, values = self._transform(
+        "autoensemble", self.checkpoints[1:2], autoensemble_size=2)
+    self.assertEqual(values["dense/kernel"].shape, (2, 4, 3))
+    _, values = self._transform("extract_first", [output_path])
+    np.testing.assert_array_equal(
+        values["dense/kernel"], self.values[1]["dense/kernel"])
+
+  def test_average_tensors(self):
+    tensors = [np.full([2], x, np.float32) for x in (1e8, 1, 1)]
+    np.testing.assert_array_equal(
+        transform_checkpoints.average_tensors(iter(tensors)),
+        np.full([2], (1e8 + 2) / 3, np.float32))
+
+
+if __name__ == "__main__":
+  absltest.main()